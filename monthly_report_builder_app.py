@@ -1,8 +1,16 @@
-import io, os, re, json, datetime, base64
+import io, os, re, json, datetime, base64, time
 import copy
+import hashlib, pickle, threading
+import contextlib
+import sqlite3
+import functools
+import heapq
+import csv
 import sys, subprocess, asyncio
 import email.utils
 from typing import Dict, Optional, List, Tuple, Any
+from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping
 
 from pathlib import Path
 import streamlit as st
@@ -120,8 +128,6 @@ if os.name == "nt":
         asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
     except Exception:
         pass
-from openai import OpenAI
-
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.image import MIMEImage
@@ -723,66 +729,358 @@ def _clamp(s: str, n: int) -> str:
         return ""
     return s if len(s) <= n else (s[:n] + "\n\n[TRUNCATED]")
 
-def _extract_pdf_text(data: bytes) -> str:
-    """Extract text from PDF bytes with best-available tech.
+PDF_PIXMAP_CACHE_PAGES = 8  # rendered pages kept per document (they are large)
+PDF_CLASSIFY_SAMPLE_PAGES = 5  # pages sampled to label a PDF digital / scanned / mixed
+PDF_TEXT_PAGE_MIN_CHARS = 20  # fewer text-layer characters than this = no usable text
+PDF_SCANNED_IMAGE_COVERAGE = 0.5  # share of a textless page covered by images to call it scanned
+
+
+class _PdfDocument:
+    """A PDF upload parsed once and shared by all PDF extractors.
+
+    PyMuPDF and pdfplumber handles are opened lazily (at most once each), and
+    per-page text, word boxes and rendered pixmaps are memoized. Every accessor
+    is defensive: a missing library or unreadable page yields None / "" / [].
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data or b""
+        self._fitz_doc: Any = None
+        self._fitz_tried = False
+        self._plumber_pdf: Any = None
+        self._plumber_tried = False
+        self._fitz_text: Dict[int, str] = {}
+        self._plumber_text: Dict[int, str] = {}
+        self._words: Dict[int, List[Dict[str, Any]]] = {}
+        self._image_rects: Dict[int, List[Tuple[float, float, float, float]]] = {}
+        self._kind: Optional[str] = None
+        self._pixmaps: "OrderedDict[Tuple[Any, ...], Any]" = OrderedDict()
+
+    def __enter__(self) -> "_PdfDocument":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for handle in (self._fitz_doc, self._plumber_pdf):
+            try:
+                if handle is not None:
+                    handle.close()
+            except Exception:
+                pass
+        self._fitz_doc = None
+        self._plumber_pdf = None
+        self._pixmaps.clear()
+
+    def fitz_doc(self) -> Any:
+        if not self._fitz_tried:
+            self._fitz_tried = True
+            try:
+                import fitz  # type: ignore
+                self._fitz_doc = fitz.open(stream=self.data, filetype="pdf")
+            except Exception:
+                self._fitz_doc = None
+        return self._fitz_doc
+
+    def plumber_pdf(self) -> Any:
+        if not self._plumber_tried:
+            self._plumber_tried = True
+            try:
+                import pdfplumber  # type: ignore
+                self._plumber_pdf = pdfplumber.open(io.BytesIO(self.data))
+            except Exception:
+                self._plumber_pdf = None
+        return self._plumber_pdf
+
+    @property
+    def page_count(self) -> int:
+        doc = self.fitz_doc()
+        if doc is not None:
+            return len(doc)
+        pdf = self.plumber_pdf()
+        return len(pdf.pages) if pdf is not None else 0
+
+    def fitz_page_text(self, page_index: int) -> str:
+        """PyMuPDF "text" extraction (reasonable reading order)."""
+        if page_index not in self._fitz_text:
+            t = ""
+            doc = self.fitz_doc()
+            if doc is not None:
+                try:
+                    t = doc.load_page(page_index).get_text("text") or ""
+                except Exception:
+                    t = ""
+            self._fitz_text[page_index] = t
+        return self._fitz_text[page_index]
+
+    def plumber_page(self, page_index: int) -> Any:
+        pdf = self.plumber_pdf()
+        if pdf is None:
+            return None
+        try:
+            return pdf.pages[page_index]
+        except Exception:
+            return None
+
+    def plumber_page_text(self, page_index: int) -> Optional[str]:
+        """pdfplumber text for a page; None when pdfplumber cannot read the file."""
+        if page_index not in self._plumber_text:
+            page = self.plumber_page(page_index)
+            if page is None:
+                return None
+            try:
+                self._plumber_text[page_index] = page.extract_text() or ""
+            except Exception:
+                return None
+        return self._plumber_text[page_index]
+
+    def words(self, page_index: int) -> List[Dict[str, Any]]:
+        """Text-layer word boxes in PDF points: {text, x0, y0, x1, y1, conf}."""
+        if page_index not in self._words:
+            out: List[Dict[str, Any]] = []
+            doc = self.fitz_doc()
+            if doc is not None:
+                try:
+                    for w in doc.load_page(page_index).get_text("words") or []:
+                        t = str(w[4] or "").strip()
+                        if t:
+                            out.append({"text": t, "x0": float(w[0]), "y0": float(w[1]), "x1": float(w[2]), "y1": float(w[3]), "conf": -1.0})
+                except Exception:
+                    out = []
+            self._words[page_index] = out
+        return self._words[page_index]
+
+    def page_rect(self, page_index: int) -> Optional[Tuple[float, float, float, float]]:
+        doc = self.fitz_doc()
+        if doc is None:
+            return None
+        try:
+            r = doc.load_page(page_index).rect
+            return (float(r.x0), float(r.y0), float(r.x1), float(r.y1))
+        except Exception:
+            return None
+
+    def image_rects(self, page_index: int) -> List[Tuple[float, float, float, float]]:
+        """Bounding boxes (PDF points) of the raster images drawn on a page, clipped to the page."""
+        if page_index not in self._image_rects:
+            out: List[Tuple[float, float, float, float]] = []
+            doc = self.fitz_doc()
+            page_r = self.page_rect(page_index)
+            if doc is not None and page_r is not None:
+                try:
+                    for info in doc.load_page(page_index).get_image_info() or []:
+                        x0, y0, x1, y1 = [float(v) for v in info.get("bbox") or (0, 0, 0, 0)]
+                        x0, y0 = max(x0, page_r[0]), max(y0, page_r[1])
+                        x1, y1 = min(x1, page_r[2]), min(y1, page_r[3])
+                        if x1 > x0 and y1 > y0:
+                            out.append((x0, y0, x1, y1))
+                except Exception:
+                    out = []
+            self._image_rects[page_index] = out
+        return self._image_rects[page_index]
+
+    def page_has_text(self, page_index: int) -> bool:
+        return len(self.fitz_page_text(page_index).strip()) >= PDF_TEXT_PAGE_MIN_CHARS
+
+    def page_is_scanned(self, page_index: int) -> bool:
+        """No usable text layer, but images cover most of the page."""
+        if self.page_has_text(page_index):
+            return False
+        page_r = self.page_rect(page_index)
+        if page_r is None:
+            return False
+        page_area = max(1.0, (page_r[2] - page_r[0]) * (page_r[3] - page_r[1]))
+        covered = sum((r[2] - r[0]) * (r[3] - r[1]) for r in self.image_rects(page_index))
+        return covered >= PDF_SCANNED_IMAGE_COVERAGE * page_area
+
+    def classify(self) -> str:
+        """"digital", "scanned", "mixed" or "unknown" (no PyMuPDF), from sampled pages.
+
+        Looks at the first page plus up to PDF_CLASSIFY_SAMPLE_PAGES evenly spaced
+        pages, using only the text layer length and image geometry (no rendering).
+        """
+        if self._kind is None:
+            n = self.page_count
+            if self.fitz_doc() is None or n == 0:
+                self._kind = "unknown"
+            else:
+                k = max(1, min(PDF_CLASSIFY_SAMPLE_PAGES, n))
+                sample = sorted(set([0] + [int(j * (n - 1) / max(1, k - 1)) for j in range(k)]))
+                text_pages = sum(1 for i in sample if self.page_has_text(i))
+                scanned_pages = sum(1 for i in sample if self.page_is_scanned(i))
+                if text_pages == len(sample):
+                    self._kind = "digital"
+                elif text_pages == 0 and scanned_pages > 0:
+                    self._kind = "scanned"
+                elif scanned_pages > 0:
+                    self._kind = "mixed"
+                else:
+                    self._kind = "digital"  # some blank / vector-only pages
+        return self._kind
+
+    def pixmap(self, page_index: int, zoom: float = 2.0, clip: Optional[Tuple[float, float, float, float]] = None) -> Any:
+        """Rendered page, or the `clip` region of it (fitz.Pixmap, RGB, no alpha); None on failure."""
+        key = (int(page_index), float(zoom), tuple(clip) if clip else None)
+        if key in self._pixmaps:
+            self._pixmaps.move_to_end(key)
+            return self._pixmaps[key]
+        doc = self.fitz_doc()
+        if doc is None:
+            return None
+        try:
+            import fitz  # type: ignore
+            kwargs: Dict[str, Any] = {"matrix": fitz.Matrix(zoom, zoom), "alpha": False}
+            if clip:
+                kwargs["clip"] = fitz.Rect(*clip)
+            pix = doc.load_page(page_index).get_pixmap(**kwargs)
+        except Exception:
+            return None
+        self._pixmaps[key] = pix
+        while len(self._pixmaps) > PDF_PIXMAP_CACHE_PAGES:
+            self._pixmaps.popitem(last=False)
+        return pix
+
+
+def _as_pdf_document(data: Any) -> Tuple[_PdfDocument, bool]:
+    """Accept raw bytes or a shared _PdfDocument; returns (doc, caller_owns_doc)."""
+    if isinstance(data, _PdfDocument):
+        return data, False
+    return _PdfDocument(data), True
+
 
-    Priority order (best to fallback):
+def _format_page_ranges(pages: List[int]) -> str:
+    """[3, 4, 5, 9] -> "3-5, 9" (1-based page numbers)."""
+    spans: List[List[int]] = []
+    for p in sorted(set(pages)):
+        if spans and p == spans[-1][1] + 1:
+            spans[-1][1] = p
+        else:
+            spans.append([p, p])
+    return ", ".join(str(a) if a == b else f"{a}-{b}" for a, b in spans)
+
+
+def _extract_pdf_text(
+    data: Any,
+    stats: Optional[Dict[str, Any]] = None,
+    max_chars: Optional[int] = None,
+    skipped_pages: Optional[List[int]] = None,
+) -> str:
+    """Extract text from PDF bytes (or a shared _PdfDocument) with best-available tech.
+
+    The PDF is classified first (_PdfDocument.classify): scanned PDFs go straight
+    to OCR, and mixed PDFs get their scanned pages OCR'd in place. Otherwise,
+    priority order (best to fallback):
       1) PyMuPDF (fitz) - generally best layout-aware extraction
       2) pdfplumber - good text extraction with layout hints
       3) PyPDF2 - basic fallback
 
+    Pages are extracted lazily and extraction stops once the text exceeds
+    `max_chars` (default MAX_DOC_CHARS_PER_FILE; callers clamp to it anyway).
+    Pages never read are appended (1-based) to `skipped_pages`.
+
     This function must be defensive and return "" on failure.
     """
-    # 1) PyMuPDF / fitz
-    try:
-        import fitz  # type: ignore
-        parts = []
-        with fitz.open(stream=data, filetype="pdf") as doc:
-            for p_i in range(len(doc)):
-                page = doc.load_page(p_i)
-                # "text" keeps reading order reasonable; avoid dict output (too big)
-                t = (page.get_text("text") or "").strip()
-                if t:
-                    parts.append(f"[PDF page {p_i+1}]\n{t}")
-        out = _normalize_ws("\n\n".join(parts))
-        if out:
-            return out
-    except Exception:
-        pass
-
-    # 2) pdfplumber
-    try:
-        import pdfplumber  # type: ignore
-        parts = []
-        with pdfplumber.open(io.BytesIO(data)) as pdf:
-            for p_i, page in enumerate(pdf.pages):
-                t = (page.extract_text() or "").strip()
-                if t:
-                    parts.append(f"[PDF page {p_i+1}]\n{t}")
-        out = _normalize_ws("\n\n".join(parts))
-        if out:
-            return out
-    except Exception:
-        pass
+    max_chars = MAX_DOC_CHARS_PER_FILE if max_chars is None else int(max_chars)
 
-    # 3) PyPDF2
-    try:
-        from PyPDF2 import PdfReader  # type: ignore
-        parts = []
-        reader = PdfReader(io.BytesIO(data))
-        for p_i, page in enumerate(reader.pages):
-            t = (page.extract_text() or "").strip()
+    def collect(n_pages: int, page_text: Any) -> str:
+        parts: List[str] = []
+        raw_len = 0
+        for p_i in range(n_pages):
+            t = (page_text(p_i) or "").strip()
             if t:
                 parts.append(f"[PDF page {p_i+1}]\n{t}")
+                raw_len += len(parts[-1]) + 2
+            # raw length bounds the normalized length, so only normalize once it could be over
+            if raw_len > max_chars and p_i + 1 < n_pages and len(_normalize_ws("\n\n".join(parts))) > max_chars:
+                if skipped_pages is not None:
+                    skipped_pages.extend(range(p_i + 2, n_pages + 1))
+                break
         return _normalize_ws("\n\n".join(parts))
-    except Exception:
-        return ""
 
-def _extract_pdf_tables(data: bytes) -> List[Dict[str, Any]]:
+    pdf, owned = _as_pdf_document(data)
+    try:
+        kind = pdf.classify()
+        if kind == "scanned":
+            # image-only: the text-layer fallbacks below would all parse the file for nothing.
+            # OCR a worker-pool's worth of pages at a time so the budget can stop it early;
+            # every chunk shares one OCR_DEADLINE_S deadline for the whole PDF.
+            texts: Dict[int, str] = {}
+            step = max(1, OCR_MAX_WORKERS)
+            deadline_ts = time.time() + OCR_DEADLINE_S
+
+            def ocr_page_text(p_i: int) -> str:
+                if p_i not in texts:
+                    chunk = range(p_i, min(p_i + step, pdf.page_count))
+                    texts.update({i: "" for i in chunk})
+                    texts.update(_ocr_pdf_page_texts(pdf, chunk, stats=stats, deadline_ts=deadline_ts))
+                return texts[p_i]
+            return collect(pdf.page_count, ocr_page_text)
+
+        # 1) PyMuPDF / fitz
+        try:
+            if pdf.fitz_doc() is not None:
+                ocr_texts: Optional[Dict[int, str]] = None
+
+                def fitz_text(p_i: int) -> str:
+                    nonlocal ocr_texts
+                    # "text" keeps reading order reasonable; avoid dict output (too big)
+                    if kind == "mixed" and pdf.page_is_scanned(p_i):
+                        if ocr_texts is None:
+                            # first scanned page: OCR all of them in one (parallel) batch
+                            ocr_texts = _ocr_pdf_page_texts(pdf, [i for i in range(p_i, pdf.page_count) if pdf.page_is_scanned(i)], stats=stats)
+                        return ocr_texts.get(p_i, "")
+                    return pdf.fitz_page_text(p_i)
+                out = collect(pdf.page_count, fitz_text)
+                if out:
+                    return out
+        except Exception:
+            pass
+
+        # 2) pdfplumber
+        try:
+            plumber = pdf.plumber_pdf()
+            if plumber is not None:
+                out = collect(len(plumber.pages), pdf.plumber_page_text)
+                if out:
+                    return out
+        except Exception:
+            pass
+
+        # 3) PyPDF2
+        try:
+            from PyPDF2 import PdfReader  # type: ignore
+            reader = PdfReader(io.BytesIO(pdf.data))
+            return collect(len(reader.pages), lambda p_i: reader.pages[p_i].extract_text())
+        except Exception:
+            return ""
+    finally:
+        if owned:
+            pdf.close()
+
+PDF_MAX_TABLES = 24  # overall cap per PDF on tables passed on (ruled first, then the richest word-grid tables)
+PDF_MAX_TABLES_PER_PAGE = 6  # ruled tables kept per page
+PDF_GRID_MAX_CANDIDATES = 240  # word-grid tables collected per PDF before ranking (dashboard tiles are small)
+PDF_GRID_MAX_TABLES_PER_PAGE = 80  # word-grid tables collected per page
+PDF_TABLES_MAX_PAGES = 60  # pages scanned for tables per PDF
+PDF_TABLES_TIME_BUDGET_S = 20.0  # wall-clock budget for table extraction per PDF
+
+
+def _extract_pdf_tables(data: Any, skipped_pages: Optional[List[int]] = None) -> List[Dict[str, Any]]:
     """Best-effort extraction of simple tables from PDFs.
 
-    Uses pdfplumber when available. Returns a list of small previews in the
-    same shape as other table previews so downstream can treat them uniformly.
+    Uses pdfplumber when available (`data` may be bytes or a shared
+    _PdfDocument); pages where it finds no (ruled) tables fall back to
+    rebuilding tables from the text-layer word boxes (_word_grid_tables).
+    Returns a list of small previews in the same shape as other table previews
+    so downstream can treat them uniformly.
+
+    At most PDF_MAX_TABLES tables come back: ruled tables first, then the
+    word-grid tables with the most numeric cells (dashboard pages can hold
+    dozens of small tiles, so up to PDF_GRID_MAX_CANDIDATES are collected and
+    ranked), in page order. Scanning stops at PDF_TABLES_MAX_PAGES pages or
+    PDF_TABLES_TIME_BUDGET_S seconds; pages not scanned are appended (1-based)
+    to `skipped_pages`.
     """
     previews: List[Dict[str, Any]] = []
     try:
@@ -828,26 +1126,64 @@ def _extract_pdf_tables(data: bytes) -> List[Dict[str, Any]]:
             "numeric_stats": {},
         }
 
+    doc, owned = _as_pdf_document(data)
     try:
-        with pdfplumber.open(io.BytesIO(data)) as pdf:
-            for p_i, page in enumerate(pdf.pages):
+        pdf = doc.plumber_pdf()
+        if pdf is None and doc.fitz_doc() is None:
+            return previews
+        n_pages = len(pdf.pages) if pdf is not None else doc.page_count
+        t0 = time.monotonic()
+        n_ruled = n_grid = 0
+        grid_previews: List[Dict[str, Any]] = []
+        for p_i in range(n_pages):
+            if p_i >= PDF_TABLES_MAX_PAGES or (time.monotonic() - t0) > PDF_TABLES_TIME_BUDGET_S:
+                if skipped_pages is not None:
+                    skipped_pages.extend(range(p_i + 1, n_pages + 1))
+                break
+            page = doc.plumber_page(p_i)
+            try:
+                tables = page.extract_tables() or []
+            except Exception:
+                tables = []
+            if tables:
+                if n_ruled >= PDF_MAX_TABLES:
+                    continue
+                page_previews = [_table_to_preview(table) for table in tables[:PDF_MAX_TABLES_PER_PAGE]]
+            else:
+                if n_grid >= PDF_GRID_MAX_CANDIDATES:
+                    continue
+                deadline = min(t0 + PDF_TABLES_TIME_BUDGET_S, time.monotonic() + WORD_GRID_TIME_BUDGET_S)
                 try:
-                    tables = page.extract_tables() or []
+                    page_previews = _word_grid_tables(doc.words(p_i), deadline_ts=deadline)[:PDF_GRID_MAX_TABLES_PER_PAGE]
                 except Exception:
-                    tables = []
-                for t_i, table in enumerate(tables[:6]):  # cap tables per page
-                    prev = _table_to_preview(table)
-                    # only keep meaningful previews
-                    if prev.get("shape", [0, 0])[0] > 0 and prev.get("shape", [0, 0])[1] > 0:
-                        prev["page"] = p_i + 1
-                        prev["table_index"] = t_i + 1
+                    page_previews = []
+            for t_i, prev in enumerate(page_previews):
+                # only keep meaningful previews
+                if prev.get("shape", [0, 0])[0] > 0 and prev.get("shape", [0, 0])[1] > 0:
+                    prev["page"] = p_i + 1
+                    prev["table_index"] = t_i + 1
+                    if tables:
                         previews.append(prev)
-                # Hard cap overall to avoid bloat
-                if len(previews) >= 24:
-                    break
+                        n_ruled += 1
+                    else:
+                        grid_previews.append(prev)
+                        n_grid += 1
+            # Hard caps overall to avoid bloat
+            if n_ruled >= PDF_MAX_TABLES:
+                if skipped_pages is not None:
+                    skipped_pages.extend(range(p_i + 2, n_pages + 1))
+                break
     except Exception:
-        return previews
-
+        pass
+    finally:
+        if owned:
+            doc.close()
+
+    # word-grid tables fill the slots left by ruled tables, richest first
+    slots = max(0, PDF_MAX_TABLES - len(previews))
+    ranked = sorted(grid_previews, key=lambda pv: -sum(1 for r in pv.get("rows") or [] for c in r if _is_num_token(c)))
+    previews.extend(ranked[:slots])
+    previews.sort(key=lambda pv: (pv["page"], pv["table_index"]))
     return previews
 
 
@@ -870,56 +1206,560 @@ def _df_to_preview(df: "pd.DataFrame") -> Dict[str, Any]:
         return {"shape": [0, 0], "headers": [], "rows": [], "truncated": False, "numeric_stats": {}}
 
 
-def _render_pdf_page_image(doc: Any, page_index: int, zoom: float = 2.0) -> "Any":
-    """Render a PDF page to a PIL image for OCR. Returns None on failure."""
+def _render_pdf_page_image(doc: Any, page_index: int, zoom: float = 2.0, clip: Optional[Tuple[float, float, float, float]] = None) -> "Any":
+    """Render a PDF page (or its `clip` rectangle, in PDF points) to a PIL image for OCR.
+    Returns None on failure.
+
+    `doc` is a shared _PdfDocument (pixmap is memoized) or an open fitz document.
+    """
     try:
         import fitz  # type: ignore
         from PIL import Image  # type: ignore
     except Exception:
         return None
     try:
-        page = doc.load_page(page_index)
-        mat = fitz.Matrix(zoom, zoom)
-        pix = page.get_pixmap(matrix=mat, alpha=False)
+        if isinstance(doc, _PdfDocument):
+            pix = doc.pixmap(page_index, zoom=zoom, clip=clip)
+            if pix is None:
+                return None
+        else:
+            page = doc.load_page(page_index)
+            mat = fitz.Matrix(zoom, zoom)
+            if clip:
+                pix = page.get_pixmap(matrix=mat, alpha=False, clip=fitz.Rect(*clip))
+            else:
+                pix = page.get_pixmap(matrix=mat, alpha=False)
         img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
         return img
     except Exception:
         return None
 
 
-def _ocr_pdf_page_words(doc: Any, page_index: int, zoom: float = 2.0, timeout_s: int = 20) -> List[Dict[str, Any]]:
-    """OCR a PDF page and return word boxes in PDF coordinate space (approx).
+OCR_BACKEND = "auto"  # "auto" | "tesserocr" | "batch" | "pytesseract"
+OCR_TESSERACT_CONFIG = ""  # extra tesseract CLI flags (part of the OCR cache key)
+OCR_CACHE_ENABLED = True
+OCR_CACHE_DIR = os.path.join(os.getcwd(), ".cache", "ocr")
+OCR_CACHE_DISK_BYTES = 64 * 1024 * 1024
 
-    Returns list of dict: {text, x0, y0, x1, y1, conf}.
-    Coordinate space is in rendered image pixels; we also include scale to PDF.
-    """
-    words: List[Dict[str, Any]] = []
+
+# ------------------------------
+# OCR backends
+# ------------------------------
+# All backends take PIL images and return word boxes in image pixels:
+# {text, x0, y0, x1, y1, conf}. `ocr_many` lets a backend OCR several page
+# images in one go (the batch backend runs a single tesseract process for them);
+# it does not raise, an image that failed or timed out comes back as None.
+
+def _word_box(text: Any, x: Any, y: Any, w: Any, h: Any, conf: Any) -> Optional[Dict[str, Any]]:
+    t = str(text or "").strip()
+    if not t:
+        return None
     try:
-        import pytesseract  # type: ignore
+        c = float(conf)
     except Exception:
+        c = -1.0
+    return {"text": t, "x0": float(x), "y0": float(y), "x1": float(x) + float(w), "y1": float(y) + float(h), "conf": c}
+
+
+class _PytesseractOcrBackend:
+    """One tesseract subprocess per image via pytesseract (the long-standing default)."""
+
+    name = "pytesseract"
+
+    @staticmethod
+    def available() -> bool:
+        try:
+            import pytesseract  # type: ignore  # noqa
+            return True
+        except Exception:
+            return False
+
+    def ocr(self, img: Any, timeout_s: int) -> List[Dict[str, Any]]:
+        import pytesseract  # type: ignore
+        data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT, timeout=timeout_s, config=OCR_TESSERACT_CONFIG)
+        words = []
+        confs = data.get("conf") or []
+        for i in range(len(data.get("text", []))):
+            conf = confs[i] if i < len(confs) else -1
+            w = _word_box(data["text"][i], data["left"][i], data["top"][i], data["width"][i], data["height"][i], conf)
+            if w:
+                words.append(w)
+        return words
+
+    def ocr_many(self, imgs: List[Any], timeout_s: int) -> List[Optional[List[Dict[str, Any]]]]:
+        out: List[Optional[List[Dict[str, Any]]]] = []
+        for img in imgs:
+            try:
+                out.append(self.ocr(img, timeout_s))
+            except Exception:
+                out.append(None)  # error / timeout on this image only
+        return out
+
+
+_TESSEROCR_APIS: Dict[int, Any] = {}
+_TESSEROCR_LOCK = threading.Lock()
+
+
+class _TesserocrOcrBackend:
+    """In-process tesseract (tesserocr): the language model is loaded once per process
+    and the API handle is reused for every page. Recognition is bounded by the
+    per-page timeout; a page that runs out of time raises like pytesseract does."""
+
+    name = "tesserocr"
+
+    @staticmethod
+    def available() -> bool:
+        try:
+            import tesserocr  # type: ignore  # noqa
+            return True
+        except Exception:
+            return False
+
+    def _api(self) -> Any:
+        pid = os.getpid()  # handles are not shared across forked workers
+        api = _TESSEROCR_APIS.get(pid)
+        if api is None:
+            from tesserocr import PyTessBaseAPI, PSM  # type: ignore
+            args = _tesseract_config_args()
+            kwargs: Dict[str, Any] = {"lang": args.get("lang") or "eng"}
+            if args.get("psm") is not None:
+                kwargs["psm"] = PSM(int(args["psm"]))
+            api = PyTessBaseAPI(**kwargs)
+            _TESSEROCR_APIS[pid] = api
+        return api
+
+    def ocr(self, img: Any, timeout_s: int) -> List[Dict[str, Any]]:
+        from tesserocr import RIL, iterate_level  # type: ignore
+        words = []
+        with _TESSEROCR_LOCK:
+            api = self._api()
+            api.SetImage(img)
+            if not api.Recognize(timeout=max(1, int(timeout_s)) * 1000):
+                raise RuntimeError("tesserocr: recognition timed out or failed")
+            for r in iterate_level(api.GetIterator(), RIL.WORD):
+                try:
+                    x0, y0, x1, y1 = r.BoundingBox(RIL.WORD)
+                    w = _word_box(r.GetUTF8Text(RIL.WORD), x0, y0, x1 - x0, y1 - y0, r.Confidence(RIL.WORD))
+                except Exception:
+                    w = None
+                if w:
+                    words.append(w)
         return words
 
-    img = _render_pdf_page_image(doc, page_index, zoom=zoom)
-    if img is None:
+    def ocr_many(self, imgs: List[Any], timeout_s: int) -> List[Optional[List[Dict[str, Any]]]]:
+        out: List[Optional[List[Dict[str, Any]]]] = []
+        for img in imgs:
+            try:
+                out.append(self.ocr(img, timeout_s))
+            except Exception:
+                out.append(None)  # timed out: skip this image, keep the others
+        return out
+
+
+class _BatchTesseractOcrBackend:
+    """All page images of a run OCR'd by a single tesseract invocation (image list
+    file -> one TSV with page_num), so the model is loaded once per batch."""
+
+    name = "batch"
+
+    @staticmethod
+    def _cmd() -> str:
+        try:
+            import pytesseract  # type: ignore
+            return str(pytesseract.pytesseract.tesseract_cmd or "tesseract")
+        except Exception:
+            return "tesseract"
+
+    @classmethod
+    def available(cls) -> bool:
+        import shutil
+        return shutil.which(cls._cmd()) is not None
+
+    def ocr(self, img: Any, timeout_s: int) -> List[Dict[str, Any]]:
+        words = self.ocr_many([img], timeout_s)[0]
+        if words is None:
+            raise RuntimeError("tesseract: batch run timed out or failed")
         return words
 
+    def ocr_many(self, imgs: List[Any], timeout_s: int) -> List[Optional[List[Dict[str, Any]]]]:
+        try:
+            return self._run(imgs, timeout_s)
+        except Exception:
+            return [None] * len(imgs)  # one process for the batch: nothing to keep
+
+    def _run(self, imgs: List[Any], timeout_s: int) -> List[Optional[List[Dict[str, Any]]]]:
+        import shlex
+        import tempfile
+        out: List[Optional[List[Dict[str, Any]]]] = [[] for _ in imgs]
+        if not imgs:
+            return out
+        with tempfile.TemporaryDirectory(prefix="mm_ocr_") as tmp:
+            paths = []
+            for k, img in enumerate(imgs):
+                path = os.path.join(tmp, f"page_{k:04d}.png")
+                img.save(path)
+                paths.append(path)
+            list_path = os.path.join(tmp, "pages.txt")
+            with open(list_path, "w", encoding="utf-8") as fh:
+                fh.write("\n".join(paths) + "\n")
+            cmd = [self._cmd(), list_path, "stdout"] + shlex.split(OCR_TESSERACT_CONFIG or "") + ["tsv"]
+            proc = subprocess.run(cmd, capture_output=True, timeout=max(1, int(timeout_s)) * len(imgs), check=True)
+        lines = proc.stdout.decode("utf-8", errors="ignore").splitlines()
+        if not lines:
+            return out
+        cols = lines[0].split("\t")
+        try:
+            i_level, i_page = cols.index("level"), cols.index("page_num")
+            i_l, i_t, i_w, i_h = cols.index("left"), cols.index("top"), cols.index("width"), cols.index("height")
+            i_conf, i_text = cols.index("conf"), cols.index("text")
+        except ValueError:
+            return out
+        for ln in lines[1:]:
+            f = ln.split("\t")
+            if len(f) <= i_text or f[i_level] != "5":  # 5 = word level
+                continue
+            page = int(f[i_page]) - 1
+            words = out[page] if 0 <= page < len(out) else None
+            if words is None:
+                continue
+            w = _word_box(f[i_text], f[i_l], f[i_t], f[i_w], f[i_h], f[i_conf])
+            if w:
+                words.append(w)
+        return out
+
+
+OCR_BACKENDS = {
+    "tesserocr": _TesserocrOcrBackend,
+    "batch": _BatchTesseractOcrBackend,
+    "pytesseract": _PytesseractOcrBackend,
+}
+
+
+def _tesseract_config_args() -> Dict[str, Any]:
+    """Pick the flags the in-process engine understands out of OCR_TESSERACT_CONFIG."""
+    import shlex
+    toks = shlex.split(OCR_TESSERACT_CONFIG or "")
+    out: Dict[str, Any] = {}
+    for i, tok in enumerate(toks[:-1]):
+        if tok == "--psm":
+            out["psm"] = toks[i + 1]
+        elif tok == "-l":
+            out["lang"] = toks[i + 1]
+    return out
+
+
+def _get_ocr_backend(name: Optional[str] = None) -> Optional[Any]:
+    """Return the configured OCR backend (auto: tesserocr > batch > pytesseract), or None."""
+    name = (name or OCR_BACKEND or "auto").strip().lower()
+    order = ["tesserocr", "batch", "pytesseract"] if name == "auto" else [name, "pytesseract"]
+    for key in order:
+        cls = OCR_BACKENDS.get(key)
+        if cls is not None and cls.available():
+            return cls()
+    return None
+
+
+def _ocr_cache() -> "_DiskCache":
+    """On-disk OCR result cache (file based, so it is shared with OCR worker processes)."""
+    return _DiskCache(OCR_CACHE_DIR, OCR_CACHE_DISK_BYTES)
+
+
+def _ocr_cache_key(img: Any, zoom: float, config: str, backend: str = "") -> str:
+    h = hashlib.sha256(img.tobytes())
+    h.update(f"|{img.mode}|{img.size[0]}x{img.size[1]}|{float(zoom)}|{config}|{backend}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _bump_stat(stats: Optional[Dict[str, Any]], key: str, n: int = 1) -> None:
+    if stats is not None:
+        stats[key] = stats.get(key, 0) + n
+
+
+OCR_ROI_ENABLED = True  # OCR only the raster image regions of pages that have a text layer
+OCR_ROI_MIN_SIDE_PT = 24.0  # ignore images smaller than this (icons, bullets, logos)
+OCR_ROI_FULL_PAGE_RATIO = 0.6  # images covering more of the page than this -> OCR the whole page
+
+
+def _ocr_regions(doc: Any, page_index: int) -> List[Optional[Tuple[float, float, float, float]]]:
+    """Regions (PDF points) of a page worth OCR'ing; None means the whole page.
+
+    Pages with a text layer only need their raster image blocks OCR'd (chart and
+    KPI tile images); overlapping images are merged. Pages without a text layer,
+    or mostly covered by images, are OCR'd whole. Returns [] when a page with a
+    text layer has no images at all (nothing OCR could add).
+    """
+    if not OCR_ROI_ENABLED or not isinstance(doc, _PdfDocument):
+        return [None]
+    page_r = doc.page_rect(page_index)
+    if page_r is None or not doc.words(page_index):
+        return [None]
+    rects = [list(r) for r in doc.image_rects(page_index)
+             if (r[2] - r[0]) >= OCR_ROI_MIN_SIDE_PT and (r[3] - r[1]) >= OCR_ROI_MIN_SIDE_PT]
+    merged: List[List[float]] = []
+    for r in sorted(rects):
+        for m in merged:
+            if r[0] <= m[2] and r[2] >= m[0] and r[1] <= m[3] and r[3] >= m[1]:
+                m[0], m[1], m[2], m[3] = min(m[0], r[0]), min(m[1], r[1]), max(m[2], r[2]), max(m[3], r[3])
+                break
+        else:
+            merged.append(r)
+    if not merged:
+        return []
+    page_area = max(1.0, (page_r[2] - page_r[0]) * (page_r[3] - page_r[1]))
+    if sum((m[2] - m[0]) * (m[3] - m[1]) for m in merged) >= OCR_ROI_FULL_PAGE_RATIO * page_area:
+        return [None]
+    return [tuple(m) for m in merged]
+
+
+def _ocr_page_images(
+    doc: Any,
+    page_indices: List[int],
+    zoom: float = 2.0,
+    timeout_s: int = 20,
+    deadline_ts: Optional[float] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    backend: Optional[Any] = None,
+    use_cache: bool = True,
+) -> Dict[int, List[Dict[str, Any]]]:
+    """Render + OCR pages with one backend; returns {page_index: words}.
+
+    Each page is split into OCR regions (see _ocr_regions) and words come back
+    in PDF point coordinates of the page. Cached regions (see _ocr_cache_key)
+    are served from disk; the rest go to the backend in one `ocr_many` call.
+    Pages not reached before `deadline_ts` (epoch seconds) are left out.
+    """
+    out: Dict[int, List[Dict[str, Any]]] = {}
+    backend = backend or _get_ocr_backend()
+    if backend is None:
+        return out
+
+    def to_page(words: List[Dict[str, Any]], clip: Optional[Tuple[float, float, float, float]]) -> List[Dict[str, Any]]:
+        ox, oy = (clip[0], clip[1]) if clip else (0.0, 0.0)
+        return [dict(w, x0=ox + w["x0"] / zoom, y0=oy + w["y0"] / zoom, x1=ox + w["x1"] / zoom, y1=oy + w["y1"] / zoom) for w in words]
+
+    pending: List[Tuple[int, Any, Optional[str], Any]] = []
+    for i in page_indices:
+        if deadline_ts is not None and deadline_ts - time.time() <= 1:
+            break
+        out[i] = []
+        regions = _ocr_regions(doc, i)
+        _bump_stat(stats, "ocr_regions", len(regions))
+        for clip in regions:
+            img = _render_pdf_page_image(doc, i, zoom=zoom, clip=clip)
+            if img is None:
+                continue
+            key = None
+            if use_cache and OCR_CACHE_ENABLED:
+                try:
+                    key = _ocr_cache_key(img, zoom, OCR_TESSERACT_CONFIG, backend.name)
+                    cached = _ocr_cache().get(key)
+                except Exception:
+                    cached = None
+                if isinstance(cached, list):
+                    _bump_stat(stats, "ocr_cache_hits")
+                    out[i].extend(to_page(cached, clip))
+                    continue
+                _bump_stat(stats, "ocr_cache_misses")
+            pending.append((i, img, key, clip))
+
+    if not pending:
+        return out
+    page_timeout = timeout_s
+    if deadline_ts is not None:
+        page_timeout = max(1, min(timeout_s, int((deadline_ts - time.time()) / len(pending))))
+
+    try:
+        results = backend.ocr_many([img for _, img, _, _ in pending], page_timeout)
+    except Exception:
+        results = [None] * len(pending)  # backends report per-image failures as None; this is a broken backend
+
+    for (i, _, key, clip), words in zip(pending, results):
+        if words is None:
+            _bump_stat(stats, "ocr_failed")
+            continue
+        if key is not None:
+            _ocr_cache().put(key, words)  # cached in image pixels of the region
+        out[i].extend(to_page(words, clip))
+    return out
+
+
+def _merge_ocr_words(text_words: List[Dict[str, Any]], ocr_words: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Union of text-layer and OCR word boxes (same page coordinates).
+
+    OCR words whose centre falls inside a text-layer word box are re-reads of
+    text the PDF already has and are dropped.
+    """
+    kept = []
+    for w in ocr_words:
+        cx, cy = (w["x0"] + w["x1"]) / 2.0, (w["y0"] + w["y1"]) / 2.0
+        if any(t["x0"] <= cx <= t["x1"] and t["y0"] <= cy <= t["y1"] for t in text_words):
+            continue
+        kept.append(w)
+    return list(text_words) + kept
+
+
+def _ocr_pdf_page_words(doc: Any, page_index: int, zoom: float = 2.0, timeout_s: int = 20, stats: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """OCR a PDF page and return word boxes in PDF coordinate space (approx).
+
+    Returns list of dict: {text, x0, y0, x1, y1, conf}, in PDF points. Only the
+    raster regions of pages with a text layer are OCR'd (see _ocr_regions).
+
+    Uses the configured OCR backend (OCR_BACKEND). Results are cached on disk by
+    a hash of the rendered region image + zoom + tesseract config, so an identical
+    region is never OCR'd twice. Cache hits/misses are counted into `stats`.
+    """
+    try:
+        return _ocr_page_images(doc, [page_index], zoom=zoom, timeout_s=timeout_s, stats=stats).get(page_index, [])
+    except Exception:
+        return []
+
+
+def _benchmark_ocr_backends(data: Any, max_pages: int = 3, zoom: float = 2.0) -> List[Dict[str, Any]]:
+    """Compare per-page OCR latency across the available backends (cache bypassed)."""
+    rows: List[Dict[str, Any]] = []
+    pdf, owned = _as_pdf_document(data)
     try:
-        data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT, timeout=timeout_s)
-        n = len(data.get("text", []))
-        for i in range(n):
-            t = (data["text"][i] or "").strip()
-            if not t:
+        pages = list(range(min(max_pages, pdf.page_count)))
+        if not pages:
+            return rows
+        for name, cls in OCR_BACKENDS.items():
+            if not cls.available():
+                rows.append({"backend": name, "available": False, "pages": 0, "total_s": None, "per_page_ms": None, "words": None})
                 continue
+            backend = cls()
+            t0 = time.perf_counter()
             try:
-                conf = float(data.get("conf", ["-1"])[i])
-            except Exception:
-                conf = -1.0
-            x, y, w, h = data["left"][i], data["top"][i], data["width"][i], data["height"][i]
-            words.append({"text": t, "x0": float(x), "y0": float(y), "x1": float(x + w), "y1": float(y + h), "conf": conf, "zoom": float(zoom)})
+                res = _ocr_page_images(pdf, pages, zoom=zoom, timeout_s=OCR_PAGE_TIMEOUT_S, backend=backend, use_cache=False)
+                err = ""
+            except Exception as e:
+                res, err = {}, str(e)
+            dt = time.perf_counter() - t0
+            rows.append({
+                "backend": name,
+                "available": True,
+                "pages": len(pages),
+                "total_s": round(dt, 3),
+                "per_page_ms": round(1000.0 * dt / len(pages), 1),
+                "words": sum(len(w) for w in res.values()),
+                "error": err,
+            })
+    finally:
+        if owned:
+            pdf.close()
+    return rows
+
+
+def _benchmark_ocr_cli(argv: List[str]) -> int:
+    """`python monthly_report_builder_app.py benchmark-ocr FILE.pdf [...] [--pages N]`.
+
+    Prints one JSON line per backend and file (see _benchmark_ocr_backends).
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog="benchmark-ocr", description="Compare OCR backend latency on PDF pages.")
+    parser.add_argument("pdfs", nargs="+")
+    parser.add_argument("--pages", type=int, default=3, help="pages per PDF (default: 3)")
+    parser.add_argument("--zoom", type=float, default=2.0)
+    args = parser.parse_args(argv)
+    for path in args.pdfs:
+        with open(path, "rb") as fh:
+            data = fh.read()
+        for row in _benchmark_ocr_backends(data, max_pages=args.pages, zoom=args.zoom):
+            print(json.dumps(dict(row, file=path)))
+    return 0
+
+
+OCR_MAX_WORKERS = max(1, min(4, os.cpu_count() or 1))
+OCR_PAGE_TIMEOUT_S = 20
+OCR_DEADLINE_S = 90.0  # overall OCR budget per PDF; pages not reached are skipped
+
+
+def _ocr_pages_task(data: bytes, page_indices: List[int], zoom: float, timeout_s: int, deadline_ts: Optional[float]) -> Dict[str, Any]:
+    """Process-pool worker: render + OCR a chunk of pages (the PDF is parsed once per chunk).
+
+    Returns {"words": {page_index: words}, "stats": {...}}.
+    """
+    stats: Dict[str, Any] = {}
+    with _PdfDocument(data) as pdf:
+        out = _ocr_page_images(pdf, page_indices, zoom=zoom, timeout_s=timeout_s, deadline_ts=deadline_ts, stats=stats)
+    return {"words": out, "stats": stats}
+
+
+def _ocr_pages(
+    pdf: "_PdfDocument",
+    page_indices: List[int],
+    zoom: float = 2.0,
+    timeout_s: int = OCR_PAGE_TIMEOUT_S,
+    workers: Optional[int] = None,
+    deadline_s: Optional[float] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    deadline_ts: Optional[float] = None,
+) -> Dict[int, List[Dict[str, Any]]]:
+    """OCR several pages, in parallel worker processes when possible.
+
+    Pages are dealt round-robin to at most `workers` processes and the whole
+    run is bounded by `deadline_s`, or by an absolute `deadline_ts` (epoch
+    seconds) shared with earlier calls for the same PDF. Returns {page_index:
+    words}; pages that were not OCR'd before the deadline are absent (counted
+    as "ocr_pages_skipped" in `stats`).
+    """
+    pages = list(page_indices)
+    workers = OCR_MAX_WORKERS if workers is None else int(workers)
+    if deadline_ts is None:
+        deadline_s = OCR_DEADLINE_S if deadline_s is None else deadline_s
+        deadline_ts = (time.time() + deadline_s) if deadline_s else None
+    else:
+        deadline_s = deadline_ts - time.time()
+        if deadline_s <= 1:  # the PDF's OCR budget is spent
+            _bump_stat(stats, "ocr_pages_skipped", len(pages))
+            return {}
+    out: Dict[int, List[Dict[str, Any]]] = {}
+
+    if len(pages) > 1 and workers > 1:
+        n = min(workers, len(pages))
+        tasks = [(pdf.data, pages[k::n], zoom, timeout_s, deadline_ts) for k in range(n)]
+        # small grace so workers can return the pages they finished at the deadline
+        results = _process_pool_map(_ocr_pages_task, tasks, n, timeout_s=(deadline_s + 5.0) if deadline_s else None)
+        if any(r is not None for r in results):
+            for r in results:
+                out.update((r or {}).get("words") or {})
+                for k, v in ((r or {}).get("stats") or {}).items():
+                    _bump_stat(stats, k, v)
+            _bump_stat(stats, "ocr_pages", len(out))
+            _bump_stat(stats, "ocr_pages_skipped", len(pages) - len(out))
+            return out
+
+    try:
+        out = _ocr_page_images(pdf, pages, zoom=zoom, timeout_s=timeout_s, deadline_ts=deadline_ts, stats=stats)
     except Exception:
-        return []
+        out = {}
+    _bump_stat(stats, "ocr_pages", len(out))
+    _bump_stat(stats, "ocr_pages_skipped", len(pages) - len(out))
+    return out
+
+
+def _ocr_pdf_page_texts(pdf: "_PdfDocument", page_indices: Any, stats: Optional[Dict[str, Any]] = None, deadline_ts: Optional[float] = None) -> Dict[int, str]:
+    """OCR whole pages into plain text lines; returns {page_index: text} (see _ocr_pages for `deadline_ts`)."""
+    pages = list(page_indices)
+    if not pages:
+        return {}
+    try:
+        words_by_page = _ocr_pages(pdf, pages, zoom=2.0, timeout_s=OCR_PAGE_TIMEOUT_S, stats=stats, deadline_ts=deadline_ts)
+    except Exception:
+        return {}
+    out: Dict[int, str] = {}
+    for i in sorted(words_by_page):
+        words = [w for w in (words_by_page[i] or []) if (w.get("conf", -1) >= 40) or (w.get("conf", -1) == -1)]
+        lines = _words_to_lines(words, y_tol=6.0)
+        t = "\n".join(" ".join(w["text"] for w in ln) for ln in lines).strip()
+        if t:
+            out[i] = t
+    return out
+
 
-    return words
+def _ocr_pdf_text(pdf: "_PdfDocument", page_indices: Any, stats: Optional[Dict[str, Any]] = None) -> str:
+    """OCR text for a scanned PDF, in the same "[PDF page n]" layout as _extract_pdf_text."""
+    texts = _ocr_pdf_page_texts(pdf, page_indices, stats=stats)
+    return _normalize_ws("\n\n".join(f"[PDF page {i+1}]\n{t}" for i, t in sorted(texts.items())))
 
 
 def _words_to_lines(words: List[Dict[str, Any]], y_tol: float = 10.0) -> List[List[Dict[str, Any]]]:
@@ -966,22 +1806,81 @@ def _clean_num_token(s: str) -> str:
     return s
 
 
-def _extract_rows_from_token_lines(
-    token_lines: List[List[str]],
-    min_numeric: int = 2,
-    max_cols: int = 10
-) -> List[List[str]]:
-    """Extract rows from tokenized lines: keep lines with >=min_numeric numeric tokens.
+NUM_TOKEN_CACHE_SIZE = 65536  # distinct tokens remembered by _classify_num_token
+
 
-    Returns rows as [label, num1, num2, ...].
+@functools.lru_cache(maxsize=NUM_TOKEN_CACHE_SIZE)
+def _classify_num_token(s: str) -> Tuple[str, bool]:
+    """(cleaned token, is numeric) for a PDF/OCR token, memoized.
+
+    The cleaned token is _clean_num_token(s); numeric means it matches
+    _NUM_TOKEN_RE. Values are read with _coerce_metric where needed.
     """
-    rows: List[List[str]] = []
-    for toks in token_lines:
-        toks = [t.strip() for t in toks if t.strip()]
-        if not toks:
-            continue
-        nums = [i for i,t in enumerate(toks) if _NUM_TOKEN_RE.match(_clean_num_token(t))]
-        if len(nums) < min_numeric:
+    cleaned = _clean_num_token(s)
+    return cleaned, bool(_NUM_TOKEN_RE.match(cleaned))
+
+
+def _is_num_token(s: str) -> bool:
+    return _classify_num_token(s)[1]
+
+
+def _benchmark_num_token_classifier(token_lines: List[List[str]], repeat: int = 3) -> Dict[str, Any]:
+    """Per-token cost of the row extractors' numeric checks: regex-per-call vs memoized."""
+    tokens = [t.strip() for ln in token_lines for t in ln if t.strip()]
+    if not tokens:
+        return {"tokens": 0}
+
+    def per_token_us(fn: Any) -> float:
+        best = None
+        for _ in range(max(1, repeat)):
+            t0 = time.perf_counter()
+            fn()
+            dt = time.perf_counter() - t0
+            best = dt if best is None else min(best, dt)
+        return round(1e6 * (best or 0.0) / len(tokens), 3)
+
+    def before() -> None:
+        # the old pattern: clean + match in the filter, then clean again for the values
+        for t in tokens:
+            if _NUM_TOKEN_RE.match(_clean_num_token(t)):
+                _clean_num_token(t)
+
+    # a private memoized copy, so the benchmark never evicts the live cache
+    classify = functools.lru_cache(maxsize=NUM_TOKEN_CACHE_SIZE)(_classify_num_token.__wrapped__)
+
+    def after() -> None:
+        for t in tokens:
+            classify(t)
+
+    cold = per_token_us(lambda: (classify.cache_clear(), after()))
+    return {
+        "tokens": len(tokens),
+        "distinct_tokens": len(set(tokens)),
+        "before_us_per_token": per_token_us(before),
+        "after_cold_us_per_token": cold,
+        "after_warm_us_per_token": per_token_us(after),
+    }
+
+
+def _extract_rows_from_token_lines(
+    token_lines: List[List[str]],
+    min_numeric: int = 2,
+    max_cols: int = 10,
+    line_numbers: Optional[List[int]] = None,
+) -> List[List[str]]:
+    """Extract rows from tokenized lines: keep lines with >=min_numeric numeric tokens.
+
+    Returns rows as [label, num1, num2, ...]; the index of the line each row came
+    from is appended to `line_numbers` when given.
+    """
+    rows: List[List[str]] = []
+    for ln_i, toks in enumerate(token_lines):
+        toks = [t.strip() for t in toks if t.strip()]
+        if not toks:
+            continue
+        classified = [_classify_num_token(t) for t in toks]
+        nums = [i for i, c in enumerate(classified) if c[1]]
+        if len(nums) < min_numeric:
             continue
         first_num = nums[0]
         label = " ".join(toks[:first_num]).strip()
@@ -989,13 +1888,74 @@ def _extract_rows_from_token_lines(
             # if label empty, treat first token as label
             label = toks[0]
             first_num = 1 if len(toks) > 1 else 0
-        values = [_clean_num_token(t) for t in toks[first_num:]]
+        values = [c[0] for c in classified[first_num:]]
         row = [label] + values
         row = row[:max_cols]
         rows.append(row)
+        if line_numbers is not None:
+            line_numbers.append(ln_i)
     return rows
 
 
+class _PhraseMatcher:
+    """Finds every occurrence of a fixed set of phrases in one regex pass.
+
+    The phrases are compiled once into a single alternation (longest first) and
+    matched against the upper-cased text, so a scan costs one pass over the text
+    however many phrases there are. Phrases contained in a longer match (e.g.
+    "REVENUE" in "PURCHASE REVENUE") are reported too, as the old per-label
+    substring checks did. `patterns` adds named regex fragments (e.g.
+    word-bounded phrases), written for upper-case text.
+    """
+
+    def __init__(self, phrases: List[str], patterns: Optional[Dict[str, str]] = None):
+        self._literals = {p.upper() for p in phrases}
+        self._patterns = [(name, re.compile(frag)) for name, frag in (patterns or {}).items()]
+        frags = [(p, re.escape(p)) for p in self._literals] + list((patterns or {}).items())
+        frags.sort(key=lambda kv: -len(kv[0]))
+        self._re = re.compile("|".join(f"(?:{frag})" for _, frag in frags))
+        self._contained = {
+            outer: [(m.start(), inner) for inner in self._literals if inner != outer for m in re.finditer(re.escape(inner), outer)]
+            for outer in self._literals
+        }
+
+    def _name(self, matched: str) -> str:
+        if matched in self._literals:
+            return matched
+        return next((name for name, rx in self._patterns if rx.fullmatch(matched)), matched)
+
+    def present(self, text: str) -> set:
+        """Set of phrases (pattern names) occurring in `text`."""
+        found = set()
+        for matched in self._re.findall((text or "").upper()):
+            name = self._name(matched)
+            found.add(name)
+            found.update(inner for _, inner in self._contained.get(name, ()))
+        return found
+
+    def find(self, text: str) -> List[Tuple[int, int, str]]:
+        """[(start, end, phrase), ...] in text order."""
+        out = []
+        for m in self._re.finditer((text or "").upper()):
+            name = self._name(m.group(0))
+            out.append((m.start(), m.end(), name))
+            for off, inner in self._contained.get(name, ()):
+                out.append((m.start() + off, m.start() + off + len(inner), inner))
+        out.sort()
+        return out
+
+
+# KPI tile labels, in the order tile labels are claimed when a label line has no column gaps
+_KPI_LABEL_ORDER = ("SESSIONS", "TOTAL USERS", "TRANSACTIONS", "CONVERSION RATE", "PURCHASE REVENUE", "REVENUE", "CLICKS",
+                    "IMPRESSIONS", "COST", "SPEND", "CONVERSIONS", "AVERAGE ORDER VALUE", "PURCHASE RATE")
+_KPI_LABEL_MATCHER = _PhraseMatcher(list(_KPI_LABEL_ORDER))
+_SECTION_HEADING_MATCHER = _PhraseMatcher(
+    ["NUMBER OF VISITORS", "SITE TRAFFIC", "NUMBER OF ORDERS", "CONVERSION RATE", "GOOGLE ADS", "MICROSOFT ADS", "TOP QUERIES"],
+    patterns={"SALES": r"\bSALES\b", "NOTES": r"\nNOTES"},
+)
+_BREAKDOWN_JUNK_LABELS = frozenset({"PREVIOU", "PREVIOUS", "PERIOD", "YEAR", "TOTAL", "REPORT", "ECO", "NOTES", "QUERIES", "CLICKS", "IMPRESSIONS", "AVG.", "CTR", "POSITION"})
+
+
 def _tokenize_text_lines(text: str) -> List[List[str]]:
     lines = []
     for ln in (text or "").splitlines():
@@ -1010,7 +1970,148 @@ def _tokenize_text_lines(text: str) -> List[List[str]]:
     return lines
 
 
-def _extract_pdf_section_tables(data: bytes, enable_ocr: bool = True) -> List[Dict[str, Any]]:
+WORD_GRID_MIN_ROWS = 2
+WORD_GRID_MIN_COLS = 2
+WORD_GRID_TIME_BUDGET_S = 2.0  # per page
+
+
+def _word_grid_tables(
+    words: List[Dict[str, Any]],
+    deadline_ts: Optional[float] = None,
+    min_rows: int = WORD_GRID_MIN_ROWS,
+    min_cols: int = WORD_GRID_MIN_COLS,
+) -> List[Dict[str, Any]]:
+    """Rebuild tables straight from word boxes (text layer or OCR, same page coordinates).
+
+    Words are binned into rows by y-centre and merged into cells where the
+    horizontal gap is small. Cells are then split into blocks by recursive
+    whitespace cuts (XY-cut): vertical gaps always separate blocks, horizontal
+    gaps only when the two sides do not share the same rows (otherwise they are
+    columns of one table). Each block becomes a grid whose columns are the
+    whitespace channels running through all of its rows. Returns previews in
+    the _df_to_preview shape; blocks not reached by `deadline_ts` (time.monotonic)
+    are dropped. Tables come out top-to-bottom, left-to-right.
+    """
+    try:
+        import numpy as np  # type: ignore
+    except Exception:
+        return []
+    words = [w for w in (words or []) if str(w.get("text") or "").strip()]
+    if len(words) < min_rows * min_cols:
+        return []
+
+    x0 = np.array([w["x0"] for w in words], dtype=float)
+    y0 = np.array([w["y0"] for w in words], dtype=float)
+    x1 = np.array([w["x1"] for w in words], dtype=float)
+    y1 = np.array([w["y1"] for w in words], dtype=float)
+    texts = np.array([str(w["text"]).strip() for w in words], dtype=object)
+    h = float(np.median(y1 - y0)) or 1.0
+
+    # rows: break the y-centre order wherever the jump exceeds half a line height
+    yc = (y0 + y1) / 2.0
+    order = np.argsort(yc, kind="stable")
+    row_of = np.empty(len(words), dtype=int)
+    row_of[order] = np.concatenate([[0], np.cumsum(np.diff(yc[order]) > 0.5 * h)])
+
+    # cells: within a row (left to right), a gap wider than ~one line height starts a new cell
+    order = np.lexsort((x0, row_of))
+    r, gx0, gx1 = row_of[order], x0[order], x1[order]
+    new_cell = np.ones(len(order), dtype=bool)
+    new_cell[1:] = (r[1:] != r[:-1]) | ((gx0[1:] - gx1[:-1]) > max(6.0, 0.9 * h))
+    starts = np.flatnonzero(new_cell)
+    cell_x0 = np.minimum.reduceat(gx0, starts)
+    cell_x1 = np.maximum.reduceat(gx1, starts)
+    cell_y0 = np.minimum.reduceat(y0[order], starts)
+    cell_y1 = np.maximum.reduceat(y1[order], starts)
+    cell_row = r[starts]
+    bounds = np.append(starts, len(order))
+    cell_text = [" ".join(texts[order[a:b]]) for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def split(idx: "np.ndarray", lo: "np.ndarray", hi: "np.ndarray", min_gap: float) -> List["np.ndarray"]:
+        """Split cells along one axis wherever no cell covers a gap wider than min_gap."""
+        o = idx[np.argsort(lo[idx], kind="stable")]
+        reach = np.maximum.accumulate(hi[o])
+        cuts = np.flatnonzero((lo[o][1:] - reach[:-1]) > min_gap) + 1
+        return np.split(o, cuts) if len(cuts) else [o]
+
+    blocks: List["np.ndarray"] = []
+    stack = [np.arange(len(starts))]
+    while stack:
+        if deadline_ts is not None and time.monotonic() > deadline_ts:
+            break
+        idx = stack.pop()
+        parts = split(idx, cell_y0, cell_y1, 1.2 * h)
+        if len(parts) > 1:
+            stack.extend(reversed(parts))
+            continue
+        # neighbouring column groups that share their rows belong to the same table
+        groups: List[Tuple["np.ndarray", set]] = []
+        for part in split(idx, cell_x0, cell_x1, 2.0 * h):
+            rows_p = set(cell_row[part].tolist())
+            if groups and len(groups[-1][1] & rows_p) >= 0.8 * max(len(groups[-1][1]), len(rows_p)):
+                groups[-1] = (np.concatenate([groups[-1][0], part]), groups[-1][1] | rows_p)
+            else:
+                groups.append((part, rows_p))
+        if len(groups) > 1:
+            stack.extend(reversed([g for g, _ in groups]))
+            continue
+        blocks.append(idx)
+
+    previews: List[Dict[str, Any]] = []
+    for idx in sorted(blocks, key=lambda b: (float(cell_y0[b].min()), float(cell_x0[b].min()))):
+        if deadline_ts is not None and time.monotonic() > deadline_ts:
+            break
+        rows = np.unique(cell_row[idx])
+        if len(rows) < min_rows:
+            continue
+        # columns: whitespace channels that run through every row of the block
+        cols = split(idx, cell_x0, cell_x1, 0.0)
+        if len(cols) < min_cols:
+            continue
+        col_of = {int(c): j for j, part in enumerate(cols) for c in part}
+        row_pos = {int(v): i for i, v in enumerate(rows)}
+        grid = [[""] * len(cols) for _ in rows]
+        for c in idx[np.argsort(cell_x0[idx], kind="stable")]:
+            i, j = row_pos[int(cell_row[c])], col_of[int(c)]
+            grid[i][j] = (grid[i][j] + " " + cell_text[c]).strip()
+        # identical tiles laid side by side share their rows: split on a repeating header
+        n_cols = len(cols)
+        period = next((q for q in range(min_cols, n_cols) if n_cols % q == 0 and any(grid[0])
+                       and all(grid[0][j] == grid[0][j % q] for j in range(n_cols))), n_cols)
+        for k in range(0, n_cols, period):
+            pv = _word_grid_preview([g[k:k + period] for g in grid])
+            if pv is not None:
+                previews.append(pv)
+    return previews
+
+
+def _word_grid_preview(grid: List[List[str]]) -> Optional[Dict[str, Any]]:
+    """Preview for one reconstructed grid, or None unless it has a numeric column."""
+    # a table needs a numeric column; prose blocks rarely have one
+    numeric_cols = sum(
+        1 for j in range(len(grid[0]))
+        if sum(1 for g in grid if _is_num_token(g[j])) >= max(1, len(grid) // 2)
+    )
+    if numeric_cols == 0:
+        return None
+    header = grid[0]
+    use_hdr = all(cell and not _is_num_token(cell) for cell in header) and len(set(header)) == len(header)
+    if use_hdr:
+        df = pd.DataFrame(grid[1:], columns=header)
+    else:
+        df = pd.DataFrame(grid, columns=[f"col_{j+1}" for j in range(len(header))])
+    if df.shape[0] == 0:
+        return None
+    return _df_to_preview(df)
+
+
+def _extract_pdf_section_tables(
+    data: Any,
+    enable_ocr: bool = True,
+    ocr_workers: Optional[int] = None,
+    ocr_deadline_s: Optional[float] = None,
+    stats: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
     """Extract 'clean table per section' best-effort from dashboard-style PDFs.
 
     Strategy:
@@ -1018,81 +2119,253 @@ def _extract_pdf_section_tables(data: bytes, enable_ocr: bool = True) -> List[Di
       - Optionally OCR each page to recover tile/chart text that isn't embedded.
       - Split into sections by known headings present in this report template.
       - For each section, produce one or more table previews.
-    """
-    previews: List[Dict[str, Any]] = []
 
-    # Load with fitz once (used for OCR rendering)
+    `data` may be raw bytes or a shared _PdfDocument. OCR runs page-parallel
+    (default OCR_MAX_WORKERS processes) within an overall deadline (default
+    OCR_DEADLINE_S seconds). OCR page / cache counters are added to `stats`.
+    """
+    pdf, owned = _as_pdf_document(data)
     try:
-        import fitz  # type: ignore
-    except Exception:
-        enable_ocr = False
-        fitz = None  # type: ignore
+        return _section_tables_from_document(pdf, enable_ocr=enable_ocr, ocr_workers=ocr_workers, ocr_deadline_s=ocr_deadline_s, stats=stats)
+    finally:
+        if owned:
+            pdf.close()
+
+
+PDF_TEMPLATE_CACHE_ENABLED = True
+PDF_TEMPLATE_CACHE_DIR = os.path.join(os.getcwd(), ".cache", "templates")
+PDF_TEMPLATE_CACHE_DISK_BYTES = 8 * 1024 * 1024
+PDF_TEMPLATE_MAX_PAGES = 40  # longer PDFs are not dashboards; don't fingerprint them
+PDF_TEMPLATE_PLAN_VERSION = "3"  # bump when the section-table heuristics or the plan format change
+PDF_TEMPLATE_ANCHOR_WINDOW = 8  # lines searched either side of a plan's recorded table start
 
-    # Baseline extracted text per page (pdfplumber tends to be best for this template)
-    page_texts: List[str] = []
+
+def _pdf_layout_fingerprint(pdf: "_PdfDocument") -> Optional[str]:
+    """Hash of a PDF's layout, stable across months of the same report template.
+
+    Built from page count and sizes, heading spans (text without digits, with
+    font and coarse position) and the coarse top-left anchors of text blocks.
+    Values (numbers) are left out, so next month's report of the same layout
+    gets the same fingerprint. None when PyMuPDF is missing or the PDF is long.
+    """
+    doc = pdf.fitz_doc()
+    if doc is None or not (0 < pdf.page_count <= PDF_TEMPLATE_MAX_PAGES):
+        return None
     try:
-        import pdfplumber  # type: ignore
-        with pdfplumber.open(io.BytesIO(data)) as pdf:
-            for p in pdf.pages:
-                page_texts.append(p.extract_text() or "")
+        features: List[Any] = [pdf.page_count]
+        for i in range(pdf.page_count):
+            page = doc.load_page(i)
+            blocks = page.get_text("dict").get("blocks") or []
+            headings = []
+            anchors = []
+            for b in blocks:
+                if b.get("type") != 0:
+                    continue
+                bx0, by0 = b["bbox"][0], b["bbox"][1]
+                anchors.append((int(bx0 // 20), int(by0 // 20)))
+                for ln in b.get("lines") or []:
+                    for sp in ln.get("spans") or []:
+                        t = (sp.get("text") or "").strip()
+                        if len(t) >= 3 and not any(ch.isdigit() for ch in t) and t.upper() == t:
+                            headings.append((t, sp.get("font", ""), round(float(sp.get("size", 0))), int(sp["bbox"][0] // 10), int(sp["bbox"][1] // 10)))
+            features.append([[round(page.rect.width), round(page.rect.height)], sorted(headings), sorted(set(anchors))])
+        return hashlib.sha256(json.dumps(features, sort_keys=True).encode("utf-8")).hexdigest()
     except Exception:
-        # fallback to fitz if pdfplumber unavailable
-        if fitz is None:
-            return previews
+        return None
+
+
+def _template_cache() -> "_DiskCache":
+    """Layout fingerprint -> section-table extraction plan (see _section_tables_from_document)."""
+    return _DiskCache(PDF_TEMPLATE_CACHE_DIR, PDF_TEMPLATE_CACHE_DISK_BYTES)
+
+
+def _template_cache_key(fingerprint: str) -> str:
+    return hashlib.sha256(f"{fingerprint}|{PDF_TEMPLATE_PLAN_VERSION}".encode("utf-8")).hexdigest()
+
+
+def _plan_tables(plan: Dict[str, Any]) -> set:
+    """{(page, table name)} a plan records."""
+    return {(str(page), str(name)) for page, names in (plan.get("tables_by_page") or {}).items() for name in (names or {})}
+
+
+def _line_anchor(tokens: List[str]) -> str:
+    """A table's start line without its numbers: the part that repeats month to month."""
+    return " ".join(t for t in tokens if not _classify_num_token(t)[1]).upper()
+
+
+def _section_tables_from_document(
+    pdf: _PdfDocument,
+    enable_ocr: bool = True,
+    ocr_workers: Optional[int] = None,
+    ocr_deadline_s: Optional[float] = None,
+    stats: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """Section tables for a parsed PDF, via a cached plan when its layout is a known template.
+
+    A plan records which page holds which section, which pages OCR adds text to
+    and which tables each page yields, with the line each table starts on and
+    that line's text without numbers (its anchor). Known layouts (same
+    _pdf_layout_fingerprint) skip section detection, the OCR page test and pages
+    that never produce tables, and run only the table extractors that worked
+    before, starting where the anchor is found near the recorded line (or at the
+    top of the page when it is not). If the plan misses any table it recorded,
+    the full heuristic pass runs and the plan is re-learned.
+    """
+    fingerprint = _pdf_layout_fingerprint(pdf) if PDF_TEMPLATE_CACHE_ENABLED else None
+    key = _template_cache_key(fingerprint) if fingerprint else None
+    if key:
         try:
-            with fitz.open(stream=data, filetype="pdf") as doc:
-                for i in range(len(doc)):
-                    page_texts.append(doc.load_page(i).get_text("text") or "")
+            plan = _template_cache().get(key)
         except Exception:
-            return previews
+            plan = None
+        if isinstance(plan, dict):
+            previews, found = _section_tables_run(pdf, enable_ocr, ocr_workers, ocr_deadline_s, stats, plan=plan)
+            if previews and _plan_tables(found) >= _plan_tables(plan):
+                _bump_stat(stats, "pdf_template_hits")
+                return previews
+        _bump_stat(stats, "pdf_template_misses")
+
+    previews, learned = _section_tables_run(pdf, enable_ocr, ocr_workers, ocr_deadline_s, stats)
+    if key and previews:
+        try:
+            _template_cache().put(key, learned)
+        except Exception:
+            pass
+    return previews
+
+
+def _section_tables_run(
+    pdf: _PdfDocument,
+    enable_ocr: bool,
+    ocr_workers: Optional[int],
+    ocr_deadline_s: Optional[float],
+    stats: Optional[Dict[str, Any]],
+    plan: Optional[Dict[str, Any]] = None,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """One section-table pass: heuristic (plan=None) or targeted by a cached plan.
+
+    Returns (previews, plan learned from this pass).
+    """
+    previews: List[Dict[str, Any]] = []
+    tables_by_page: Dict[int, Dict[str, List[Any]]] = {}  # page -> {table name: [first line, anchor]}
+    if plan is not None:
+        plan_tables = {
+            int(k): {str(n): (int(start[0]), str(start[1])) for n, start in (v or {}).items()}
+            for k, v in (plan.get("tables_by_page") or {}).items()
+        }
+        plan_sections = {int(k): v for k, v in (plan.get("section_by_page") or {}).items()}
+        plan_ocr = [int(i) for i in (plan.get("ocr_pages") or [])]
+
+    # fitz is only needed for OCR rendering (and as a text fallback)
+    if pdf.fitz_doc() is None:
+        enable_ocr = False
+
+    # Baseline extracted text per page (pdfplumber tends to be best for this template);
+    # with a plan, only the pages that hold tables are read
+    n_pages = pdf.page_count
+    wanted_pages = [i for i in range(n_pages) if plan is None or i in plan_tables]
+    page_texts: Optional[List[str]] = None
+    plumber = pdf.plumber_pdf()
+    if plumber is not None:
+        n_pages = len(plumber.pages)
+        page_texts = [""] * n_pages
+        for i in wanted_pages:
+            t = pdf.plumber_page_text(i)
+            if t is None:
+                page_texts = None
+                break
+            page_texts[i] = t
+    if page_texts is None:
+        # fallback to fitz if pdfplumber unavailable
+        if pdf.fitz_doc() is None:
+            return previews, {}
+        page_texts = [pdf.fitz_page_text(i) if i in wanted_pages else "" for i in range(pdf.page_count)]
 
     ocr_lines_by_page: List[List[List[str]]] = [[] for _ in range(len(page_texts))]
-    if enable_ocr and fitz is not None:
+    ocr_pages: List[int] = []
+    if enable_ocr:
         try:
-            with fitz.open(stream=data, filetype="pdf") as doc:
-                for i in range(len(doc)):
-                    base_t = page_texts[i] if i < len(page_texts) else ""
+            if plan is not None:
+                ocr_pages = [i for i in plan_ocr if i < len(page_texts)]
+            else:
+                for i in range(min(pdf.page_count, len(page_texts))):
+                    base_t = page_texts[i]
                     digit_count = sum(1 for ch in (base_t or "") if ch.isdigit())
                     should_ocr = ("..." in (base_t or "")) or (digit_count < 80)
-                    if not should_ocr:
-                        continue
-                    words = _ocr_pdf_page_words(doc, i, zoom=2.0, timeout_s=20)
-                    # keep only reasonable confidence words; allow -1 (unknown) but prefer >=40
-                    words2 = [w for w in words if (w.get("conf", -1) >= 40) or (w.get("conf", -1) == -1)]
-                    lines = _words_to_lines(words2, y_tol=12.0)
-                    token_lines = [[w["text"] for w in ln] for ln in lines]
-                    ocr_lines_by_page[i] = token_lines
+                    if should_ocr:
+                        ocr_pages.append(i)
+            words_by_page = _ocr_pages(pdf, ocr_pages, zoom=2.0, timeout_s=OCR_PAGE_TIMEOUT_S, workers=ocr_workers, deadline_s=ocr_deadline_s, stats=stats)
+            # merge back in page order so the section/KPI heuristics stay deterministic
+            for i in sorted(words_by_page):
+                words = words_by_page[i] or []
+                # keep only reasonable confidence words; allow -1 (unknown) but prefer >=40
+                words2 = [w for w in words if (w.get("conf", -1) >= 40) or (w.get("conf", -1) == -1)]
+                if not words2:
+                    continue
+                # OCR words are in page points: line them up with the text layer so an image
+                # value lands on the same line as its text label; lines without any OCR word
+                # are already covered by the base text
+                ocr_ids = set(id(w) for w in words2)
+                lines = _words_to_lines(_merge_ocr_words(pdf.words(i), words2), y_tol=6.0)
+                token_lines = [[w["text"] for w in ln] for ln in lines if any(id(w) in ocr_ids for w in ln)]
+                ocr_lines_by_page[i] = token_lines
         except Exception:
             pass
 
     # Section identification (by page; this report is consistent)
     section_by_page = {}
     for i, t in enumerate(page_texts):
+        if plan is not None:
+            section_by_page[i] = plan_sections.get(i, f"Page {i+1}")
+            continue
         tt = (t or "").upper()
-        if "NUMBER OF VISITORS" in tt and "SITE TRAFFIC" in tt:
+        found = _SECTION_HEADING_MATCHER.present(tt)
+        if "NUMBER OF VISITORS" in found and "SITE TRAFFIC" in found:
             section_by_page[i] = "Site Traffic"
-        elif "NUMBER OF ORDERS" in tt:
+        elif "NUMBER OF ORDERS" in found:
             section_by_page[i] = "Orders"
-        elif "CONVERSION RATE" in tt:
+        elif "CONVERSION RATE" in found:
             section_by_page[i] = "Conversion Rate"
-        elif re.search(r"\bSALES\b", tt):
+        elif "SALES" in found:
             section_by_page[i] = "Sales"
-        elif "GOOGLE ADS" in tt:
+        elif "GOOGLE ADS" in found:
             section_by_page[i] = "Google Ads"
-        elif "MICROSOFT ADS" in tt:
+        elif "MICROSOFT ADS" in found:
             section_by_page[i] = "Microsoft Ads"
-        elif "TOP QUERIES" in tt or "\nNOTES" in tt or tt.strip().startswith("NOTES"):
+        elif "TOP QUERIES" in found or "NOTES" in found or tt.strip().startswith("NOTES"):
             section_by_page[i] = "Notes & Top Queries"
         else:
             section_by_page[i] = f"Page {i+1}"
 
-    def add_preview(section: str, table_name: str, df: "pd.DataFrame"):
+    def add_preview(section: str, table_name: str, df: "pd.DataFrame", line: int):
         pv = _df_to_preview(df)
         pv["section"] = section
         pv["table_name"] = table_name
         previews.append(pv)
+        tables_by_page.setdefault(i, {})[table_name] = [line, _line_anchor(merged_lines[line]) if line < len(merged_lines) else ""]
 
     for i, base_text in enumerate(page_texts):
+        if plan is not None and i not in plan_tables:
+            continue
+        wanted = plan_tables[i] if plan is not None else None
+
+        def plan_line(*names: str) -> int:
+            """Where the named tables start on this page: the line near the recorded one that
+            carries the recorded anchor; 0 (scan the whole page) without a plan or a match."""
+            if wanted is None:
+                return 0
+            starts = []
+            for n in names:
+                if n not in wanted:
+                    continue
+                line, anchor = wanted[n]
+                near = sorted(range(max(0, line - PDF_TEMPLATE_ANCHOR_WINDOW), min(len(merged_lines), line + PDF_TEMPLATE_ANCHOR_WINDOW + 1)), key=lambda j: abs(j - line))
+                hit = next((j for j in near if anchor and _line_anchor(merged_lines[j]) == anchor), None)
+                if hit is None:
+                    return 0
+                starts.append(hit)
+            return min(starts or [0])
+
         section = section_by_page.get(i, f"Page {i+1}")
 
         base_lines = _tokenize_text_lines(base_text)
@@ -1107,37 +2380,28 @@ def _extract_pdf_section_tables(data: bytes, enable_ocr: bool = True) -> List[Di
 
         # --- KPI tiles (generic) ---
         # Look for lines that contain multiple known KPI labels; next line often contains the values.
-        kpi_labels = ["SESSIONS","TOTAL USERS","TRANSACTIONS","PURCHASE REVENUE","REVENUE","CONVERSIONS","CLICKS","IMPRESSIONS","COST","SPEND","AVERAGE ORDER VALUE","PURCHASE RATE","CONVERSION RATE"]
         kpi_rows = []
-        for idx_ln, ln in enumerate(merged_lines[:-1]):
-            up = " ".join(ln).upper()
-            if any(lbl in up for lbl in kpi_labels) and sum(1 for lbl in kpi_labels if lbl in up) >= 2:
-                labels = [tok for tok in re.split(r"\s{1,}", up) if tok.strip()]
-                # Use the raw line tokens rather than split again
-                label_line = " ".join(ln)
+        kpi_line = 0
+        for idx_ln in range(plan_line("KPIs"), len(merged_lines) - 1) if (wanted is None or "KPIs" in wanted) else []:
+            ln = merged_lines[idx_ln]
+            # Use the raw line tokens rather than split again
+            label_line = " ".join(ln)
+            if len(_KPI_LABEL_MATCHER.present(label_line)) >= 2:
                 val_line = " ".join(merged_lines[idx_ln+1])
-                # crude: split labels by double spaces in base extraction; if not, fall back to known sequence
-                # We'll detect label chunks by scanning for known phrases in order.
-                chunks = []
-                tmp = label_line
-                # prioritize longer labels
-                ordered = sorted(set(kpi_labels), key=lambda s: -len(s))
-                found = []
-                for lbl in ordered:
-                    if lbl.lower() in tmp.lower():
-                        found.append(lbl)
                 # For this template, the line is usually the labels in order. We'll just use the tokens in ln grouped by "  " if present in base line
                 chunks = re.split(r"\s{2,}", label_line.strip())
                 if len(chunks) <= 1:
-                    # fallback: split by known labels occurrences
+                    # fallback: known labels in their canonical order, each claiming its first
+                    # occurrence that an earlier label has not already claimed
                     chunks = []
-                    rest = label_line
-                    for lbl in ["SESSIONS","TOTAL USERS","TRANSACTIONS","CONVERSION RATE","PURCHASE REVENUE","REVENUE","CLICKS","IMPRESSIONS","COST","SPEND","CONVERSIONS","AVERAGE ORDER VALUE","PURCHASE RATE"]:
-                        if lbl.lower() in rest.lower():
-                            chunks.append(lbl)
-                            # remove first occurrence
-                            rest = re.sub(re.escape(lbl), "", rest, flags=re.I, count=1).strip()
-                    chunks = [c.strip() for c in chunks if c.strip()]
+                    hits = _KPI_LABEL_MATCHER.find(label_line)
+                    claimed: List[Tuple[int, int]] = []
+                    for lbl in _KPI_LABEL_ORDER:
+                        for start, end, hit in hits:
+                            if hit == lbl and not any(start < c_end and c_start < end for c_start, c_end in claimed):
+                                chunks.append(lbl)
+                                claimed.append((start, end))
+                                break
                 val_chunks = re.split(r"\s{2,}", val_line.strip())
                 if len(val_chunks) < len(chunks):
                     val_chunks = val_line.split()
@@ -1145,20 +2409,25 @@ def _extract_pdf_section_tables(data: bytes, enable_ocr: bool = True) -> List[Di
                 for j, lbl in enumerate(chunks):
                     val = val_chunks[j] if j < len(val_chunks) else ""
                     if lbl.strip() and val.strip():
-                        kpi_rows.append([lbl.strip(), _clean_num_token(val.strip())])
+                        kpi_rows.append([lbl.strip(), _classify_num_token(val.strip())[0]])
                 if kpi_rows:
+                    kpi_line = idx_ln
                     break
         if kpi_rows:
             df = pd.DataFrame(kpi_rows, columns=["Metric", "Current"])
-            add_preview(section, "KPIs", df)
+            add_preview(section, "KPIs", df, kpi_line)
 
         # --- Common breakdown tables (label + value + optional delta) ---
         # Extract rows with at least 1 numeric token; but keep label/value shapes.
-        breakdown_rows = _extract_rows_from_token_lines(merged_lines, min_numeric=1, max_cols=6)
+        wants_breakdown = wanted is None or bool(wanted.keys() & {"By Source / Medium", "By Channel"})
+        first = plan_line("By Source / Medium", "By Channel")
+        row_lines: List[int] = []
+        breakdown_rows = _extract_rows_from_token_lines(merged_lines[first:], min_numeric=1, max_cols=6, line_numbers=row_lines) if wants_breakdown else []
         # Filter out obvious junk headers
-        junk = {"PREVIOU", "PREVIOUS", "PERIOD", "YEAR", "TOTAL", "REPORT", "ECO", "NOTES", "QUERIES", "CLICKS", "IMPRESSIONS", "AVG.", "CTR", "POSITION"}
+        junk = _BREAKDOWN_JUNK_LABELS
         cleaned = []
-        for r in breakdown_rows:
+        cleaned_lines: List[int] = []
+        for r, r_ln in zip(breakdown_rows, row_lines):
             lab = (r[0] or "").strip()
             if not lab:
                 continue
@@ -1168,44 +2437,52 @@ def _extract_pdf_section_tables(data: bytes, enable_ocr: bool = True) -> List[Di
             if any(lab.upper() == (kr[0].upper() if kr else "") for kr in kpi_rows):
                 continue
             cleaned.append(r)
+            cleaned_lines.append(first + r_ln)
 
         if cleaned:
             # Heuristic: if many rows contain "/" it's likely Source/Medium table
             slash_ratio = sum(1 for r in cleaned if "/" in r[0]) / float(len(cleaned))
             if slash_ratio >= 0.3:
                 # keep only rows with slash
-                rows2 = [r for r in cleaned if "/" in r[0]]
+                rows2 = [(r, r_ln) for r, r_ln in zip(cleaned, cleaned_lines) if "/" in r[0]]
                 if rows2:
-                    maxlen = max(len(r) for r in rows2)
+                    maxlen = max(len(r) for r, _ in rows2)
                     cols = ["Source / Medium"] + [f"Value {k}" for k in range(1, maxlen)]
-                    df = pd.DataFrame([r + [""]*(maxlen-len(r)) for r in rows2], columns=cols)
-                    add_preview(section, "By Source / Medium", df)
+                    df = pd.DataFrame([r + [""]*(maxlen-len(r)) for r, _ in rows2], columns=cols)
+                    add_preview(section, "By Source / Medium", df, rows2[0][1])
 
             # Channel tables often have short labels without "/"
-            chan_rows = [r for r in cleaned if ("/" not in r[0]) and (len(r[0]) <= 24) and re.search(r"[A-Za-z]", r[0])]
+            chan_rows = [(r, r_ln) for r, r_ln in zip(cleaned, cleaned_lines) if ("/" not in r[0]) and (len(r[0]) <= 24) and re.search(r"[A-Za-z]", r[0])]
             if len(chan_rows) >= 3:
-                maxlen = max(len(r) for r in chan_rows)
+                maxlen = max(len(r) for r, _ in chan_rows)
                 cols = ["Channel"] + [f"Value {k}" for k in range(1, maxlen)]
-                df = pd.DataFrame([r + [""]*(maxlen-len(r)) for r in chan_rows], columns=cols)
-                add_preview(section, "By Channel", df)
+                df = pd.DataFrame([r + [""]*(maxlen-len(r)) for r, _ in chan_rows], columns=cols)
+                add_preview(section, "By Channel", df, chan_rows[0][1])
 
         # --- Notes & Top Queries (page 7) ---
-        if section == "Notes & Top Queries":
+        if section == "Notes & Top Queries" and (wanted is None or bool(wanted.keys() & {"Notes", "Top Queries"})):
             # Notes: lines beginning with digit
             note_rows = []
-            for ln in merged_lines:
+            note_line = 0
+            for idx_ln in range(plan_line("Notes"), len(merged_lines)):
+                ln = merged_lines[idx_ln]
                 if len(ln) >= 2 and re.match(r"^\d+$", ln[0]):
+                    if not note_rows:
+                        note_line = idx_ln
                     note_rows.append([ln[0], " ".join(ln[1:]).strip()])
             if note_rows:
-                add_preview(section, "Notes", pd.DataFrame(note_rows, columns=["#", "Note"]))
+                add_preview(section, "Notes", pd.DataFrame(note_rows, columns=["#", "Note"]), note_line)
 
             # Top queries: look for rows with >=4 numeric tokens
             tq_rows = []
             in_tq = False
-            for ln in merged_lines:
+            tq_line = 0
+            for idx_ln in range(plan_line("Top Queries"), len(merged_lines)):
+                ln = merged_lines[idx_ln]
                 s = " ".join(ln)
                 if "TOP" in s.upper() and "QUER" in s.upper():
                     in_tq = True
+                    tq_line = idx_ln
                     continue
                 if not in_tq:
                     continue
@@ -1213,13 +2490,13 @@ def _extract_pdf_section_tables(data: bytes, enable_ocr: bool = True) -> List[Di
                 if "OTES" in s.upper() or s.strip().upper() == "NOTES":
                     break
                 toks = [t.strip() for t in ln if t.strip()]
-                nums = [t for t in toks if _NUM_TOKEN_RE.match(_clean_num_token(t))]
-                if len(nums) >= 4:
-                    # find first numeric index
-                    idxs = [ii for ii,t in enumerate(toks) if _NUM_TOKEN_RE.match(_clean_num_token(t))]
+                classified = [_classify_num_token(t) for t in toks]
+                idxs = [ii for ii, c in enumerate(classified) if c[1]]
+                if len(idxs) >= 4:
+                    # first numeric index
                     first = idxs[0]
                     query = " ".join(toks[:first]).strip()
-                    vals = [_clean_num_token(t) for t in toks[first:]]
+                    vals = [c[0] for c in classified[first:]]
                     if query:
                         tq_rows.append([query]+vals)
             if tq_rows:
@@ -1227,9 +2504,16 @@ def _extract_pdf_section_tables(data: bytes, enable_ocr: bool = True) -> List[Di
                 cols = ["Query","Clicks","Δ Clicks","Impressions","Δ Impressions","CTR","Δ CTR","Avg Position","Δ Avg Position"][:maxlen]
                 # pad
                 df = pd.DataFrame([r+[""]*(maxlen-len(r)) for r in tq_rows], columns=cols)
-                add_preview(section, "Top Queries", df)
-
-    return previews
+                add_preview(section, "Top Queries", df, tq_line)
+
+    # OCR pages worth revisiting: those OCR added lines to (or every candidate, if no OCR engine ran)
+    ocr_useful = [i for i, lines in enumerate(ocr_lines_by_page) if lines]
+    learned = {
+        "section_by_page": {str(i): section_by_page[i] for i in tables_by_page},
+        "tables_by_page": {str(i): dict(sorted(names.items())) for i, names in tables_by_page.items()},
+        "ocr_pages": ocr_useful if (ocr_useful or _get_ocr_backend() is not None) else ocr_pages,
+    }
+    return previews, learned
 
 
 
@@ -1242,6 +2526,304 @@ def _extract_docx_text(data: bytes) -> str:
     except Exception:
         return ""
 
+# ---------- Metric coercion ----------
+# Exports write the same metric many ways: "12.5%", "$1,204.33", "(3.2%)", "1.2K",
+# "1.234,5", "—". _coerce_metric reads one cell; _coerce_numeric a whole column.
+METRIC_UNITS = ("number", "percent", "currency")  # unit tags, in tie-break order
+METRIC_NULL_TOKENS = {"-", "--", "—", "–", "−", "n/a", "na", "nan", "none", "null"}
+METRIC_SUFFIXES = {"k": 1e3, "m": 1e6, "b": 1e9}
+_METRIC_CURRENCY_RE = re.compile(r"(?:US|CA|AU|NZ|HK|A|C)?[$€£¥₹]|\b(?:USD|EUR|GBP|CAD|AUD|JPY|INR)\b", re.I)
+_DIGIT_RE = re.compile(r"\d")
+_METRIC_BODY_RE = re.compile(r"\d[\d.,]*|[.,]\d+")
+_THOUSANDS_COMMA_RE = re.compile(r"\d{1,3}(?:,\d{3})+")
+_THOUSANDS_DOT_RE = re.compile(r"\d{1,3}(?:\.\d{3})+")
+
+
+def _metric_blank(s: str) -> bool:
+    """Blank cell or an export's "no value" marker (dashes, n/a)."""
+    s = s.strip()
+    return not s or s.lower() in METRIC_NULL_TOKENS
+
+
+def _metric_decimal(body: str) -> Optional[float]:
+    """Digits with locale separators: "1,234.5", "1.234,5", "1234,5" and "1,234" (thousands)."""
+    if "," in body and "." in body:
+        # the last separator is the decimal point
+        if body.rfind(",") > body.rfind("."):
+            body = body.replace(".", "").replace(",", ".")
+        else:
+            body = body.replace(",", "")
+    elif "," in body:
+        if _THOUSANDS_COMMA_RE.fullmatch(body):
+            body = body.replace(",", "")
+        elif body.count(",") == 1:
+            body = body.replace(",", ".")
+        else:
+            return None
+    elif body.count(".") > 1:
+        if not _THOUSANDS_DOT_RE.fullmatch(body):
+            return None
+        body = body.replace(".", "")
+    try:
+        return float(body)
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=NUM_TOKEN_CACHE_SIZE)
+def _coerce_metric_str(s: str) -> Tuple[Optional[float], str]:
+    s = s.strip()
+    try:
+        v = float(s)
+        return (None, "") if v != v else (v, "number")
+    except ValueError:
+        pass
+    t = s.replace("\u00a0", " ").replace("\u202f", " ")
+    if _metric_blank(t) or not _DIGIT_RE.search(t):
+        return None, ""
+    neg = False
+    if t.startswith("(") and t.endswith(")"):
+        neg, t = True, t[1:-1].strip()
+    unit = "number"
+    stripped = _METRIC_CURRENCY_RE.sub("", t)
+    if stripped != t:
+        unit, t = "currency", stripped.strip()
+    if t[:1] in ("+", "-", "−", "–"):
+        neg, t = neg != (t[0] != "+"), t[1:].strip()
+    pct = t.endswith("%")
+    if pct:
+        unit, t = "percent", t[:-1].strip()
+    scale = 1.0
+    if t[-1:].lower() in METRIC_SUFFIXES:
+        scale, t = METRIC_SUFFIXES[t[-1].lower()], t[:-1].strip()
+    t = t.replace(" ", "").replace("'", "")
+    if not _METRIC_BODY_RE.fullmatch(t):
+        return None, ""
+    v = _metric_decimal(t)
+    if v is None:
+        return None, ""
+    v = v * scale / 100.0 if pct else v * scale
+    return (-v if neg else v), unit
+
+
+def _coerce_metric(x: Any) -> Tuple[Optional[float], str]:
+    """(value, unit) for one exported metric cell; (None, "") when it isn't a number.
+
+    "12.5%" -> 0.125 (percent), "$1,204.33" / "€1.204,33" -> 1204.33 (currency),
+    "(3.2%)" and "-3.2%" are negative, "1.2K" / "3M" / "2B" are scaled and
+    "1.234,5" / "1 234,5" use locale separators. Dashes and "n/a" are blanks;
+    booleans are not numbers.
+    """
+    if x is None or isinstance(x, bool):
+        return None, ""
+    if isinstance(x, (int, float)):
+        v = float(x)
+        return (None, "") if v != v else (v, "number")
+    return _coerce_metric_str(x if isinstance(x, str) else str(x))
+
+
+# shapes _parse_metric_strings handles: "(", sign, currency symbol, plain or comma-grouped digits, K/M/B, "%", ")"
+_METRIC_SIMPLE_RE = re.compile(
+    r"^\s*(\()? *([+-])? *([$€£¥₹])? *(\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?) *([kKmMbB])? *(%)? *(\))?\s*\Z")
+
+
+def _parse_metric_strings(strs: List[str]) -> Tuple[Any, Any, Any]:
+    """Vectorized _coerce_metric over strings: (values, unit codes, parsed mask).
+
+    One anchored regex (pandas .str.extract) splits the common export shapes into
+    their parts; the values are then whole-column operations. Anything else (locale
+    separators, currency codes, dash signs, words, ...) is left unparsed (mask
+    False) for _coerce_metric, so both paths agree cell for cell.
+    """
+    import numpy as np  # type: ignore
+    import pandas as pd  # type: ignore
+    n = len(strs)
+    values = np.full(n, np.nan)
+    units = np.zeros(n, dtype=np.int8)
+    if not n:
+        return values, units, np.zeros(0, dtype=bool)
+    parts = pd.Series(strs, dtype=object).str.extract(_METRIC_SIMPLE_RE)
+    lpar, rpar = parts[0].notna().to_numpy(), parts[6].notna().to_numpy()
+    ok = parts[3].notna().to_numpy() & (lpar == rpar)
+    if not ok.any():
+        return values, units, ok
+    parts = parts[ok]
+    v = parts[3].str.replace(",", "", regex=False).astype(float).to_numpy()
+    v = v * parts[4].str.lower().map(METRIC_SUFFIXES).fillna(1.0).to_numpy(dtype=float)
+    pct = parts[5].notna().to_numpy()
+    v = np.where(pct, v / 100.0, v)
+    neg = lpar[ok] != (parts[1] == "-").to_numpy()
+    values[ok] = np.where(neg, -v, v)
+    unit = np.where(parts[2].notna().to_numpy(), METRIC_UNITS.index("currency"), METRIC_UNITS.index("number"))
+    units[ok] = np.where(pct, METRIC_UNITS.index("percent"), unit)
+    return values, units, ok
+
+
+def _coerce_numeric(values: Any) -> Tuple[Any, str]:
+    """Column version of _coerce_metric: (float64 array, unit tag).
+
+    Each distinct cell is coerced once (pandas factorize, unless the column is mostly
+    distinct anyway) and scattered back by its codes; strings go through _parse_metric_strings and only the shapes it
+    leaves unparsed fall back to _coerce_metric. NaN marks blanks and non-numbers.
+    The unit is the most common one among the parsed cells, or "" when nothing
+    parsed or some non-blank cell isn't a number.
+    """
+    import numpy as np  # type: ignore
+    import pandas as pd  # type: ignore
+    if isinstance(values, pd.Series) and values.dtype.kind in "iuf":
+        values = values.to_numpy()
+    if isinstance(values, np.ndarray) and values.dtype.kind in "iuf":
+        out = np.array(values, dtype=float)
+        return out, ("number" if (~np.isnan(out)).any() else "")
+    s = values.astype(object) if isinstance(values, pd.Series) else pd.Series(values if isinstance(values, list) else list(values), dtype=object)
+    if len(s) > 4096 and s.iloc[:2048].nunique() > 1843:
+        # mostly distinct values: factorizing wouldn't shrink the work
+        missing = s.isna().to_numpy()
+        codes, uniques = np.where(missing, -1, np.arange(len(s))), s.where(~missing, "")
+    else:
+        codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    all_str = pd.api.types.infer_dtype(uniques, skipna=False) == "string"
+    uniques = uniques.tolist()
+    vals = np.full(len(uniques) + 1, np.nan)  # the last slot is for missing cells (code -1)
+    tags = np.zeros(len(uniques) + 1, dtype=np.int8)
+    done = np.zeros(len(uniques), dtype=bool)
+    strs = range(len(uniques)) if all_str else [j for j, u in enumerate(uniques) if isinstance(u, str)]
+    if len(strs):
+        idx = np.arange(len(uniques)) if all_str else np.array(strs)
+        v, t, ok = _parse_metric_strings(uniques if all_str else [uniques[j] for j in strs])
+        vals[idx[ok]], tags[idx[ok]], done[idx[ok]] = v[ok], t[ok], True
+    failed = False
+    for j in np.flatnonzero(~done):
+        v, unit = _coerce_metric(uniques[j])
+        if v is None:
+            failed = failed or not (isinstance(uniques[j], str) and _metric_blank(uniques[j]))
+        else:
+            vals[j], tags[j] = v, METRIC_UNITS.index(unit)
+    out, units = vals[codes], tags[codes]
+    parsed = ~np.isnan(out)
+    if failed or not parsed.any():
+        return out, ""
+    return out, METRIC_UNITS[int(np.argmax(np.bincount(units[parsed], minlength=len(METRIC_UNITS))))]
+
+
+COLUMNAR_TABLES = True  # spreadsheet/CSV previews are _ColumnarTable (typed columns, rows built lazily)
+
+
+class _ColumnarTable(MutableMapping):
+    """Column-oriented table preview: typed NumPy numeric columns, interned strings otherwise.
+
+    Built once at ingestion from the typed preview frame. It reads like the legacy
+    preview dict ({"shape", "headers", "rows", "truncated", "numeric_stats", ...}),
+    but the list-of-string "rows" are only materialized on first access (UI, JSON
+    payloads). Data-signal passes use `num(j)` / `text(j)` to work column-wise.
+    """
+
+    def __init__(self, headers: List[str], columns: List[Any], n_rows: int, meta: Optional[Dict[str, Any]] = None):
+        self.headers = [str(h) for h in headers]
+        self.columns = columns  # per column: np.ndarray (numeric dtype) or List[str]
+        self.n_rows = int(n_rows)
+        self.meta = dict(meta or {})  # shape / truncated / numeric_stats / gsc_aggregate / ...
+        self._num: Dict[int, Any] = {}
+        self._unit: Dict[int, str] = {}
+        self._text: Dict[int, List[str]] = {}
+        self._rows: Optional[List[List[str]]] = None
+        self.schema: Optional[Dict[str, Any]] = None  # column roles, set by _table_schema
+
+    @classmethod
+    def from_frame(cls, dfp: Any, meta: Optional[Dict[str, Any]] = None) -> "_ColumnarTable":
+        """From the (already row/column capped) preview DataFrame, keeping numeric dtypes."""
+        import pandas as pd  # type: ignore
+        columns: List[Any] = []
+        for j in range(dfp.shape[1]):
+            col = dfp.iloc[:, j]
+            if pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_bool_dtype(col):
+                columns.append(col.to_numpy(copy=True))
+            else:
+                # astype(str) leaves NaT as NaN in datetime columns with gaps
+                columns.append([sys.intern(v) if isinstance(v, str) else "" for v in col.fillna("").astype(str).tolist()])
+        return cls([str(c) for c in dfp.columns.tolist()], columns, dfp.shape[0], meta)
+
+    @classmethod
+    def from_rows(cls, headers: List[Any], rows: List[Any]) -> "_ColumnarTable":
+        """From legacy rows (lists, or dicts keyed by header); missing cells are blank."""
+        hs = [str(h) for h in headers]
+        columns: List[Any] = [[] for _ in hs]
+        for r in rows or []:
+            for j, h in enumerate(hs):
+                if isinstance(r, Mapping):
+                    v = r.get(h, "")
+                else:
+                    v = r[j] if j < len(r) else ""
+                columns[j].append(sys.intern("" if v is None else str(v)))
+        return cls(hs, columns, len(rows or []))
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {"headers": self.headers, "columns": self.columns, "n_rows": self.n_rows, "meta": self.meta}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(state["headers"], state["columns"], state["n_rows"], state["meta"])
+
+    def text(self, j: int) -> List[str]:
+        """Column j as the preview strings ("" for blanks)."""
+        col = self.columns[j]
+        if isinstance(col, list):
+            return col
+        if j not in self._text:
+            import pandas as pd  # type: ignore
+            self._text[j] = pd.Series(col).fillna("").astype(str).tolist()
+        return self._text[j]
+
+    def num(self, j: int) -> Any:
+        """Column j as float64 via _coerce_numeric (NaN where the cell is blank or not a number)."""
+        if j not in self._num:
+            self._num[j], self._unit[j] = _coerce_numeric(self.columns[j])
+        return self._num[j]
+
+    def unit(self, j: int) -> str:
+        """_coerce_numeric's unit tag for column j ("number", "percent", "currency" or "")."""
+        self.num(j)
+        return self._unit[j]
+
+    def rows(self) -> List[List[str]]:
+        if self._rows is None:
+            if self.columns:
+                self._rows = [list(r) for r in zip(*(self.text(j) for j in range(len(self.columns))))]
+            else:
+                self._rows = [[] for _ in range(self.n_rows)]
+        return self._rows
+
+    def to_preview(self) -> Dict[str, Any]:
+        """The legacy preview dict."""
+        return dict(self)
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "headers":
+            return self.headers
+        if key == "rows":
+            return self.rows()
+        return self.meta[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in ("headers", "rows"):
+            raise KeyError(f"{key} is derived from the columns")
+        self.meta[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        del self.meta[key]
+
+    def __iter__(self):
+        if "shape" in self.meta:
+            yield "shape"
+        yield "headers"
+        yield "rows"
+        for k in self.meta:
+            if k != "shape":
+                yield k
+
+    def __len__(self) -> int:
+        return len(self.meta) + 2
+
+
 def _df_preview(df) -> Dict[str, Any]:
     try:
         import pandas as pd  # type: ignore
@@ -1251,25 +2833,804 @@ def _df_preview(df) -> Dict[str, Any]:
         truncated = df2.shape[0] > MAX_TABLE_ROWS
         dfp = df2.head(MAX_TABLE_ROWS) if truncated else df2
         headers = [str(c) for c in dfp.columns.tolist()]
-        rows = dfp.fillna("").astype(str).values.tolist()
-        # light numeric stats for hinting
-        numeric_cols = [c for c in df2.columns if pd.api.types.is_numeric_dtype(df2[c])]
+        # light numeric stats for hinting: numeric columns, and text columns that are all
+        # metric strings ("12.5%", "$1,204") with their _coerce_numeric unit
         stats = {}
-        for c in numeric_cols[:12]:
-            col = df2[c].dropna()
-            if len(col) == 0:
-                continue
-            stats[str(c)] = {"min": float(col.min()), "max": float(col.max()), "mean": float(col.mean())}
+        n_numeric = 0
+        for c in df2.columns:
+            if n_numeric >= 12:
+                break
+            col = df2[c]
+            if pd.api.types.is_numeric_dtype(col):
+                n_numeric += 1
+                col = col.dropna()
+                if len(col) == 0:
+                    continue
+                stats[str(c)] = {"min": float(col.min()), "max": float(col.max()), "mean": float(col.mean())}
+            elif (col.dtype == object or pd.api.types.is_string_dtype(col)) and _coerce_numeric(col.dropna().head(64))[1]:
+                values, unit = _coerce_numeric(col)
+                if not unit:
+                    continue
+                n_numeric += 1
+                col = pd.Series(values).dropna()
+                stats[str(c)] = {"min": float(col.min()), "max": float(col.max()), "mean": float(col.mean()), "unit": unit}
+        meta = {"shape": [int(df.shape[0]), int(df.shape[1])], "truncated": bool(truncated), "numeric_stats": stats}
+        if COLUMNAR_TABLES:
+            return _ColumnarTable.from_frame(dfp, meta)
         return {
-            "shape": [int(df.shape[0]), int(df.shape[1])],
+            "shape": meta["shape"],
             "headers": headers,
-            "rows": rows,
-            "truncated": bool(truncated),
+            "rows": dfp.fillna("").astype(str).values.tolist(),
+            "truncated": meta["truncated"],
             "numeric_stats": stats,
         }
     except Exception as e:
         return {"error": str(e)}
 
+XLSX_STREAMING = True  # stream .xlsx sheets (openpyxl read-only) instead of building DataFrames
+XLSX_MAX_SHEETS = 12
+XLSX_LAZY_SHEETS = True  # in GSC workbooks, only fully parse the sheets the data signals read
+GSC_SHEET_NAMES = {"chart", "queries", "pages", "countries", "devices", "search appearance", "filters"}
+GSC_CONSUMED_KINDS = {"chart", "queries", "pages", "countries", "devices", "search_appearance"}
+
+
+# Cell strings pandas.read_excel reads as NaN by default (its na_values)
+XLSX_NA_STRINGS = frozenset({
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+})
+
+
+class _StreamingTablePreview:
+    """Builds a _df_preview-shaped preview from sheet rows in one pass, in bounded memory.
+
+    Feed every row of the sheet (the first row is the header) to `add_row`; only
+    the first MAX_TABLE_ROWS data rows are kept, while per-column type counts and
+    numeric min/max/sum run over all rows. `preview()` mirrors what
+    pandas.read_excel + _df_preview produce: trailing blank rows/cells trimmed,
+    rows padded to the widest row, integral floats read as ints, "Unnamed: i" /
+    "name.1" headers, pandas' default NA strings, full-column dtypes (an int
+    column with gaps renders as floats, booleans among numbers or with gaps read
+    as 1/0, all-datetime columns render date-only when every value is at
+    midnight) and numeric stats. `consumers` are called with (headers, data row)
+    for each data row, for aggregates beyond the preview.
+    """
+
+    def __init__(self, consumers: Optional[List[Any]] = None):
+        self.header_row: Optional[List[Any]] = None
+        self.n_rows = 0
+        self.kept: List[List[Any]] = []
+        self.consumers = list(consumers or [])
+        self._width = 0
+        self._pending_blank = 0
+        self._cols: List[Dict[str, Any]] = []
+        self._headers: Optional[List[str]] = None  # cached for consumers; reset when the width grows
+
+    @staticmethod
+    def _cell(v: Any, na_strings: Any = XLSX_NA_STRINGS) -> Any:
+        if isinstance(v, float) and v.is_integer():
+            return int(v)
+        if isinstance(v, str) and v in na_strings:
+            return None
+        return v
+
+    @property
+    def headers(self) -> List[str]:
+        raw = list(self.header_row or []) + [None] * (self._width - len(self.header_row or []))
+        seen: Dict[str, int] = {}
+        out = []
+        for i, h in enumerate(raw):
+            name = f"Unnamed: {i}" if h is None else str(h)
+            if name in seen:
+                seen[name] += 1
+                name = f"{name}.{seen[name]}"
+            else:
+                seen[name] = 0
+            out.append(name)
+        return out
+
+    def add_row(self, values: Any) -> None:
+        na_strings = XLSX_NA_STRINGS if self.header_row is not None else ("",)  # headers keep "NA" etc.
+        row = [self._cell(v, na_strings) for v in (values or ())]
+        while row and row[-1] is None:
+            row.pop()
+        if self.header_row is None:
+            self.header_row = row
+            self._grow(len(row))
+            return
+        if not row:
+            self._pending_blank += 1  # kept only if more data follows (pandas drops trailing blanks)
+            return
+        for _ in range(self._pending_blank):
+            self._add_data_row([])
+        self._pending_blank = 0
+        self._add_data_row(row)
+
+    def _grow(self, width: int) -> None:
+        while len(self._cols) < width:
+            self._cols.append({"nonnull": 0, "int": 0, "float": 0, "bool": 0, "datetime": 0, "other": 0,
+                               "min": None, "max": None, "sum": 0.0, "comp": 0.0,
+                               "coerced": [0] * len(METRIC_UNITS), "uncoerced": 0})
+        if width > self._width:
+            self._width = width
+            self._headers = None
+
+    def _add_data_row(self, row: List[Any]) -> None:
+        self._grow(len(row))
+        self.n_rows += 1
+        if len(self.kept) < MAX_TABLE_ROWS:
+            self.kept.append(row)
+        for v, col in zip(row, self._cols):
+            if v is None:
+                continue
+            col["nonnull"] += 1
+            if isinstance(v, bool):
+                col["bool"] += 1
+                x = float(v)
+            elif isinstance(v, int):
+                col["int"] += 1
+                x = float(v)
+            elif isinstance(v, float):
+                col["float"] += 1
+                x = v
+            elif isinstance(v, datetime.datetime):
+                col["datetime"] += 1  # no numeric stats; pandas leaves datetime columns out
+                continue
+            else:
+                col["other"] += 1
+                if col["uncoerced"]:
+                    continue
+                # text cells count towards the stats while they're all metric strings
+                x, unit = _coerce_metric(v) if isinstance(v, str) else (None, "")
+                if x is None:
+                    if not (isinstance(v, str) and _metric_blank(v)):
+                        col["uncoerced"] += 1
+                    continue
+                col["coerced"][METRIC_UNITS.index(unit)] += 1
+            col["min"] = x if col["min"] is None else min(col["min"], x)
+            col["max"] = x if col["max"] is None else max(col["max"], x)
+            # compensated (Neumaier) sum keeps the mean accurate over long columns
+            t = col["sum"] + x
+            col["comp"] += (col["sum"] - t) + x if abs(col["sum"]) >= abs(x) else (x - t) + col["sum"]
+            col["sum"] = t
+        if self.consumers:
+            if self._headers is None:
+                self._headers = self.headers
+            headers = self._headers
+            padded = row + [None] * (self._width - len(row))
+            for consume in self.consumers:
+                consume(headers, padded)
+
+    def _dtype(self, j: int) -> str:
+        col = self._cols[j]
+        has_null = col["nonnull"] < self.n_rows
+        if col["nonnull"] == 0:
+            return "float64"
+        if col["other"]:
+            return "object"
+        if col["datetime"]:
+            return "datetime64[ns]" if col["datetime"] == col["nonnull"] else "object"
+        if col["bool"] == col["nonnull"] and not has_null:
+            return "bool"
+        # otherwise booleans are read as 1/0 among the numbers, like pandas does
+        return "float64" if (col["float"] or has_null) else "int64"
+
+    def _text_unit(self, j: int) -> str:
+        """_coerce_numeric's unit for an object column ("" unless every non-blank cell is a number)."""
+        col = self._cols[j]
+        counts = list(col["coerced"])
+        counts[0] += col["int"] + col["float"]
+        if col["uncoerced"] or col["bool"] or col["datetime"] or not sum(counts):
+            return ""
+        return METRIC_UNITS[counts.index(max(counts))]
+
+    def preview(self) -> Dict[str, Any]:
+        import pandas as pd  # type: ignore
+        headers = self.headers
+        if self.header_row is None or (self._width == 0):
+            return {"shape": [self.n_rows, 0], "headers": [], "rows": [[] for _ in self.kept], "truncated": False, "numeric_stats": {}}
+        n_cols = min(len(headers), MAX_TABLE_COLS)
+        frame = {}
+        for j in range(n_cols):
+            values = [r[j] if j < len(r) else None for r in self.kept]
+            dtype = self._dtype(j)
+            if dtype == "object":
+                frame[j] = pd.Series(values, dtype=object)
+            elif dtype.startswith("datetime64"):
+                frame[j] = pd.Series(values, dtype=dtype)  # None -> NaT
+            else:
+                frame[j] = pd.Series([float("nan") if v is None else v for v in values], dtype=dtype)
+        dfp = pd.DataFrame(frame)
+        stats = {}
+        n_numeric = 0
+        for j in range(n_cols):
+            if n_numeric >= 12:
+                break
+            col = self._cols[j]
+            unit = self._text_unit(j) if self._dtype(j) == "object" else ""
+            if self._dtype(j) == "object" and not unit:
+                continue
+            n_numeric += 1
+            if col["min"] is None:
+                continue
+            n = col["int"] + col["float"] + col["bool"] + sum(col["coerced"])
+            stats[headers[j]] = {"min": float(col["min"]), "max": float(col["max"]), "mean": float((col["sum"] + col["comp"]) / n)}
+            if unit:
+                stats[headers[j]]["unit"] = unit
+        meta = {"shape": [int(self.n_rows), int(len(headers))], "truncated": bool(self.n_rows > MAX_TABLE_ROWS), "numeric_stats": stats}
+        if COLUMNAR_TABLES:
+            dfp.columns = headers[:n_cols]
+            return _ColumnarTable.from_frame(dfp, meta)
+        return {
+            "shape": meta["shape"],
+            "headers": headers[:n_cols],
+            "rows": dfp.fillna("").astype(str).values.tolist() if self.kept else [],
+            "truncated": meta["truncated"],
+            "numeric_stats": stats,
+        }
+
+
+GSC_OPPORTUNITY_DIMS = {"queries": ["query"], "pages": ["page", "url"]}
+
+
+# Opportunity scoring: an entity's missed clicks are impressions x (expected CTR at its
+# position - actual CTR). The expected-CTR-by-position curve is fitted from the site's
+# other queries / pages (each row is left out of its own benchmark), shrunk toward
+# OPPORTUNITY_CTR_PRIOR where a position has few impressions. Thresholds can be overridden per client (see _client_settings).
+OPPORTUNITY_THRESHOLDS = {
+    "min_impressions": 100.0,  # too few impressions to judge CTR below this
+    "min_position": 1.0,
+    "max_position": 20.0,  # past page 2 the expected CTR is ~0
+    "min_missed_clicks": 1.0,
+}
+# Typical organic CTR at positions 1..20 (public CTR-curve studies, rounded)
+OPPORTUNITY_CTR_PRIOR = (
+    0.28, 0.155, 0.11, 0.08, 0.06, 0.047, 0.037, 0.03, 0.025, 0.021,
+    0.016, 0.014, 0.012, 0.011, 0.01, 0.009, 0.008, 0.007, 0.0065, 0.006,
+)
+OPPORTUNITY_PRIOR_IMPRESSIONS = 500.0  # weight of the prior in each position bin, in impressions
+
+
+def _opportunity_thresholds(overrides: Optional[Mapping] = None) -> Dict[str, float]:
+    """OPPORTUNITY_THRESHOLDS with numeric per-client overrides applied (unknown / invalid keys ignored)."""
+    out = dict(OPPORTUNITY_THRESHOLDS)
+    for k, v in (overrides or {}).items():
+        if k in out:
+            fv = _safe_float(v)
+            if fv is not None:
+                out[k] = fv
+    return out
+
+
+def _ctr_bins(clicks: Any, imps: Any, pos: Any) -> Tuple[Any, Any, Any, Any]:
+    """(rows used, their 0-based rounded-position bin, clicks per bin, impressions per bin)."""
+    import numpy as np  # type: ignore
+    n = len(OPPORTUNITY_CTR_PRIOR)
+    with np.errstate(invalid="ignore"):
+        ok = (imps > 0) & ~np.isnan(clicks) & (pos >= 0.5) & (pos < n + 0.5)
+    bins = np.clip(np.rint(pos[ok]).astype(int), 1, n) - 1
+    c = np.bincount(bins, weights=clicks[ok], minlength=n)
+    i = np.bincount(bins, weights=imps[ok], minlength=n)
+    return ok, bins, c, i
+
+
+def _fit_ctr_curve(clicks: Any, imps: Any, pos: Any) -> Any:
+    """Expected CTR at positions 1..len(OPPORTUNITY_CTR_PRIOR), fitted from the given rows.
+
+    Rows are binned by rounded position; each bin's CTR is sum(clicks) / sum(impressions)
+    with OPPORTUNITY_PRIOR_IMPRESSIONS of the prior mixed in, then forced non-increasing
+    (a better position never expects a lower CTR).
+    """
+    import numpy as np  # type: ignore
+    _, _, c, i = _ctr_bins(clicks, imps, pos)
+    k = OPPORTUNITY_PRIOR_IMPRESSIONS
+    return np.minimum.accumulate((c + np.asarray(OPPORTUNITY_CTR_PRIOR) * k) / (i + k))
+
+
+def _expected_ctr(clicks: Any, imps: Any, pos: Any) -> Any:
+    """Expected CTR per row at its position, from the curve fitted without that row.
+
+    Otherwise a dominant entity sets its own benchmark: 5,000 impressions and no clicks
+    at position 3 would pull that bin to ~1% and show ~50 missed clicks instead of ~550.
+    Leaving a row out only changes its own bin and the bin after it on the curve, so
+    the refit is done for every row at once.
+    """
+    import numpy as np  # type: ignore
+    prior = np.asarray(OPPORTUNITY_CTR_PRIOR, dtype=float)
+    n = prior.size
+    k = OPPORTUNITY_PRIOR_IMPRESSIONS
+    ok, bins, c, i = _ctr_bins(clicks, imps, pos)
+    raw = (c + prior * k) / (i + k)
+    curve = np.minimum.accumulate(raw)
+    expected = np.where(np.isnan(pos), np.nan, np.interp(pos, np.arange(1, n + 1), curve))
+    if not ok.any():
+        return expected
+    own = (c[bins] - clicks[ok] + prior[bins] * k) / (i[bins] - imps[ok] + k)
+    at = np.minimum(np.concatenate(([np.inf], curve[:-1]))[bins], own)  # the row's bin, refitted
+    after = np.minimum(at, raw[np.minimum(bins + 1, n - 1)])
+    before = curve[np.maximum(bins - 1, 0)]
+    # interpolate between the two bins around the position; the row's bin is one of them
+    p = np.clip(pos[ok], 1, n)
+    lo = np.minimum(np.floor(p).astype(int), n - 1) - 1
+    frac = p - (lo + 1)
+    first = bins == lo
+    v0, v1 = np.where(first, at, before), np.where(first, after, at)
+    expected[ok] = v0 + frac * (v1 - v0)
+    return expected
+
+
+def _score_opportunities(clicks: Any, imps: Any, pos: Any, thresholds: Optional[Mapping] = None) -> Tuple[Any, Any, Any]:
+    """(missed clicks, expected CTR, actual CTR) per row over float64 columns, in one vectorized pass.
+
+    Missed clicks are impressions x (expected - actual CTR), NaN for rows outside the
+    thresholds (impressions, position band, minimum gap) or without a position.
+    """
+    import numpy as np  # type: ignore
+    th = _opportunity_thresholds(thresholds)
+    expected = _expected_ctr(clicks, imps, pos)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ctr = np.where(imps > 0, np.nan_to_num(clicks, nan=0.0) / imps, np.nan)
+        missed = imps * (expected - ctr)
+        mask = (
+            (imps >= th["min_impressions"])
+            & (pos >= th["min_position"]) & (pos <= th["max_position"])
+            & (missed >= th["min_missed_clicks"])
+        )
+    return np.where(mask, missed, np.nan), expected, ctr
+
+
+def _gsc_cell_str(v: Any) -> str:
+    """Render a raw cell like the preview does (blank for missing, dates without a midnight time)."""
+    if v is None:
+        return ""
+    if isinstance(v, datetime.datetime) and v.time() == datetime.time(0, 0):
+        return v.date().isoformat()
+    return str(v)
+
+
+class _TopK:
+    """Bounded top-k selection over a stream, for several named rankings in one pass.
+
+    `push(item, clicks=..., impressions=...)` offers a row to every named ranking at
+    once (a None / NaN score leaves the row out of that ranking); each ranking keeps
+    its k best scores in a min-heap. Ties go to the earlier row, so `items(name)`
+    (best first) equals a stable descending sort of the whole stream cut to k.
+    """
+
+    def __init__(self, k: int, names: Tuple[str, ...]):
+        self.k = int(k)
+        self.heaps: Dict[str, List[Tuple[float, int, Any]]] = {n: [] for n in names}
+        self.seen = 0
+
+    def push(self, item: Any, **scores: Optional[float]) -> None:
+        self.seen += 1
+        if self.k <= 0:
+            return
+        seq = -self.seen  # later rows lose ties
+        for name, score in scores.items():
+            if score is None or score != score:
+                continue
+            heap = self.heaps[name]
+            if len(heap) < self.k:
+                heapq.heappush(heap, (score, seq, item))
+            elif (score, seq) > heap[0][:2]:
+                heapq.heapreplace(heap, (score, seq, item))
+
+    def items(self, name: str) -> List[Any]:
+        return [it for _, _, it in sorted(self.heaps[name], key=lambda e: e[:2], reverse=True)]
+
+
+def _top_k_indices(scores: Any, k: int, mask: Any = None) -> Any:
+    """Row indices of the k largest scores, best first; ties keep row order.
+
+    np.argpartition finds the k-th largest score in linear time and only rows at or
+    above it get sorted. NaN scores and rows outside `mask` are never selected.
+    """
+    import numpy as np  # type: ignore
+    scores = np.asarray(scores, dtype=float)
+    ok = ~np.isnan(scores)
+    idx = np.flatnonzero(ok if mask is None else (ok & mask))
+    if k <= 0 or idx.size == 0:
+        return idx[:0]
+    vals = scores[idx]
+    if idx.size > k:
+        cut = idx.size - k
+        kth = vals[np.argpartition(vals, cut)[cut]]
+        keep = vals >= kth
+        idx, vals = idx[keep], vals[keep]
+    return idx[np.lexsort((idx, -vals))][:k]
+
+
+_URL_SCHEME_RE = re.compile(r"^[a-z][a-z0-9+.-]*://")
+
+
+@functools.lru_cache(maxsize=NUM_TOKEN_CACHE_SIZE)
+def _gsc_entity_key(kind: str, s: str) -> str:
+    """Join key for a query / page cell: casefolded with whitespace collapsed.
+
+    Pages also drop the scheme, a leading "www.", the #fragment and trailing slashes,
+    so "https://www.site.com/a/" and "http://site.com/a" join as the same entity.
+    """
+    k = " ".join(s.split()).casefold()
+    if kind == "pages":
+        k = _URL_SCHEME_RE.sub("", k).split("#", 1)[0]
+        if k.startswith("www."):
+            k = k[4:]
+        k = k.rstrip("/")
+    return k
+
+
+class _GscEntityIndex:
+    """Per-entity totals of one GSC queries / pages table over every row, keyed for joins.
+
+    Rows whose labels normalize to the same _gsc_entity_key are merged: clicks and
+    impressions are summed, position is impression-weighted (GSC's own averaging).
+    `labels` keeps the first raw label seen for each key. Built in one hash pass
+    (pd.factorize + np.bincount); `join_keys` are unique, in first-seen order.
+    """
+
+    def __init__(self, kind: str, labels: List[str], keys: List[str], clicks: Any, impressions: Any, position: Any):
+        self.kind = kind
+        self.labels = labels
+        self.join_keys = keys
+        self.clicks = clicks
+        self.impressions = impressions
+        self.position = position
+
+    @classmethod
+    def from_rows(cls, kind: str, labels: List[str], clicks: Any, impressions: Any, position: Any) -> "_GscEntityIndex":
+        """Merge row-level columns (float64, NaN = missing) by normalized label; blank labels are dropped."""
+        import numpy as np  # type: ignore
+        keys = [_gsc_entity_key(kind, str(s)) for s in labels]
+        keep = np.flatnonzero(np.array([bool(k) for k in keys], dtype=bool))
+        clicks, impressions, position = (np.asarray(a, dtype=float)[keep] for a in (clicks, impressions, position))
+        codes, uniq = pd.factorize(np.array(keys, dtype=object)[keep])
+        n = len(uniq)
+        _, first = np.unique(codes, return_index=True)
+        has_pos = ~np.isnan(position)
+        # unknown impressions still give the row's position a unit weight
+        w = np.where(has_pos, np.where(impressions > 0, impressions, 1.0), 0.0)
+        pos_w = np.bincount(codes, weights=w, minlength=n)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            pos = np.bincount(codes, weights=np.where(has_pos, position, 0.0) * w, minlength=n) / pos_w
+        return cls(
+            kind,
+            [str(labels[keep[r]]).strip() for r in first],
+            [str(k) for k in uniq],
+            np.bincount(codes, weights=np.nan_to_num(clicks, nan=0.0), minlength=n),
+            np.bincount(codes, weights=np.nan_to_num(impressions, nan=0.0), minlength=n),
+            np.where(pos_w > 0, pos, np.nan),
+        )
+
+    def __len__(self) -> int:
+        return len(self.join_keys)
+
+    def summary(self) -> Dict[str, Any]:
+        """What JSON exports show instead of the per-entity arrays."""
+        return {"kind": self.kind, "entities": len(self)}
+
+
+def _is_entity_index(obj: Any) -> bool:
+    """Duck-typed _GscEntityIndex check. Streamlit re-executes this script on every
+    rerun, redefining the class, so indexes held by the cache_resource memory tier
+    belong to an older class object and fail isinstance()."""
+    return hasattr(obj, "join_keys") and callable(getattr(obj, "summary", None))
+
+
+class _GscAggregator:
+    """Streaming (headers, row) consumer that aggregates a GSC table over every row.
+
+    Keeps clicks/impressions running sums, the top MAX_LIST_ROWS rows by clicks, the
+    best day by clicks (chart tables) and, for queries / pages tables, one
+    (label, clicks, impressions, position) tuple per row for the _GscEntityIndex.
+    Ties keep the earlier row, so the top rows match a stable sort of the full table.
+    Tables without clicks/impressions columns are ignored.
+    """
+
+    def __init__(self, sheet: str = "", keep: int = MAX_LIST_ROWS):
+        self.sheet = sheet
+        self.keep = keep
+        self.cols: Optional[Dict[str, Any]] = None  # resolved from the first row's headers
+        self.headers: List[str] = []
+        self.n_rows = 0
+        self.clicks = 0.0
+        self.impressions = 0.0
+        self.best_day: Optional[Tuple[str, float]] = None
+        self._top = _TopK(keep, ("clicks",))
+        # (label, clicks, impressions, position) per query / page row, for _GscEntityIndex
+        self._entities: List[Tuple[str, float, float, float]] = []
+
+    def _resolve(self, headers: List[str]) -> None:
+        sch = _table_schema(headers)
+        if sch["clicks"] is None or sch["impressions"] is None:
+            self.cols = {}
+            return
+        kind = _detect_gsc_table_kind(self.sheet, headers)
+        self.headers = [str(h) for h in headers[:MAX_TABLE_COLS]]
+        self.cols = {
+            "kind": kind,
+            "clicks": sch["clicks"],
+            "impressions": sch["impressions"],
+            "position": sch["position"],
+            "dim": sch["opportunity"].get(kind),
+            "date": sch["date"] if kind == "chart" else None,
+        }
+
+    def __call__(self, headers: List[str], row: List[Any]) -> None:
+        if self.cols is None:
+            self._resolve(headers)
+        cols = self.cols
+        if not cols:
+            return
+        self.n_rows += 1
+        c = _coerce_metric(row[cols["clicks"]])[0]
+        i = _coerce_metric(row[cols["impressions"]])[0]
+        if c is not None:
+            self.clicks += c
+        if i is not None:
+            self.impressions += i
+        label = _gsc_cell_str(row[cols["dim"]]).strip() if cols["dim"] is not None else ""
+        if label:
+            pos = _coerce_metric(row[cols["position"]])[0] if cols["position"] is not None else None
+            nan = float("nan")
+            self._entities.append((label, nan if c is None else c, nan if i is None else i, nan if pos is None else pos))
+        self._top.push(row, clicks=c if c is not None else -1.0)
+        if cols["date"] is not None:
+            d = _gsc_cell_str(row[cols["date"]]).strip()
+            if d and c is not None and (self.best_day is None or c > self.best_day[1]):
+                self.best_day = (d, c)
+
+    def _rows(self, ranking: str) -> List[Dict[str, str]]:
+        return [
+            {h: _gsc_cell_str(r[j]) if j < len(r) else "" for j, h in enumerate(self.headers)}
+            for r in self._top.items(ranking)
+        ]
+
+    def result(self) -> Optional[Dict[str, Any]]:
+        """Aggregate over all rows seen, or None when this isn't a GSC metrics table."""
+        if not self.cols:
+            return None
+        out = {
+            "rows": self.n_rows,
+            "clicks": self.clicks,
+            "impressions": self.impressions,
+            "top_rows": self._rows("clicks"),
+            "best_day": list(self.best_day) if self.best_day else None,
+        }
+        if self._entities:
+            labels, clicks, imps, pos = zip(*self._entities)
+            out["entities"] = _GscEntityIndex.from_rows(self.cols["kind"], list(labels), clicks, imps, pos)
+        return out
+
+
+def _gsc_aggregate_frame(df: Any, sheet: str = "") -> Optional[Dict[str, Any]]:
+    """_GscAggregator over a DataFrame (CSV / pandas Excel fallback); None for non-GSC tables."""
+    headers = [str(c) for c in df.columns]
+    agg = _GscAggregator(sheet)
+    agg._resolve(headers)
+    if not agg.cols:
+        return None
+    for values in df.itertuples(index=False, name=None):
+        agg(headers, [None if (isinstance(v, float) and v != v) else v for v in values])
+    return agg.result()
+
+
+def _xlsx_sheet_consumed(sheet: str, headers: List[Any]) -> bool:
+    """True when _build_data_signals would read this GSC workbook sheet (kind + clicks/impressions header)."""
+    hs = [str(h) for h in headers if h is not None]
+    sch = _table_schema(hs)
+    if sch["clicks"] is None or sch["impressions"] is None:
+        return False
+    return _detect_gsc_table_kind(sheet, hs) in GSC_CONSUMED_KINDS | {"unknown"}
+
+
+def _deferred_sheet_preview(headers: List[Any]) -> Dict[str, Any]:
+    """Placeholder preview for a sheet that was classified but not parsed (see _load_deferred_xlsx_sheets)."""
+    hs = [str(h) for h in headers if h is not None][:MAX_TABLE_COLS]
+    return {"shape": [None, len(hs)], "headers": hs, "rows": [], "truncated": False, "numeric_stats": {}, "deferred": True}
+
+
+def _stream_xlsx_previews(
+    data: bytes,
+    max_sheets: int = XLSX_MAX_SHEETS,
+    lazy: bool = False,
+    only: Optional[List[str]] = None,
+) -> List[Tuple[str, Any]]:
+    """[(sheet, preview dict or Exception), ...] for an .xlsx via openpyxl read-only streaming.
+
+    With `lazy`, a workbook that looks like a GSC export (>= 2 GSC sheet names) is
+    classified from each sheet's header row first, and sheets the data signals don't
+    read get a `deferred` placeholder preview instead of a full parse. `only`
+    restricts the parse to the named sheets (used to load deferred sheets on demand).
+    Raises if the workbook cannot be opened this way (callers fall back to pandas).
+    """
+    import openpyxl  # type: ignore
+    wb = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True, keep_links=False)
+    out: List[Tuple[str, Any]] = []
+    try:
+        sheets = wb.sheetnames[:max_sheets]
+        if only is not None:
+            sheets = [s for s in sheets if s in set(only)]
+        gsc_workbook = lazy and len({s.strip().lower() for s in sheets} & GSC_SHEET_NAMES) >= 2
+        for sheet in sheets:
+            try:
+                ws = wb[sheet]
+                if gsc_workbook:
+                    header = next(ws.iter_rows(values_only=True, max_row=1), ())
+                    if not _xlsx_sheet_consumed(sheet, list(header or ())):
+                        out.append((sheet, _deferred_sheet_preview(list(header or ()))))
+                        continue
+                agg = _GscAggregator(sheet)
+                sp = _StreamingTablePreview(consumers=[agg])
+                for values in ws.iter_rows(values_only=True):
+                    sp.add_row(values)
+                preview = sp.preview()
+                summary = agg.result()
+                if summary:
+                    preview["gsc_aggregate"] = summary
+                out.append((sheet, preview))
+            except Exception as se:
+                out.append((sheet, se))
+    finally:
+        wb.close()
+    return out
+
+
+def _xlsx_parity_sample() -> bytes:
+    """Small workbook with the cell types where streaming and pandas previews can drift."""
+    import openpyxl  # type: ignore
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Dates"
+    ws.append(["Day", "Stamp", "Gappy", "Time", "DateOrNA"])
+    for i in range(8):
+        day = datetime.datetime(2026, 3, 1 + i)
+        ws.append([day, day.replace(hour=9, minute=30), None if i == 4 else day, datetime.time(9, i), "n/a" if i == 1 else day])
+    ws = wb.create_sheet("Numbers")
+    ws.append(["IntBool", "FloatBool", "BoolGap", "AllBool", "BoolText", "NA"])
+    for i in range(8):
+        ws.append([True if i == 3 else i, False if i == 5 else i + 0.5, None if i == 2 else bool(i % 2), bool(i % 2), True if i == 0 else "x", "NA" if i == 6 else i])
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def _check_xlsx_preview_parity(data: Optional[bytes] = None) -> List[Dict[str, Any]]:
+    """Sheets where the streaming preview differs from pandas.read_excel + _df_preview.
+
+    Compares headers, shape, rendered rows and numeric stats (floats to 1e-9);
+    `data` defaults to _xlsx_parity_sample(). Returns [] when the paths agree.
+    """
+    import math
+    data = _xlsx_parity_sample() if data is None else data
+
+    def plain(p: Any) -> Dict[str, Any]:
+        p = dict(p)
+        return {k: p.get(k) for k in ("shape", "headers", "rows", "truncated", "numeric_stats")}
+
+    def same(a: Any, b: Any) -> bool:
+        if isinstance(a, float) and isinstance(b, float):
+            return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-12)
+        if isinstance(a, dict) and isinstance(b, dict):
+            return a.keys() == b.keys() and all(same(a[k], b[k]) for k in a)
+        if isinstance(a, list) and isinstance(b, list):
+            return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+        return a == b
+
+    xl = pd.ExcelFile(io.BytesIO(data), engine="openpyxl")
+    mismatches: List[Dict[str, Any]] = []
+    for sheet, streamed in _stream_xlsx_previews(data):
+        expected = plain(_df_preview(xl.parse(sheet_name=sheet)))
+        got = plain(streamed) if isinstance(streamed, Mapping) else {"error": str(streamed)}
+        diff = [k for k in expected if not same(expected[k], got.get(k))]
+        if diff:
+            mismatches.append({"sheet": sheet, "fields": diff, "pandas": {k: expected[k] for k in diff}, "streaming": {k: got.get(k) for k in diff}})
+    return mismatches
+
+
+def _check_xlsx_previews_cli(argv: List[str]) -> int:
+    """`python monthly_report_builder_app.py check-xlsx-previews [FILE.xlsx ...]`.
+
+    Prints streaming-vs-pandas preview mismatches (built-in sample workbook
+    without files); exits 1 if there are any.
+    """
+    failed = False
+    for path in argv or [None]:
+        data = None
+        if path is not None:
+            with open(path, "rb") as fh:
+                data = fh.read()
+        mismatches = _check_xlsx_preview_parity(data)
+        for mm in mismatches:
+            print(json.dumps(dict(mm, file=path or "(sample)"), default=str))
+        print(f"{path or '(sample)'}: {'OK' if not mismatches else f'{len(mismatches)} sheet(s) differ'}")
+        failed = failed or bool(mismatches)
+    return 1 if failed else 0
+
+
+def _load_deferred_xlsx_sheets(supporting: Dict[str, Any], files: Dict[str, bytes]) -> int:
+    """Parse the deferred sheets of uploaded workbooks in place (debug tab). Returns sheets loaded."""
+    wanted: Dict[str, List[str]] = {}
+    for t in supporting.get("tables") or []:
+        if t.get("type") == "xlsx" and (t.get("table") or {}).get("deferred") and t.get("filename") in files:
+            wanted.setdefault(t["filename"], []).append(t.get("sheet") or "")
+    loaded = 0
+    for fname, sheets in wanted.items():
+        try:
+            parsed = dict(_stream_xlsx_previews(files[fname], only=sheets))
+        except Exception as e:
+            supporting.setdefault("notes", []).append(f"Excel parse error for {fname}: {e}")
+            continue
+        by_file_tables = ((supporting.get("_by_file") or {}).get(fname) or {}).get("tables") or []
+        for t in list(supporting.get("tables") or []) + list(by_file_tables):
+            if t.get("filename", fname) != fname or not (t.get("table") or {}).get("deferred"):
+                continue
+            preview = parsed.get(t.get("sheet") or "")
+            if isinstance(preview, Mapping):
+                t["table"] = preview
+        loaded += sum(1 for p in parsed.values() if isinstance(p, Mapping))
+    return loaded
+
+
+CSV_FAST_PATH = True  # prefix sniffing + C/pyarrow parser; the python-engine reader is the fallback
+CSV_SNIFF_BYTES = 64 * 1024
+CSV_HEADER_SCAN_LINES = 50
+CSV_DELIMITERS = ",;\t|"
+
+
+_CSV_LINE_END_RE = re.compile(rb"(\r\n|\r|\n)")  # the line ends pandas' C parser accepts
+
+
+def _sniff_csv_layout(prefix: bytes) -> Tuple[int, str]:
+    """(header byte offset, delimiter) from the first bytes of a CSV.
+
+    GA4 exports start with '#' metadata lines; the header is the first non-empty,
+    non-comment line containing a delimiter. The delimiter is sniffed from the
+    header and the lines after it (comma when the sniffer can't decide). Lines
+    are split on the bytes themselves (\r\n, \r or \n), so the offset is exact
+    whatever the line ends.
+    """
+    pieces = _CSV_LINE_END_RE.split(prefix)  # [line, end, line, end, ..., line]
+    raw_lines = pieces[0::2]
+    offsets = [0]
+    for line, end in zip(raw_lines, pieces[1::2]):
+        offsets.append(offsets[-1] + len(line) + len(end))
+    lines = [ln.decode("utf-8-sig" if i == 0 else "utf-8", errors="ignore") for i, ln in enumerate(raw_lines)]
+    if len(prefix) >= CSV_SNIFF_BYTES and lines:
+        lines = lines[:-1]  # last line may be cut mid-row
+    header_idx = 0
+    for i, ln in enumerate(lines[:CSV_HEADER_SCAN_LINES]):
+        s = (ln or "").strip()
+        if not s or s.startswith("#"):
+            continue
+        if any(d in s for d in CSV_DELIMITERS):
+            header_idx = i
+            break
+    sample = [ln for ln in lines[header_idx:header_idx + 20] if ln.strip() and not ln.lstrip().startswith("#")]
+    sep = ","
+    if sample and "," not in sample[0]:
+        try:
+            sep = csv.Sniffer().sniff("\n".join(sample), delimiters=CSV_DELIMITERS).delimiter
+        except Exception:
+            sep = ","
+    return offsets[header_idx], sep
+
+
+def _read_csv_fast(data: bytes):
+    """Parse a (GA4-style) CSV with the C engine, or pyarrow when installed and the body has no '#' lines."""
+    import pandas as pd  # type: ignore
+    header_pos, sep = _sniff_csv_layout(data[:CSV_SNIFF_BYTES])
+    # start at the header line, so neither parser re-scans the metadata block
+    body = data[header_pos:] if header_pos else data
+    if not re.search(rb"[\r\n]#", body):
+        try:
+            import pyarrow  # type: ignore  # noqa: F401
+            return pd.read_csv(io.BytesIO(body), sep=sep, engine="pyarrow")
+        except Exception:
+            pass
+    return pd.read_csv(io.BytesIO(body), sep=sep, comment="#", engine="c", float_precision="round_trip")
+
+
 def _extract_kpis_from_table_preview(table_rows: Any, source_ref: str) -> List[Dict[str, Any]]:
     """Heuristic extraction of KPI-like rows from a small table preview (often from PDFs like DashThis).
 
@@ -1281,7 +3642,7 @@ def _extract_kpis_from_table_preview(table_rows: Any, source_ref: str) -> List[D
     """
     headers: List[str] = []
     # Some callers may accidentally pass the full preview dict; normalize.
-    if isinstance(table_rows, dict):
+    if isinstance(table_rows, Mapping):
         headers = [str(h) for h in (table_rows.get("headers") or []) if h is not None]
         table_rows = table_rows.get("rows") or []
 
@@ -1300,90 +3661,662 @@ def _extract_kpis_from_table_preview(table_rows: Any, source_ref: str) -> List[D
     else:
         return []
 
-    if len(keys) < 2:
-        return []
-    # If too wide, it's likely not a KPI tile table
-    if len(keys) > 6:
-        return []
+    if len(keys) < 2:
+        return []
+    # If too wide, it's likely not a KPI tile table
+    if len(keys) > 6:
+        return []
+
+    # Cap work
+    rows = table_rows[:MAX_LIST_ROWS]
+    out: List[Dict[str, Any]] = []
+
+    def _to_dict(r: Any) -> Dict[str, Any]:
+        if isinstance(r, dict):
+            return r
+        if isinstance(r, (list, tuple)):
+            d: Dict[str, Any] = {}
+            for i, v in enumerate(r):
+                k = keys[i] if i < len(keys) else f"col{i+1}"
+                d[str(k)] = v
+            return d
+        return {}
+
+    import numpy as np  # type: ignore
+    dict_rows = [_to_dict(raw) for raw in rows]
+    # which cells are numbers ("12.5%", "$1,204", "(3.2)", "1.2K", ...), one column at a time
+    numeric = {k: ~np.isnan(_coerce_numeric([r.get(k) for r in dict_rows])[0]) for k in keys}
+
+    for i, r in enumerate(dict_rows):
+        if not r:
+            continue
+
+        # KPI tables are usually (label, value, maybe delta/period)
+        # Pick metric label from the first non-numeric-ish cell
+        metric = ""
+        value = None
+        delta = None
+
+        cells = [(r.get(k), bool(numeric[k][i])) for k in keys if k in r]
+        # Fallback if keys didn't align perfectly
+        if not cells:
+            cells = [(v, _coerce_metric(v)[0] is not None) for v in r.values()]
+
+        # metric: first non-num cell
+        for v, numish in cells:
+            if v is None:
+                continue
+            if not numish:
+                metric = str(v).strip()
+                break
+
+        # value: first numish cell
+        for v, numish in cells:
+            if v is None:
+                continue
+            if numish:
+                value = str(v).strip()
+                break
+
+        # delta: numish with % or +/- if present
+        for v, numish in cells:
+            if v is None:
+                continue
+            s = str(v).strip()
+            if ("%" in s or s.startswith(("+", "-"))) and numish:
+                delta = s
+                break
+
+        if not metric or value is None:
+            continue
+
+        out.append({
+            "metric": metric,
+            "value": value,
+            "delta": delta,
+            "evidence_ref": source_ref,
+            "confidence": "Medium",
+        })
+
+    return out
+# ------------------------------
+# Extraction cache
+# ------------------------------
+# Analysts re-upload the same exports several times per report. Per-file
+# extraction results are cached by the SHA-256 of the upload bytes, the file
+# type, EXTRACTOR_VERSION and the switches that change what is extracted (see
+# _extraction_switches). Bump EXTRACTOR_VERSION whenever the extraction
+# heuristics or output shape change: old entries are then never hit again and
+# age out of the size-bounded disk tier. Parses that lost OCR work (deadline,
+# timeouts, no OCR engine) are not cached, so the next upload retries them.
+EXTRACTOR_VERSION = "10"
+EXTRACTION_CACHE_ENABLED = True
+EXTRACTION_CACHE_DIR = os.path.join(os.getcwd(), ".cache", "extraction")
+EXTRACTION_CACHE_MEMORY_ITEMS = 32
+EXTRACTION_CACHE_DISK_BYTES = 256 * 1024 * 1024
+
+
+class _DiskCache:
+    """Size-bounded directory of pickled values, evicted least-recently-used (by mtime)."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fh:
+                value = pickle.load(fh)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Corrupt / partially written / incompatible entry: drop it.
+            try:
+                os.remove(path)
+            except Exception:
+                pass
+            return None
+        try:
+            os.utime(path, None)  # mark as recently used
+        except Exception:
+            pass
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = f"{self._path(key)}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "wb") as fh:
+                pickle.dump(value, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+        except Exception:
+            return
+        self._evict()
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        out = []
+        try:
+            names = os.listdir(self.directory)
+        except Exception:
+            return out
+        for fn in names:
+            if not fn.endswith(".pkl"):
+                continue
+            path = os.path.join(self.directory, fn)
+            try:
+                stt = os.stat(path)
+            except Exception:
+                continue
+            out.append((stt.st_mtime, stt.st_size, path))
+        return out
+
+    def _evict(self) -> None:
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except Exception:
+                continue
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self) -> int:
+        removed = 0
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+                removed += 1
+            except Exception:
+                pass
+        return removed
+
+
+class _ExtractionCache:
+    """Two-tier (in-process LRU + on-disk) cache of per-file extraction results."""
+
+    def __init__(self, directory: str, memory_items: int, disk_bytes: int):
+        self.memory_items = int(memory_items)
+        self.disk = _DiskCache(directory, disk_bytes)
+        self._mem: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return copy.deepcopy(self._mem[key])
+        value = self.disk.get(key)
+        with self._lock:
+            if value is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["disk_hits"] += 1
+            self._remember(key, value)
+        return copy.deepcopy(value)
+
+    def put(self, key: str, value: Any) -> None:
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._remember(key, value)
+            self.stats["stores"] += 1
+        self.disk.put(key, value)
+
+    def _remember(self, key: str, value: Any) -> None:
+        self._mem[key] = value
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.memory_items:
+            self._mem.popitem(last=False)
+
+    def clear(self) -> int:
+        with self._lock:
+            self._mem.clear()
+        return self.disk.clear()
+
+
+@st.cache_resource(show_spinner=False)
+def _get_extraction_cache() -> _ExtractionCache:
+    """One cache per server process (survives Streamlit reruns)."""
+    return _ExtractionCache(EXTRACTION_CACHE_DIR, EXTRACTION_CACHE_MEMORY_ITEMS, EXTRACTION_CACHE_DISK_BYTES)
+
+
+def clear_extraction_cache() -> int:
+    """Drop every cached extraction result (memory + disk). Returns files removed."""
+    try:
+        return _get_extraction_cache().clear()
+    except Exception:
+        return 0
+
+
+def _extraction_switches() -> str:
+    """Settings that change what is extracted, as a cache-key fragment."""
+    backend = _get_ocr_backend()
+    return "|".join([
+        f"lazy={int(bool(XLSX_STREAMING and XLSX_LAZY_SHEETS))}",
+        f"stream={int(bool(XLSX_STREAMING))}",
+        f"columnar={int(bool(COLUMNAR_TABLES))}",
+        f"csv_fast={int(bool(CSV_FAST_PATH))}",
+        f"ocr_roi={int(bool(OCR_ROI_ENABLED))}",
+        f"pdf_templates={int(bool(PDF_TEMPLATE_CACHE_ENABLED))}",
+        f"ocr={backend.name if backend is not None else 'none'}",
+        f"ocr_config={OCR_TESSERACT_CONFIG}",
+    ])
+
+
+def _extraction_cache_key(name: str, data: bytes, switches: Optional[str] = None) -> str:
+    ext = os.path.splitext(name or "")[1].lower()
+    h = hashlib.sha256(data or b"")
+    h.update(f"|{ext}|{EXTRACTOR_VERSION}|{_extraction_switches() if switches is None else switches}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _extraction_degraded(part: Dict[str, Any]) -> bool:
+    """True when a parse lost OCR work (pages past the deadline, failed / timed-out images, no engine)."""
+    stats = part.get("_stats") or {}
+    return any(int(stats.get(k, 0) or 0) > 0 for k in ("ocr_pages_skipped", "ocr_failed"))
+
+
+def _relabel_note(note: str, old_name: str, new_name: str) -> str:
+    """Swap the file name in one per-file note, only where the note templates put it:
+    right after "for " ("... for NAME: ...", "... for NAME / sheet: ...") or at the end ("...: NAME")."""
+    m = re.match(r"[^:]*? for " + re.escape(old_name) + r"(?=: | / )", note)
+    if m:
+        return note[:m.end() - len(old_name)] + new_name + note[m.end():]
+    if note.endswith(": " + old_name):
+        return note[:-len(old_name)] + new_name
+    return note
+
+
+def _relabel_file_context(part: Dict[str, Any], old_name: str, new_name: str) -> Dict[str, Any]:
+    """Re-point a cached single-file context at the name it was re-uploaded under."""
+    if old_name == new_name:
+        return part
+    for key in ("documents", "tables"):
+        for entry in part.get(key) or []:
+            if entry.get("filename") == old_name:
+                entry["filename"] = new_name
+    part["notes"] = [_relabel_note(str(n), old_name, new_name) for n in (part.get("notes") or [])]
+    by_file = part.get("_by_file") or {}
+    if old_name in by_file:
+        blob = by_file.pop(old_name)
+        if isinstance(blob.get("notes"), list):
+            blob["notes"] = [_relabel_note(str(n), old_name, new_name) for n in blob["notes"]]
+        by_file[new_name] = blob
+    part["_by_file"] = by_file
+    kinds = part.get("_pdf_kinds") or {}
+    if old_name in kinds:
+        kinds[new_name] = kinds.pop(old_name)
+    return part
+
+# ------------------------------
+# Parallel ingestion
+# ------------------------------
+# Each upload is an isolated unit of work, so month-end uploads can be fanned
+# out to a bounded process pool (one task per file: a PDF is parsed once). The
+# app runs inside a multithreaded server, so workers are never forked from it
+# directly (a child could inherit a lock held by another thread): they come from
+# a forkserver, or are spawned, and re-import this script to find its functions.
+# The UI only runs under __main__, and the forkserver preloads the heavy
+# libraries, so that re-import is just the definitions.
+INGEST_PARALLEL = True
+INGEST_MAX_WORKERS = max(1, min(8, os.cpu_count() or 1))
+INGEST_TIMEOUT_S = 300.0
+PDF_INGEST_PARTS = ("text", "tables", "section_tables")
+POOL_PRELOAD_MODULES = ["numpy", "pandas", "fitz", "pdfplumber", "openpyxl", "streamlit"]
+
+_IN_POOL_WORKER = False
+
+
+def _mark_pool_worker() -> None:
+    """Process-pool initializer: lets nested work detect it is already in a worker."""
+    global _IN_POOL_WORKER
+    _IN_POOL_WORKER = True
+
+
+def _pool_context() -> Any:
+    """Multiprocessing context for worker pools: forkserver, else spawn; never plain fork.
+
+    The forkserver imports POOL_PRELOAD_MODULES once, so workers forked from it
+    start with them loaded (missing modules are skipped).
+    """
+    import multiprocessing
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(POOL_PRELOAD_MODULES)
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+
+def _process_pool_map(fn: Any, tasks: List[Tuple[Any, ...]], max_workers: int, timeout_s: Optional[float] = None) -> List[Any]:
+    """Run fn(*task) for every task in a bounded process pool (see _pool_context).
+
+    Results come back in task order. A slot is None when that task raised, did
+    not finish within `timeout_s` (overall), or the pool could not be used, so
+    callers can redo or skip that work. Workers still busy at the deadline are
+    terminated rather than waited for.
+    """
+    results: List[Any] = [None] * len(tasks)
+    if not tasks or max_workers <= 1 or _IN_POOL_WORKER:
+        return results
+    try:
+        ctx = _pool_context()
+    except Exception:
+        return results
+
+    deadline = (time.monotonic() + timeout_s) if timeout_s else None
+    pool = None
+    pending: List[Any] = []
+    try:
+        pool = ctx.Pool(processes=min(max_workers, len(tasks)), initializer=_mark_pool_worker)
+        pending = [pool.apply_async(fn, task) for task in tasks]
+        for i, res in enumerate(pending):
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                results[i] = res.get(timeout=remaining)
+            except Exception:
+                results[i] = None
+    except Exception:
+        pass
+    finally:
+        if pool is not None:
+            try:
+                if any(not r.ready() for r in pending):
+                    pool.terminate()
+                else:
+                    pool.close()
+                pool.join()
+            except Exception:
+                pass
+    return results
+
+
+def _new_file_context() -> Dict[str, Any]:
+    return {"documents": [], "tables": [], "notes": [], "_by_file": {}}
+
+
+def _ingest_pdf_parts(supporting: Dict[str, Any], name: str, pdf: "_PdfDocument", parts: Tuple[str, ...]) -> None:
+    """Run the requested PDF extractors against one shared parsed document."""
+    if "text" in parts:
+        supporting.setdefault("_pdf_kinds", {})[name] = pdf.classify()
+        skipped: List[int] = []
+        t = _extract_pdf_text(pdf, stats=supporting.setdefault("_stats", {}), max_chars=MAX_DOC_CHARS_PER_FILE, skipped_pages=skipped)
+        if skipped:
+            supporting["notes"].append(f"PDF text budget reached ({MAX_DOC_CHARS_PER_FILE:,} chars); pages {_format_page_ranges(skipped)} not extracted: {name}")
+        if t.strip():
+            t = _clamp(t, MAX_DOC_CHARS_PER_FILE)
+            supporting["documents"].append({"filename": name, "type": "pdf", "text": t})
+            supporting["_by_file"].setdefault(name, {"documents": [], "tables": []})["documents"].append({"type": "pdf", "text": t})
+        elif supporting["_pdf_kinds"][name] == "scanned":
+            supporting["notes"].append(f"Could not extract text from scanned PDF (OCR unavailable or found no text): {name}")
+        else:
+            supporting["notes"].append(f"Could not extract text from PDF: {name}")
+
+    # Best-effort table extraction (helps with PDF exports that contain embedded tables)
+    if "tables" in parts:
+        try:
+            skipped_tables: List[int] = []
+            pdf_tables = _extract_pdf_tables(pdf, skipped_pages=skipped_tables)
+            if skipped_tables:
+                supporting["notes"].append(f"PDF table scan stopped early (table/page/time budget); pages {_format_page_ranges(skipped_tables)} not scanned for tables: {name}")
+            for pv in (pdf_tables or []):
+                # Represent each table like an Excel sheet preview
+                page = pv.get("page", "")
+                t_i = pv.get("table_index", "")
+                sheet_label = f"PDF page {page} table {t_i}".strip()
+                supporting["tables"].append({"filename": name, "type": "pdf", "sheet": sheet_label, "table": pv})
+                supporting["_by_file"].setdefault(name, {"documents": [], "tables": []})["tables"].append({"type": "pdf", "sheet": sheet_label, "table": pv})
+        except Exception:
+            pass
+
+    # Best-effort "clean tables per section" extraction for dashboard-style PDFs (includes OCR fallback)
+    if "section_tables" in parts:
+        try:
+            section_tables = _extract_pdf_section_tables(pdf, enable_ocr=True, stats=supporting.setdefault("_stats", {}))
+            for pv in (section_tables or []):
+                section = pv.get("section", "PDF")
+                table_name = pv.get("table_name", "Table")
+                sheet_label = f"{section} - {table_name}".strip(" -")
+                supporting["tables"].append({"filename": name, "type": "pdf", "sheet": sheet_label, "table": pv})
+                supporting["_by_file"].setdefault(name, {"documents": [], "tables": []})["tables"].append({"type": "pdf", "sheet": sheet_label, "table": pv})
+        except Exception:
+            pass
+
+
+def _ingest_file(name: str, data: bytes, parts: Optional[Tuple[str, ...]] = None) -> Dict[str, Any]:
+    """Parse one non-image upload into a single-file supporting context.
+
+    The result has the same shape as build_supporting_context() output so it can
+    be merged in upload order. `parts` limits PDF work to a subset of
+    PDF_INGEST_PARTS (default: all of them).
+    """
+    supporting = _new_file_context()
+    lower = name.lower()
+    parts = tuple(parts or PDF_INGEST_PARTS)
+
+    if lower.endswith(".pdf"):
+        # Parse once; the text, table and section extractors share the document.
+        with _PdfDocument(data) as pdf:
+            _ingest_pdf_parts(supporting, name, pdf, parts)
+        return supporting
+
+    if lower.endswith(".docx"):
+        t = _extract_docx_text(data)
+        if t.strip():
+            t = _clamp(t, MAX_DOC_CHARS_PER_FILE)
+            supporting["documents"].append({"filename": name, "type": "docx", "text": t})
+            supporting["_by_file"].setdefault(name, {"documents": [], "tables": []})["documents"].append({"type": "docx", "text": t})
+        else:
+            supporting["notes"].append(f"Could not extract text from DOCX: {name}")
+        return supporting
+
+    if lower.endswith((".txt", ".md", ".log")):
+        t = _normalize_ws(_safe_decode_text(data))
+        if t.strip():
+            t = _clamp(t, MAX_DOC_CHARS_PER_FILE)
+            supporting["documents"].append({"filename": name, "type": "text", "text": t})
+            supporting["_by_file"].setdefault(name, {"documents": [], "tables": []})["documents"].append({"type": "text", "text": t})
+        return supporting
+
+    if lower.endswith((".xlsx", ".xls", ".xlsm")):
+        try:
+            import pandas as pd  # type: ignore
+        except Exception:
+            supporting["notes"].append(f"Cannot parse Excel (pandas/openpyxl not installed): {name}")
+            return supporting
+        sheet_previews = None
+        if XLSX_STREAMING and lower.endswith((".xlsx", ".xlsm")):
+            # Fast path: stream rows straight into previews (no DataFrame per sheet)
+            try:
+                sheet_previews = _stream_xlsx_previews(data, lazy=XLSX_LAZY_SHEETS)
+            except Exception:
+                sheet_previews = None
+        if sheet_previews is not None:
+            added_any = False
+            for sheet, preview in sheet_previews:
+                if isinstance(preview, Exception):
+                    supporting["notes"].append(f"Excel sheet parse error for {name} / {sheet}: {preview}")
+                    continue
+                kind = _detect_gsc_table_kind(sheet, preview.get("headers") or [])
+                supporting["tables"].append({"filename": name, "type": "xlsx", "sheet": sheet, "table": preview, "_gsc_kind": kind})
+                supporting["_by_file"].setdefault(name, {"tables": []})["tables"].append({"type": "xlsx", "sheet": sheet, "table": preview, "_gsc_kind": kind})
+                added_any = True
+            if not added_any:
+                supporting["notes"].append(f"Excel parsed but no sheets could be read: {name}")
+            return supporting
+
+        try:
+            bio = io.BytesIO(data)
 
-    # Cap work
-    rows = table_rows[:MAX_LIST_ROWS]
-    out: List[Dict[str, Any]] = []
+            # Robust engine fallback:
+            # - Prefer openpyxl (best for .xlsx)
+            # - If openpyxl isn't available or fails, let pandas pick an engine.
+            try:
+                xl = pd.ExcelFile(bio, engine="openpyxl")
+            except Exception:
+                try:
+                    bio.seek(0)
+                except Exception:
+                    pass
+                xl = pd.ExcelFile(bio)
 
-    def _numish(v: Any) -> bool:
-        s = str(v).strip()
-        if not s or s.lower() in {"nan", "none"}:
-            return False
-        s2 = re.sub(r"[,$%\s]", "", s)
-        return bool(re.match(r"^[+-]?(\d+\.?\d*|\d*\.?\d+)$", s2))
+            added_any = False
+            for sheet in xl.sheet_names[:XLSX_MAX_SHEETS]:
+                try:
+                    df = xl.parse(sheet_name=sheet)
+                    preview = _df_preview(df)
+                    summary = _gsc_aggregate_frame(df, sheet)
+                    if summary and "error" not in preview:
+                        preview["gsc_aggregate"] = summary
+                    kind = _detect_gsc_table_kind(sheet, preview.get("headers") or [])
+                    supporting["tables"].append({"filename": name, "type": "xlsx", "sheet": sheet, "table": preview, "_gsc_kind": kind})
+                    supporting["_by_file"].setdefault(name, {"tables": []})["tables"].append({"type": "xlsx", "sheet": sheet, "table": preview, "_gsc_kind": kind})
+                    added_any = True
+                except Exception as se:
+                    supporting["notes"].append(f"Excel sheet parse error for {name} / {sheet}: {se}")
+
+            if not added_any:
+                supporting["notes"].append(f"Excel parsed but no sheets could be read: {name}")
+
+        except Exception as e:
+            supporting["notes"].append(f"Excel parse error for {name}: {e}")
+        return supporting
+
+    if lower.endswith(".csv"):
+        # CSV exports (including GA4) often include metadata lines before the header.
+        try:
+            import pandas as pd  # type: ignore
+        except Exception:
+            supporting["notes"].append(f"Cannot parse CSV (pandas not installed): {name}")
+            # Still register the file so it appears in UI/debug
+            supporting["_by_file"].setdefault(name, {"documents": [], "tables": [], "notes": []})["notes"].append(
+                "CSV parse skipped: pandas not installed"
+            )
+            return supporting
 
-    def _to_dict(r: Any) -> Dict[str, Any]:
-        if isinstance(r, dict):
-            return r
-        if isinstance(r, (list, tuple)):
-            d: Dict[str, Any] = {}
-            for i, v in enumerate(r):
-                k = keys[i] if i < len(keys) else f"col{i+1}"
-                d[str(k)] = v
-            return d
-        return {}
+        supporting["_by_file"].setdefault(name, {"documents": [], "tables": [], "notes": []})
 
-    for raw in rows:
-        r = _to_dict(raw)
-        if not r:
-            continue
+        def _read_csv_ga4_robust(raw: bytes):
+            # Decode small prefix for header detection
+            text = raw.decode("utf-8", errors="ignore")
+            lines = text.splitlines()
 
-        # KPI tables are usually (label, value, maybe delta/period)
-        # Pick metric label from the first non-numeric-ish cell
-        metric = ""
-        value = None
-        delta = None
+            # Find first plausible header line (non-empty, not starting with '#', contains comma)
+            header_idx = None
+            for i, ln in enumerate(lines[:50]):
+                s = (ln or "").strip()
+                if not s:
+                    continue
+                if s.startswith("#"):
+                    continue
+                if "," in s:
+                    header_idx = i
+                    break
 
-        ordered_vals = [r.get(k) for k in keys if k in r]
-        # Fallback if keys didn't align perfectly
-        if not ordered_vals:
-            ordered_vals = list(r.values())
+            skiprows = header_idx if header_idx is not None else 0
 
-        # metric: first non-num cell
-        for v in ordered_vals:
-            if v is None:
-                continue
-            if not _numish(v):
-                metric = str(v).strip()
-                break
+            # First attempt: ignore GA4 metadata lines and sniff delimiter
+            try:
+                return pd.read_csv(io.BytesIO(raw), comment="#", engine="python", sep=None, skiprows=skiprows)
+            except Exception:
+                # Fallback: strict comma with same skiprows
+                return pd.read_csv(io.BytesIO(raw), comment="#", sep=",", skiprows=skiprows)
 
-        # value: first numish cell
-        for v in ordered_vals:
-            if v is None:
-                continue
-            if _numish(v):
-                value = str(v).strip()
-                break
+        try:
+            df = None
+            if CSV_FAST_PATH:
+                try:
+                    df = _read_csv_fast(data)
+                except Exception:
+                    df = None
+            if df is None:
+                df = _read_csv_ga4_robust(data)
+            # Clean up unnamed columns
+            df = df.loc[:, [c for c in df.columns if str(c).strip() and not str(c).lower().startswith("unnamed")]]
+            preview = _df_preview(df)
+            summary = _gsc_aggregate_frame(df)
+            if summary and "error" not in preview:
+                preview["gsc_aggregate"] = summary
+            supporting["tables"].append({"filename": name, "type": "csv", "table": preview})
+            supporting["_by_file"][name]["tables"].append({"type": "csv", "sheet": "CSV", "table": preview})
+        except Exception as e:
+            err = f"CSV parse error for {name}: {e}"
+            supporting["notes"].append(err)
+            supporting["_by_file"][name]["notes"].append(err)
+        return supporting
+
+    msg = f"Unsupported file type for parsing: {name}"
+    supporting["notes"].append(msg)
+    supporting["_by_file"].setdefault(name, {"documents": [], "tables": [], "notes": []})["notes"].append(msg)
+    return supporting
 
-        # delta: numish with % or +/- if present
-        for v in ordered_vals:
-            if v is None:
-                continue
-            s = str(v).strip()
-            if ("%" in s or s.startswith(("+", "-"))) and _numish(s):
-                delta = s
-                break
 
-        if not metric or value is None:
-            continue
+def _merge_file_context(supporting: Dict[str, Any], part: Dict[str, Any]) -> None:
+    """Append a single-file context (see _ingest_file) onto the combined context."""
+    for key in ("documents", "tables", "notes"):
+        supporting[key].extend(part.get(key) or [])
+    for fname, blob in (part.get("_by_file") or {}).items():
+        dst = supporting["_by_file"].setdefault(fname, {k: [] for k in blob})
+        for k, v in blob.items():
+            dst.setdefault(k, []).extend(v or [])
+    if part.get("_pdf_kinds"):
+        supporting.setdefault("_pdf_kinds", {}).update(part["_pdf_kinds"])
+    # numeric extraction counters (e.g. OCR pages / OCR cache hits)
+    for k, v in (part.get("_stats") or {}).items():
+        if isinstance(v, (int, float)):
+            _bump_stat(supporting.setdefault("_stats", {}), k, v)
+
+
+def _ingest_pool_task(name: str, data: bytes) -> Optional[Dict[str, Any]]:
+    """Process-pool worker: _ingest_file(), except that a scanned PDF is handed back
+    (None) once classified, so its OCR runs in the parent with a page-level pool
+    (pools are not nested inside workers)."""
+    if name.lower().endswith(".pdf"):
+        supporting = _new_file_context()
+        with _PdfDocument(data) as pdf:
+            if pdf.classify() == "scanned":
+                return None
+            _ingest_pdf_parts(supporting, name, pdf, PDF_INGEST_PARTS)
+        return supporting
+    return _ingest_file(name, data)
+
+
+def _ingest_uploads_parallel(uploads: List[Tuple[str, bytes]]) -> List[Dict[str, Any]]:
+    """Ingest uploads through the process pool; returns one merged context per upload.
+
+    Each upload is one task, classified and parsed once inside its worker.
+    Uploads the pool hands back (scanned PDFs, see _ingest_pool_task) or could
+    not complete are parsed in-process, so the output never depends on the pool.
+    """
+    tasks: List[Tuple[str, bytes]] = list(uploads)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(tasks)
+    if len(tasks) > 1:
+        results = _process_pool_map(_ingest_pool_task, tasks, INGEST_MAX_WORKERS, INGEST_TIMEOUT_S)
 
-        out.append({
-            "metric": metric,
-            "value": value,
-            "delta": delta,
-            "evidence_ref": source_ref,
-            "confidence": "Medium",
-        })
+    per_upload = [_new_file_context() for _ in uploads]
+    for task, part, res in zip(tasks, per_upload, results):
+        _merge_file_context(part, res if res is not None else _ingest_file(*task))
+    return per_upload
 
-    return out
-def build_supporting_context(uploaded_files: List[Any]) -> Dict[str, Any]:
-    """Parse non-image uploads into structured evidence for the model."""
-    supporting: Dict[str, Any] = {"documents": [], "tables": [], "notes": [], "_by_file": {}}
+
+def build_supporting_context(uploaded_files: List[Any], parallel: Optional[bool] = None, use_cache: Optional[bool] = None) -> Dict[str, Any]:
+    """Parse non-image uploads into structured evidence for the model.
+
+    With parallel ingestion (default: INGEST_PARALLEL) uploads are parsed in a
+    process pool; results are merged in upload order, so the output is the same
+    as the serial path. Files already seen (same bytes, same EXTRACTOR_VERSION
+    and extraction switches) are served from the extraction cache (default:
+    EXTRACTION_CACHE_ENABLED); parses that lost OCR work are not cached.
+    """
+    supporting: Dict[str, Any] = _new_file_context()
     total_chars = 0
 
     # Lazy availability checks
@@ -1413,9 +4346,9 @@ def build_supporting_context(uploaded_files: List[Any]) -> Dict[str, Any]:
     except Exception:
         has_fitz = False
 
+    uploads: List[Tuple[str, bytes]] = []
     for f in uploaded_files or []:
         name = getattr(f, "name", "uploaded_file")
-        lower = name.lower()
         data = f.getvalue() if hasattr(f, "getvalue") else (f.read() if hasattr(f, "read") else b"")
         try:
             if hasattr(f, "seek"):
@@ -1424,177 +4357,90 @@ def build_supporting_context(uploaded_files: List[Any]) -> Dict[str, Any]:
             pass
 
         # Skip images here
-        if lower.endswith((".png", ".jpg", ".jpeg", ".webp")):
-            continue
-
-        if lower.endswith(".pdf"):
-            t = _extract_pdf_text(data)
-            if t.strip():
-                t = _clamp(t, MAX_DOC_CHARS_PER_FILE)
-                supporting["documents"].append({"filename": name, "type": "pdf", "text": t})
-                supporting["_by_file"].setdefault(name, {"documents": [], "tables": []})["documents"].append({"type": "pdf", "text": t})
-                total_chars += len(t)
-            else:
-                supporting["notes"].append(f"Could not extract text from PDF: {name}")
-
-            # Best-effort table extraction (helps with PDF exports that contain embedded tables)
-            try:
-                pdf_tables = _extract_pdf_tables(data)
-                for pv in (pdf_tables or []):
-                    # Represent each table like an Excel sheet preview
-                    page = pv.get("page", "")
-                    t_i = pv.get("table_index", "")
-                    sheet_label = f"PDF page {page} table {t_i}".strip()
-                    supporting["tables"].append({"filename": name, "type": "pdf", "sheet": sheet_label, "table": pv})
-                    supporting["_by_file"].setdefault(name, {"documents": [], "tables": []})["tables"].append({"type": "pdf", "sheet": sheet_label, "table": pv})
-            except Exception:
-                pass
-
-            # Best-effort "clean tables per section" extraction for dashboard-style PDFs (includes OCR fallback)
-            try:
-                section_tables = _extract_pdf_section_tables(data, enable_ocr=True)
-                for pv in (section_tables or []):
-                    section = pv.get("section", "PDF")
-                    table_name = pv.get("table_name", "Table")
-                    sheet_label = f"{section} - {table_name}".strip(" -")
-                    supporting["tables"].append({"filename": name, "type": "pdf", "sheet": sheet_label, "table": pv})
-                    supporting["_by_file"].setdefault(name, {"documents": [], "tables": []})["tables"].append({"type": "pdf", "sheet": sheet_label, "table": pv})
-            except Exception:
-                pass
-
-            continue
-
-        if lower.endswith(".docx"):
-            t = _extract_docx_text(data)
-            if t.strip():
-                t = _clamp(t, MAX_DOC_CHARS_PER_FILE)
-                supporting["documents"].append({"filename": name, "type": "docx", "text": t})
-                supporting["_by_file"].setdefault(name, {"documents": [], "tables": []})["documents"].append({"type": "docx", "text": t})
-                total_chars += len(t)
-            else:
-                supporting["notes"].append(f"Could not extract text from DOCX: {name}")
-            continue
-
-        if lower.endswith((".txt", ".md", ".log")):
-            t = _normalize_ws(_safe_decode_text(data))
-            if t.strip():
-                t = _clamp(t, MAX_DOC_CHARS_PER_FILE)
-                supporting["documents"].append({"filename": name, "type": "text", "text": t})
-                supporting["_by_file"].setdefault(name, {"documents": [], "tables": []})["documents"].append({"type": "text", "text": t})
-                total_chars += len(t)
-            continue
-
-            continue
-
-
-        if lower.endswith((".xlsx", ".xls", ".xlsm")):
-            if not has_pandas:
-                supporting["notes"].append(f"Cannot parse Excel (pandas/openpyxl not installed): {name}")
-                continue
-            try:
-                import pandas as pd  # type: ignore
-                bio = io.BytesIO(data)
-
-                # Robust engine fallback:
-                # - Prefer openpyxl (best for .xlsx)
-                # - If openpyxl isn't available or fails, let pandas pick an engine.
-                try:
-                    xl = pd.ExcelFile(bio, engine="openpyxl")
-                except Exception:
-                    try:
-                        bio.seek(0)
-                    except Exception:
-                        pass
-                    xl = pd.ExcelFile(bio)
-
-                added_any = False
-                for sheet in xl.sheet_names[:12]:
-                    try:
-                        df = xl.parse(sheet_name=sheet)
-                        preview = _df_preview(df)
-                        kind = _detect_gsc_table_kind(sheet, preview.get("headers") or [])
-                        supporting["tables"].append({"filename": name, "type": "xlsx", "sheet": sheet, "table": preview, "_gsc_kind": kind})
-                        supporting["_by_file"].setdefault(name, {"tables": []})["tables"].append({"type": "xlsx", "sheet": sheet, "table": preview, "_gsc_kind": kind})
-                        added_any = True
-                    except Exception as se:
-                        supporting["notes"].append(f"Excel sheet parse error for {name} / {sheet}: {se}")
-
-                if not added_any:
-                    supporting["notes"].append(f"Excel parsed but no sheets could be read: {name}")
-
-            except Exception as e:
-                supporting["notes"].append(f"Excel parse error for {name}: {e}")
+        if name.lower().endswith((".png", ".jpg", ".jpeg", ".webp")):
             continue
+        uploads.append((name, data))
 
-        
-        if lower.endswith(".csv"):
-            # CSV exports (including GA4) often include metadata lines before the header.
-            try:
-                import pandas as pd  # type: ignore
-            except Exception:
-                supporting["notes"].append(f"Cannot parse CSV (pandas not installed): {name}")
-                # Still register the file so it appears in UI/debug
-                supporting["_by_file"].setdefault(name, {"documents": [], "tables": [], "notes": []})["notes"].append(
-                    "CSV parse skipped: pandas not installed"
-                )
-                continue
-
-            supporting["_by_file"].setdefault(name, {"documents": [], "tables": [], "notes": []})
-
-            def _read_csv_ga4_robust(raw: bytes):
-                # Decode small prefix for header detection
-                text = raw.decode("utf-8", errors="ignore")
-                lines = text.splitlines()
-
-                # Find first plausible header line (non-empty, not starting with '#', contains comma)
-                header_idx = None
-                for i, ln in enumerate(lines[:50]):
-                    s = (ln or "").strip()
-                    if not s:
-                        continue
-                    if s.startswith("#"):
-                        continue
-                    if "," in s:
-                        header_idx = i
-                        break
-
-                skiprows = header_idx if header_idx is not None else 0
-
-                # First attempt: ignore GA4 metadata lines and sniff delimiter
-                try:
-                    return pd.read_csv(io.BytesIO(raw), comment="#", engine="python", sep=None, skiprows=skiprows)
-                except Exception:
-                    # Fallback: strict comma with same skiprows
-                    return pd.read_csv(io.BytesIO(raw), comment="#", sep=",", skiprows=skiprows)
+    if parallel is None:
+        parallel = INGEST_PARALLEL
+    if use_cache is None:
+        use_cache = EXTRACTION_CACHE_ENABLED
 
-            try:
-                df = _read_csv_ga4_robust(data)
-                # Clean up unnamed columns
-                df = df.loc[:, [c for c in df.columns if str(c).strip() and not str(c).lower().startswith("unnamed")]]
-                supporting["tables"].append({"filename": name, "type": "csv", "table": _df_preview(df)})
-                supporting["_by_file"][name]["tables"].append({"type": "csv", "sheet": "CSV", "table": _df_preview(df)})
-            except Exception as e:
-                err = f"CSV parse error for {name}: {e}"
-                supporting["notes"].append(err)
-                supporting["_by_file"][name]["notes"].append(err)
-            continue
-        msg = f"Unsupported file type for parsing: {name}"
-        supporting["notes"].append(msg)
-        supporting["_by_file"].setdefault(name, {"documents": [], "tables": [], "notes": []})["notes"].append(msg)
+    # Cache lookup first, so only new / changed files are parsed.
+    cache: Optional[_ExtractionCache] = None
+    if use_cache:
+        try:
+            cache = _get_extraction_cache()
+        except Exception:
+            cache = None
+    switches = _extraction_switches() if cache is not None else ""
+    cache_keys = [_extraction_cache_key(name, data, switches) for name, data in uploads] if cache is not None else []
+    cached: List[Optional[Dict[str, Any]]] = [None] * len(uploads)
+    cache_hits = 0
+    for i, (name, _) in enumerate(uploads):
+        if cache is None:
+            break
+        hit = cache.get(cache_keys[i])
+        if isinstance(hit, dict) and isinstance(hit.get("context"), dict):
+            cached[i] = _relabel_file_context(hit["context"], str(hit.get("name") or name), name)
+            cache_hits += 1
+
+    pending = [i for i in range(len(uploads)) if cached[i] is None]
+    parsed: Dict[int, Dict[str, Any]] = {}
+    if parallel and pending:
+        parsed = dict(zip(pending, _ingest_uploads_parallel([uploads[i] for i in pending])))
+
+    for i, (name, data) in enumerate(uploads):
+        part = cached[i]
+        if part is None:
+            part = parsed.get(i) or _ingest_file(name, data)
+            if cache is not None and not _extraction_degraded(part):
+                # run counters (OCR etc.) describe this parse only; don't replay them on hits
+                cache.put(cache_keys[i], {"name": name, "context": {k: v for k, v in part.items() if k != "_stats"}})
+        _merge_file_context(supporting, part)
+        total_chars += sum(len(d.get("text") or "") for d in (part.get("documents") or []))
 
         if total_chars > MAX_SUPPORTING_TEXT_CHARS:
             supporting["notes"].append("Supporting context truncated due to size limits.")
             break
 
+    run_stats = supporting.pop("_stats", {}) or {}
+    pdf_kinds = supporting.pop("_pdf_kinds", {}) or {}
+    ocr_hits = int(run_stats.get("ocr_cache_hits", 0))
+    ocr_misses = int(run_stats.get("ocr_cache_misses", 0))
     supporting["_extraction_stats"] = {
         "documents_count": len(supporting.get("documents", [])),
         "tables_count": len(supporting.get("tables", [])),
+        "deferred_sheets": sum(1 for t in supporting.get("tables", []) if (t.get("table") or {}).get("deferred")),
         "notes_count": len(supporting.get("notes", [])),
         "has_pandas": has_pandas,
         "has_pdfplumber": has_pdfplumber,
         "has_pypdf2": has_pypdf2,
         "has_docx": has_docx,
         "has_fitz": has_fitz,
+        "pdf_classification": pdf_kinds,
+        "pdf_templates": {
+            "hits": int(run_stats.get("pdf_template_hits", 0)),
+            "misses": int(run_stats.get("pdf_template_misses", 0)),
+        },
+        "parallel_ingestion": bool(parallel),
+        "ingest_workers": INGEST_MAX_WORKERS if parallel else 1,
+        "extraction_cache": {
+            "enabled": cache is not None,
+            "version": EXTRACTOR_VERSION,
+            "hits": cache_hits,
+            "misses": len(uploads) - cache_hits if cache is not None else 0,
+            "lifetime": dict(cache.stats) if cache is not None else {},
+        },
+        "ocr": {
+            "pages": int(run_stats.get("ocr_pages", 0)),
+            "pages_skipped": int(run_stats.get("ocr_pages_skipped", 0)),
+            "images_failed": int(run_stats.get("ocr_failed", 0)),
+            "regions": int(run_stats.get("ocr_regions", 0)),
+            "cache_hits": ocr_hits,
+            "cache_misses": ocr_misses,
+            "cache_hit_rate": round(ocr_hits / float(ocr_hits + ocr_misses), 3) if (ocr_hits + ocr_misses) else None,
+        },
     }
     return supporting
 
@@ -1651,8 +4497,8 @@ Rules:
 - Confidence must be one of: High, Medium, Low. Prefer High only when numbers/labels are explicit.
 - Do not editorialize. Do not write an email. Do not mention limitations like 'in this workspace'.""".strip()
 
-def run_evidence_extraction(client: OpenAI, model: str, omni_notes: str, supporting_context: Dict[str, Any], image_parts_for_model: List[Tuple[str, bytes, str]]) -> Dict[str, Any]:
-    supporting_json = json.dumps(supporting_context, ensure_ascii=False)
+def run_evidence_extraction(client: "OpenAI", model: str, omni_notes: str, supporting_context: Dict[str, Any], image_parts_for_model: List[Tuple[str, bytes, str]]) -> Dict[str, Any]:
+    supporting_json = json.dumps(supporting_context, ensure_ascii=False, default=_json_default)
     user_text = f"""Omni notes (for context only; do not invent results):
 {omni_notes}
 
@@ -1731,7 +4577,8 @@ def bullets_to_html(items: List[str]) -> str:
 def _format_gsc_opportunity_item(row: Any) -> str:
     """Format a GSC opportunity row dict into a concise string.
 
-    Expected row shape: {"item": str, "impressions": int/str, "ctr": "0.80%" or float, "position": float/str}
+    Expected row shape: {"item": str, "impressions": int/str, "ctr": "0.80%" or float, "position": float/str,
+    "expected_ctr": "2.40%" (optional)}
     Safe for partial/missing keys.
     """
     if isinstance(row, str):
@@ -1774,6 +4621,9 @@ def _format_gsc_opportunity_item(row: Any) -> str:
                 parts.append(f"{val:.2f}% CTR")
     except Exception:
         pass
+    expected = str(row.get("expected_ctr") or "").strip()
+    if expected and parts and parts[-1].endswith("CTR"):
+        parts[-1] += f" ({expected} expected)"
     # Position
     try:
         if pos not in (None, ""):
@@ -1946,9 +4796,19 @@ def _detect_image_subtype(data: bytes) -> str | None:
     return None
 
 
+def _json_default(obj: Any) -> Any:
+    """json.dumps hook: columnar table previews serialize as the legacy preview dict."""
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if _is_entity_index(obj):
+        return obj.summary()  # per-entity arrays stay out of prompts / exports
+    if hasattr(obj, "tolist"):
+        return obj.tolist()  # NumPy arrays / scalars
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
 def _json_deepcopy(obj: Any) -> Any:
     try:
-        return json.loads(json.dumps(obj))
+        return json.loads(json.dumps(obj, default=_json_default))
     except Exception:
         return copy.deepcopy(obj)
 
@@ -1963,6 +4823,42 @@ def _safe_float(x: Any) -> Optional[float]:
     except Exception:
         return None
 
+@functools.lru_cache(maxsize=4096)
+def _norm_header(s: str) -> str:
+    s = str(s or "").strip().lower()
+    s = re.sub(r"[\s\u00A0]+", " ", s)
+    s = re.sub(r"[^a-z0-9 ]+", "", s)
+    return s.strip()
+
+@functools.lru_cache(maxsize=256)
+def _needle_variants(needles: Tuple[str, ...]) -> Tuple[Tuple[str, frozenset], ...]:
+    """Normalized needles plus singular/plural variants, each with its tokens."""
+    out: List[str] = []
+    for n in needles:
+        n = _norm_header(n)
+        vs = {n}
+        # basic pluralization helpers
+        if n.endswith("y"):
+            vs.add(n[:-1] + "ies")
+        if not n.endswith("s"):
+            vs.add(n + "s")
+        if n.endswith("s"):
+            vs.add(n[:-1])
+        out.extend(sorted(v for v in vs if v))
+    return tuple((v, frozenset(v.split())) for v in out)
+
+def _header_matches(h: str, variants: Tuple[Tuple[str, frozenset], ...]) -> bool:
+    toks = None
+    for n, n_toks in variants:
+        # exact, substring both directions ('top queries' vs 'query'), or token containment
+        if n in h or h in n:
+            return True
+        if toks is None:
+            toks = frozenset(h.split())
+        if n_toks <= toks:
+            return True
+    return False
+
 def _find_col(headers: List[str], needles: List[str]) -> Optional[int]:
     """Return the column index whose header matches any needle.
 
@@ -1971,56 +4867,71 @@ def _find_col(headers: List[str], needles: List[str]) -> Optional[int]:
     - Accept 'Top queries' style headers (needle is substring-ish)
     - Normalize whitespace + punctuation
     """
-    def norm(s: str) -> str:
-        s = str(s or "").strip().lower()
-        s = re.sub(r"[\s\u00A0]+", " ", s)
-        s = re.sub(r"[^a-z0-9 ]+", "", s)
-        return s.strip()
-
-    hs_raw = [str(h) for h in headers]
-    hs = [norm(h) for h in hs_raw]
-
-    def variants(n: str) -> List[str]:
-        n = norm(n)
-        out = {n}
-        # basic pluralization helpers
-        if n.endswith("y"):
-            out.add(n[:-1] + "ies")
-        if not n.endswith("s"):
-            out.add(n + "s")
-        if n.endswith("s"):
-            out.add(n[:-1])
-        return [v for v in out if v]
-
-    needles_v = []
-    for n in needles:
-        needles_v.extend(variants(n))
-
-    for i, h in enumerate(hs):
-        for n in needles_v:
-            if h == n:
-                return i
-            # substring match both directions to catch 'top queries' vs 'query'
-            if n in h or h in n:
-                return i
-            # token containment (e.g., 'top queries' contains token 'queries')
-            if all(tok in h.split() for tok in n.split()):
-                return i
+    variants = _needle_variants(tuple(needles))
+    for i, h in enumerate(headers):
+        if _header_matches(_norm_header(str(h)), variants):
+            return i
     return None
 
-def _table_rows_as_dicts(table_preview: Dict[str, Any]) -> List[Dict[str, Any]]:
-    headers = table_preview.get("headers") or []
-    rows = table_preview.get("rows") or []
-    out = []
-    for r in rows:
-        d = {}
-        for i, h in enumerate(headers):
-            if i < len(r):
-                d[str(h)] = r[i]
-            else:
-                d[str(h)] = ""
-        out.append(d)
-    return out
+# Canonical column roles of a GSC table, resolved once per header row (see _table_schema).
+GSC_ROLE_NEEDLES: Dict[str, List[str]] = {
+    "clicks": ["clicks"],
+    "impressions": ["impressions"],
+    "ctr": ["ctr"],
+    "position": ["position", "avg position"],
+    "date": ["date"],
+}
+# Dimension column per table kind (top lists / breakdowns / last-resort pages)
+GSC_DIMENSION_NEEDLES: Dict[str, List[str]] = {
+    "queries": ["query", "queries", "top queries", "top query"],
+    "pages": ["page", "pages", "top pages", "url"],
+    "countries": ["country"],
+    "devices": ["device"],
+    "search_appearance": ["search appearance", "appearance"],
+}
+GSC_METRIC_NEEDLES = ["click", "impression", "ctr", "position", "avg position"]
+
+@functools.lru_cache(maxsize=512)
+def _resolve_gsc_schema(headers: Tuple[str, ...]) -> Dict[str, Any]:
+    """Map a header row to column roles in one pass over the headers.
+
+    Returns {"clicks", "impressions", "ctr", "position", "date": index or None,
+    "dimension": {kind: index}, "opportunity": {kind: index} (GSC_OPPORTUNITY_DIMS),
+    "label": first non-metric column}. Indexes are what _find_col would return for
+    the same needles. Cached by header tuple; treat the result as read-only.
+    """
+    roles: List[Tuple[Tuple[str, str], Any]] = []
+    for role, needles in GSC_ROLE_NEEDLES.items():
+        roles.append((("", role), _needle_variants(tuple(needles))))
+    for kind, needles in GSC_DIMENSION_NEEDLES.items():
+        roles.append((("dimension", kind), _needle_variants(tuple(needles))))
+    for kind, needles in GSC_OPPORTUNITY_DIMS.items():
+        roles.append((("opportunity", kind), _needle_variants(tuple(needles))))
+    found: Dict[Tuple[str, str], int] = {}
+    label = None
+    for i, raw in enumerate(headers):
+        h = _norm_header(raw)
+        for key, variants in roles:
+            if key not in found and _header_matches(h, variants):
+                found[key] = i
+        if label is None and not any(m in str(raw).lower() for m in GSC_METRIC_NEEDLES):
+            label = i
+    schema: Dict[str, Any] = {role: found.get(("", role)) for role in GSC_ROLE_NEEDLES}
+    schema["dimension"] = {k: found.get(("dimension", k)) for k in GSC_DIMENSION_NEEDLES}
+    schema["opportunity"] = {k: found.get(("opportunity", k)) for k in GSC_OPPORTUNITY_DIMS}
+    schema["label"] = label
+    return schema
+
+def _table_schema(preview: Any) -> Dict[str, Any]:
+    """Column roles of a table preview; cached on columnar tables, LRU by header tuple otherwise."""
+    cached = getattr(preview, "schema", None)
+    if isinstance(cached, dict):
+        return cached
+    headers = preview.get("headers") if isinstance(preview, Mapping) else preview
+    schema = _resolve_gsc_schema(tuple(str(h) for h in (headers or [])))
+    if hasattr(preview, "num"):
+        preview.schema = schema
+    return schema
 
 def _detect_gsc_table_kind(sheet: str, headers: List[str]) -> str:
     """Classify GSC export tables by sheet name / headers.
@@ -2057,23 +4968,142 @@ def _detect_gsc_table_kind(sheet: str, headers: List[str]) -> str:
 
     return "unknown"
 
-def _compute_gsc_totals(rows: List[Dict[str, Any]], click_key: str, impr_key: str) -> Tuple[float, float]:
-    clicks = 0.0
-    imps = 0.0
-    for r in rows:
-        c = _safe_float(r.get(click_key))
-        i = _safe_float(r.get(impr_key))
-        if c is not None:
-            clicks += c
-        if i is not None:
-            imps += i
-    return clicks, imps
+def _gsc_table(preview: Mapping, part: str = "") -> "_ColumnarTable":
+    """Columnar view of a GSC table: the full-table aggregate's `part` rows when present, else the preview."""
+    headers = preview.get("headers") or []
+    agg = preview.get("gsc_aggregate")
+    if part and isinstance(agg, Mapping) and isinstance(agg.get(part), list):
+        return _ColumnarTable.from_rows(headers, agg[part])
+    if callable(getattr(preview, "num", None)):
+        return preview  # built at ingestion
+    return _ColumnarTable.from_rows(headers, preview.get("rows") or [])
+
+def _nan_none(x: Any) -> Optional[float]:
+    return None if x != x else float(x)
+
+MOM_LIST_ROWS = 15  # gainers / losers kept per dimension (queries, pages)
+
+def _mom_delta(now: Optional[float], prev: Optional[float], points: bool = False) -> str:
+    """KPI "delta" cell vs the previous period ("+1,204 (+12.5%)", or "+0.42 pp" for rates); "" without a prior value."""
+    if now is None or prev is None:
+        return ""
+    if points:
+        return f"{(now - prev) * 100:+.2f} pp vs previous period"
+    pct = f" ({(now - prev) / prev:+.1%})" if prev else ""
+    return f"{now - prev:+,.0f}{pct} vs previous period"
+
+def _gsc_entity_index(kind: str, gsc_tables: List[Tuple[str, Dict[str, Any]]]) -> Optional[Tuple["_GscEntityIndex", str]]:
+    """(_GscEntityIndex, evidence ref) of the first `kind` table: the full-table index when ingestion built one, else the preview rows."""
+    import numpy as np  # type: ignore
+    for k, t in gsc_tables:
+        if k != kind:
+            continue
+        preview = t.get("table") or {}
+        ref = f"{t.get('filename')} / {t.get('sheet')}"
+        agg = preview.get("gsc_aggregate")
+        if isinstance(agg, Mapping) and _is_entity_index(agg.get("entities")):
+            return agg["entities"], ref
+        sch = _table_schema(preview)
+        dim_i = sch["opportunity"].get(kind)
+        if dim_i is None:
+            continue
+        ct = _gsc_table(preview)
+        pos = ct.num(sch["position"]) if sch["position"] is not None else np.full(ct.n_rows, np.nan)
+        index = _GscEntityIndex.from_rows(kind, ct.text(dim_i), ct.num(sch["clicks"]), ct.num(sch["impressions"]), pos)
+        return index, f"{ref} (preview rows)"
+    return None
+
+def _gsc_mom_changes(
+    current: Tuple["_GscEntityIndex", str],
+    previous: Tuple["_GscEntityIndex", str],
+    n: int = MOM_LIST_ROWS,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """(gainers, losers) by click change between two periods of the same GSC dimension.
+
+    A hash join (pd.Index.get_indexer) matches current entities to prior ones; prior
+    entities with no current row are appended as "lost" (0 clicks now), current ones
+    with no prior row are "new". Deltas are computed column-wise over the joined
+    arrays, so the cost is linear in rows; only the 2 * n listed entities become dicts.
+    Position delta < 0 means the entity moved up.
+    """
+    import numpy as np  # type: ignore
+    cur, cur_ref = current
+    prev, prev_ref = previous
+    idx = pd.Index(prev.join_keys, dtype=object).get_indexer(cur.join_keys)  # -1 = new this period
+    matched = idx >= 0
+    gone = np.ones(len(prev), dtype=bool)
+    gone[idx[matched]] = False
+
+    def _joined(now: Any, before: Any, fill: float) -> Tuple[Any, Any]:
+        # idx == -1 picks the appended fill value
+        prior = np.append(before, fill)[idx]
+        return np.concatenate([now, np.full(int(gone.sum()), fill)]), np.concatenate([prior, before[gone]])
+
+    labels = cur.labels + [prev.labels[r] for r in np.flatnonzero(gone)]
+    status = np.concatenate([np.where(matched, "", "new"), np.full(int(gone.sum()), "lost")])
+    c1, c0 = _joined(cur.clicks, prev.clicks, 0.0)
+    i1, i0 = _joined(cur.impressions, prev.impressions, 0.0)
+    p1, p0 = _joined(cur.position, prev.position, np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r1 = np.where(i1 > 0, c1 / i1, np.nan)
+        r0 = np.where(i0 > 0, c0 / i0, np.nan)
+    dc = c1 - c0
+    ref = f"{cur_ref} vs {prev_ref} (previous period)"
+
+    def _entry(r: int) -> Dict[str, Any]:
+        ctr, ctr_prev, pos, pos_prev = _nan_none(r1[r]), _nan_none(r0[r]), _nan_none(p1[r]), _nan_none(p0[r])
+        return {
+            "item": labels[r],
+            "clicks": int(c1[r]),
+            "clicks_prev": int(c0[r]),
+            "clicks_delta": int(dc[r]),
+            "impressions": int(i1[r]),
+            "impressions_prev": int(i0[r]),
+            "impressions_delta": int(i1[r] - i0[r]),
+            "ctr": f"{ctr:.2%}" if ctr is not None else "",
+            "ctr_prev": f"{ctr_prev:.2%}" if ctr_prev is not None else "",
+            "ctr_delta": f"{(ctr - ctr_prev) * 100:+.2f} pp" if ctr is not None and ctr_prev is not None else "",
+            "position": round(pos, 2) if pos is not None else "",
+            "position_prev": round(pos_prev, 2) if pos_prev is not None else "",
+            "position_delta": round(pos - pos_prev, 2) if pos is not None and pos_prev is not None else "",
+            "status": str(status[r]),
+            "evidence_ref": ref,
+            "confidence": "High",
+        }
+
+    gainers = [_entry(int(r)) for r in _top_k_indices(dc, n, mask=dc > 0)]
+    losers = [_entry(int(r)) for r in _top_k_indices(-dc, n, mask=dc < 0)]
+    return gainers, losers
+
+def _opportunity_entries(index: "_GscEntityIndex", ref: str, thresholds: Optional[Mapping] = None, n: int = MAX_LIST_ROWS) -> List[Dict[str, Any]]:
+    """Opportunity list entries for one queries / pages entity index, most missed clicks first."""
+    missed, expected, ctr = _score_opportunities(index.clicks, index.impressions, index.position, thresholds)
+    out = []
+    for r in _top_k_indices(missed, n):
+        pos = float(index.position[r])
+        out.append({
+            "item": index.labels[r],
+            "impressions": int(index.impressions[r]),
+            "clicks": int(index.clicks[r]),
+            "ctr": f"{float(ctr[r]):.2%}",
+            "expected_ctr": f"{float(expected[r]):.2%}",
+            "missed_clicks": int(round(float(missed[r]))),
+            "position": round(pos, 2),
+            "why_it_matters": (
+                f"About {int(round(float(missed[r]))):,} missed clicks: CTR {float(ctr[r]):.2%} vs "
+                f"{float(expected[r]):.2%} expected at position {pos:.1f} on this site (opportunity)."
+            ),
+            "evidence_ref": f"{ref} (opportunity score)",
+            "confidence": "Medium",
+        })
+    return out
 
-def _build_data_signals(supporting_context: Dict[str, Any]) -> Dict[str, Any]:
+def _select_gsc_tables(supporting_context: Dict[str, Any]) -> Tuple[Optional[str], List[Tuple[str, Dict[str, Any]]]]:
+    """(best GSC file or None, [(kind, table), ...]) for the tables carrying clicks + impressions columns."""
     tables = supporting_context.get("tables") or []
     # If multiple files provide tables, prefer the file that most resembles a GSC export
     by_file = supporting_context.get("_by_file") or {}
-    gsc_sheet_names = {"chart","queries","pages","countries","devices","search appearance","filters"}
+    gsc_sheet_names = GSC_SHEET_NAMES
     best_gsc_file = None
     best_score = 0
     for fname, blob in by_file.items():
@@ -2084,15 +5114,6 @@ def _build_data_signals(supporting_context: Dict[str, Any]) -> Dict[str, Any]:
             best_gsc_file = fname
     if best_gsc_file and best_score >= 2:
         tables = [t for t in tables if (t.get("filename") == best_gsc_file)]
-    data_signals = {
-        "kpis": [],
-        "top_queries": [],
-        "top_pages": [],
-        "opportunity_queries": [],
-        "opportunity_pages": [],
-        "distribution_breakdowns": {"devices": [], "countries": [], "search_appearance": []},
-        "trend_notes": [],
-    }
 
     # Collect candidate GSC tables
     gsc_tables = []
@@ -2101,12 +5122,16 @@ def _build_data_signals(supporting_context: Dict[str, Any]) -> Dict[str, Any]:
         preview = t.get("table") or {}
         headers = preview.get("headers") or []
         # Require core metrics
-        if _find_col(headers, ["clicks"]) is None or _find_col(headers, ["impressions"]) is None:
+        sch = _table_schema(preview)
+        if sch["clicks"] is None or sch["impressions"] is None:
             continue
         kind = t.get("_gsc_kind") or _detect_gsc_table_kind(sheet, headers)
         gsc_tables.append((kind, t))
+    return best_gsc_file, gsc_tables
 
-    # Prefer totals from Chart if present; otherwise take first available totals
+def _gsc_totals(gsc_tables: List[Tuple[str, Dict[str, Any]]]) -> Optional[Tuple[float, float, str]]:
+    """(clicks, impressions, evidence ref): Chart totals if present, else the first table with totals."""
+    import numpy as np  # type: ignore
     totals_clicks = None
     totals_imps = None
     totals_ref = None
@@ -2115,15 +5140,17 @@ def _build_data_signals(supporting_context: Dict[str, Any]) -> Dict[str, Any]:
         if kind not in ("chart", "unknown", "queries", "pages", "countries", "devices", "search_appearance"):
             continue
         preview = t.get("table") or {}
-        headers = preview.get("headers") or []
-        rows = _table_rows_as_dicts(preview)
-        ci = _find_col(headers, ["clicks"])
-        ii = _find_col(headers, ["impressions"])
+        sch = _table_schema(preview)
+        ci, ii = sch["clicks"], sch["impressions"]
         if ci is None or ii is None:
             continue
-        click_key = str(headers[ci])
-        impr_key = str(headers[ii])
-        clicks, imps = _compute_gsc_totals(rows, click_key, impr_key)
+        agg = preview.get("gsc_aggregate")
+        if isinstance(agg, Mapping):
+            # running sums over the whole sheet, not just the preview rows
+            clicks, imps = float(agg.get("clicks") or 0.0), float(agg.get("impressions") or 0.0)
+        else:
+            ct = _gsc_table(preview)
+            clicks, imps = float(np.nansum(ct.num(ci))), float(np.nansum(ct.num(ii)))
         if clicks <= 0 and imps <= 0:
             continue
         # Prefer chart
@@ -2132,13 +5159,49 @@ def _build_data_signals(supporting_context: Dict[str, Any]) -> Dict[str, Any]:
             totals_ref = f"{t.get('filename')} / {t.get('sheet')}"
             if kind == "chart":
                 break
+    if totals_clicks is None or totals_imps is None:
+        return None
+    return totals_clicks, totals_imps, totals_ref
+
+def _build_data_signals(
+    supporting_context: Dict[str, Any],
+    previous_context: Optional[Dict[str, Any]] = None,
+    opportunity_thresholds: Optional[Mapping] = None,
+) -> Dict[str, Any]:
+    """Layer A: KPIs, top/opportunity lists and breakdowns from the uploaded GSC export.
+
+    With `previous_context` (build_supporting_context of the prior period's upload),
+    KPI deltas and month-over-month gainers / losers are added (see _gsc_mom_changes).
+    `opportunity_thresholds` overrides OPPORTUNITY_THRESHOLDS for this client.
+    """
+    import numpy as np  # type: ignore
+    by_file = supporting_context.get("_by_file") or {}
+    best_gsc_file, gsc_tables = _select_gsc_tables(supporting_context)
+    data_signals = {
+        "kpis": [],
+        "top_queries": [],
+        "top_pages": [],
+        "opportunity_queries": [],
+        "opportunity_pages": [],
+        "distribution_breakdowns": {"devices": [], "countries": [], "search_appearance": []},
+        "trend_notes": [],
+        "mom_query_gainers": [],
+        "mom_query_losers": [],
+        "mom_page_gainers": [],
+        "mom_page_losers": [],
+    }
+    prev_gsc_file, prev_tables = _select_gsc_tables(previous_context) if previous_context else (None, [])
 
-    if totals_clicks is not None and totals_imps is not None:
+    totals = _gsc_totals(gsc_tables)
+    prev_totals = _gsc_totals(prev_tables) if prev_tables else None
+    if totals is not None:
+        totals_clicks, totals_imps, totals_ref = totals
+        prev_clicks, prev_imps = prev_totals[:2] if prev_totals else (None, None)
         data_signals["kpis"].append({
             "metric": "GSC Clicks",
             "value": f"{int(round(totals_clicks)):,}",
             "period": "",
-            "delta": "",
+            "delta": _mom_delta(totals_clicks, prev_clicks),
             "evidence_ref": totals_ref or "GSC export",
             "confidence": "High",
         })
@@ -2146,155 +5209,104 @@ def _build_data_signals(supporting_context: Dict[str, Any]) -> Dict[str, Any]:
             "metric": "GSC Impressions",
             "value": f"{int(round(totals_imps)):,}",
             "period": "",
-            "delta": "",
+            "delta": _mom_delta(totals_imps, prev_imps),
             "evidence_ref": totals_ref or "GSC export",
             "confidence": "High",
         })
         # Derived CTR (safe, but mark Medium)
         if totals_imps > 0:
             ctr = totals_clicks / totals_imps
+            prev_ctr = prev_clicks / prev_imps if prev_imps else None
             data_signals["kpis"].append({
                 "metric": "GSC CTR (derived)",
                 "value": f"{ctr:.2%}",
                 "period": "",
-                "delta": "",
+                "delta": _mom_delta(ctr, prev_ctr, points=True),
                 "evidence_ref": totals_ref or "GSC export (derived from totals)",
                 "confidence": "Medium",
             })
 
     # Build lists for queries/pages and breakdowns
-    def top_n(kind: str, dim_needles: List[str], target_list: List[Dict[str, Any]], n: int = MAX_LIST_ROWS):
-        for k, t in gsc_tables:
-            if k != kind:
-                continue
-            preview = t.get("table") or {}
-            headers = preview.get("headers") or []
-            rows = _table_rows_as_dicts(preview)
-            dim_i = _find_col(headers, dim_needles)
-            ci = _find_col(headers, ["clicks"])
-            ii = _find_col(headers, ["impressions"])
-            ctri = _find_col(headers, ["ctr"])
-            posi = _find_col(headers, ["position", "avg position"])
-            if dim_i is None or ci is None:
-                continue
-            dim_key = str(headers[dim_i])
-            click_key = str(headers[ci])
-            impr_key = str(headers[ii]) if ii is not None else None
-            ctr_key = str(headers[ctri]) if ctri is not None else None
-            pos_key = str(headers[posi]) if posi is not None else None
-
-            # sort by clicks
-            def _click_val(r):
-                v = _safe_float(r.get(click_key))
-                return v if v is not None else -1.0
-            rows_sorted = sorted(rows, key=_click_val, reverse=True)
-            for r in rows_sorted[:n]:
-                item = str(r.get(dim_key) or "").strip()
-                if not item:
-                    continue
-                clicks = _safe_float(r.get(click_key))
-                imps = _safe_float(r.get(impr_key)) if impr_key else None
-                ctr = _safe_float(r.get(ctr_key)) if ctr_key else None
-                pos = _safe_float(r.get(pos_key)) if pos_key else None
-                target_list.append({
-                    "item": item,
-                    "clicks": int(clicks) if clicks is not None else "",
-                    "impressions": int(imps) if imps is not None else "",
-                    "ctr": f"{ctr:.2%}" if isinstance(ctr, float) and ctr <= 1.0 else (f"{ctr:.2f}" if ctr is not None else ""),
-                    "position": round(pos, 2) if pos is not None else "",
-                    "evidence_ref": f"{t.get('filename')} / {t.get('sheet')} (top rows)",
-                    "confidence": "High" if clicks is not None else "Medium",
-                })
-            break
+    def _col(ct: "_ColumnarTable", j: Optional[int]) -> Any:
+        # float64 column; all-NaN when the column is missing
+        return ct.num(j) if j is not None else np.full(ct.n_rows, np.nan)
+
+    def _click_rank(clicks: Any) -> Any:
+        # blank clicks rank last
+        return np.where(np.isnan(clicks), -1.0, clicks)
 
-    top_n("queries", ["query", "queries", "top queries", "top query"], data_signals["top_queries"], n=MAX_LIST_ROWS)
-    top_n("pages", ["page", "pages", "top pages", "url"], data_signals["top_pages"], n=MAX_LIST_ROWS)
+    def _top_entry(t: Dict[str, Any], item: str, clicks: Any, imps: Any, ctr: Any, pos: Any) -> Dict[str, Any]:
+        clicks, imps, ctr, pos = _nan_none(clicks), _nan_none(imps), _nan_none(ctr), _nan_none(pos)
+        return {
+            "item": item,
+            "clicks": int(clicks) if clicks is not None else "",
+            "impressions": int(imps) if imps is not None else "",
+            "ctr": f"{ctr:.2%}" if isinstance(ctr, float) and ctr <= 1.0 else (f"{ctr:.2f}" if ctr is not None else ""),
+            "position": round(pos, 2) if pos is not None else "",
+            "evidence_ref": f"{t.get('filename')} / {t.get('sheet')} (top rows)",
+            "confidence": "High" if clicks is not None else "Medium",
+        }
 
-    # opportunities: high impressions, low ctr, pos 8-20
-    def opportunities(kind: str, dim_needles: List[str], out_list: List[Dict[str, Any]], n: int = MAX_LIST_ROWS):
+    def top_n(kind: str, target_list: List[Dict[str, Any]], n: int = MAX_LIST_ROWS):
         for k, t in gsc_tables:
             if k != kind:
                 continue
             preview = t.get("table") or {}
-            headers = preview.get("headers") or []
-            rows = _table_rows_as_dicts(preview)
-            dim_i = _find_col(headers, dim_needles)
-            ci = _find_col(headers, ["clicks"])
-            ii = _find_col(headers, ["impressions"])
-            ctri = _find_col(headers, ["ctr"])
-            posi = _find_col(headers, ["position", "avg position"])
-            if dim_i is None or ii is None or ci is None:
+            ct = _gsc_table(preview, "top_rows")
+            sch = _table_schema(preview)
+            dim_i, ci, ii, ctri, posi = sch["dimension"].get(kind), sch["clicks"], sch["impressions"], sch["ctr"], sch["position"]
+            if dim_i is None or ci is None:
                 continue
-            dim_key = str(headers[dim_i])
-            click_key = str(headers[ci])
-            impr_key = str(headers[ii])
-            ctr_key = str(headers[ctri]) if ctri is not None else None
-            pos_key = str(headers[posi]) if posi is not None else None
-
-            candidates = []
-            for r in rows:
-                item = str(r.get(dim_key) or "").strip()
+            clicks, imps, ctrs, poss = _col(ct, ci), _col(ct, ii), _col(ct, ctri), _col(ct, posi)
+            items = ct.text(dim_i)
+            for r in _top_k_indices(_click_rank(clicks), n):
+                item = items[r].strip()
                 if not item:
                     continue
-                imps = _safe_float(r.get(impr_key))
-                clicks = _safe_float(r.get(click_key))
-                pos = _safe_float(r.get(pos_key)) if pos_key else None
-                ctr = _safe_float(r.get(ctr_key)) if ctr_key else (clicks / imps if (imps and clicks is not None) else None)
-                if imps is None or imps < 200:
-                    continue
-                if pos is not None and (pos < 8 or pos > 20):
-                    continue
-                if ctr is not None and ctr > 0.03:
-                    continue
-                candidates.append((imps, item, clicks, ctr, pos))
-
-            candidates.sort(key=lambda x: x[0], reverse=True)  # impressions desc
-            for imps, item, clicks, ctr, pos in candidates[:n]:
-                out_list.append({
-                    "item": item,
-                    "impressions": int(imps) if imps is not None else "",
-                    "clicks": int(clicks) if clicks is not None else "",
-                    "ctr": f"{ctr:.2%}" if isinstance(ctr, float) and ctr <= 1.0 else "",
-                    "position": round(pos, 2) if pos is not None else "",
-                    "why_it_matters": "High impressions with low CTR and mid SERP position (opportunity).",
-                    "evidence_ref": f"{t.get('filename')} / {t.get('sheet')} (opportunity filter)",
-                    "confidence": "Medium",
-                })
+                target_list.append(_top_entry(t, item, clicks[r], imps[r], ctrs[r], poss[r]))
             break
 
-    opportunities("queries", ["query"], data_signals["opportunity_queries"], n=MAX_LIST_ROWS)
-    opportunities("pages", ["page", "url"], data_signals["opportunity_pages"], n=MAX_LIST_ROWS)
+    top_n("queries", data_signals["top_queries"], n=MAX_LIST_ROWS)
+    top_n("pages", data_signals["top_pages"], n=MAX_LIST_ROWS)
+
+    # opportunities: missed clicks vs the site's own CTR-by-position curve, over every query / page
+    for kind, key in (("queries", "opportunity_queries"), ("pages", "opportunity_pages")):
+        found = _gsc_entity_index(kind, gsc_tables)
+        if found:
+            data_signals[key] = _opportunity_entries(*found, thresholds=opportunity_thresholds)
 
     # breakdowns
-    top_n("countries", ["country"], data_signals["distribution_breakdowns"]["countries"], n=8)
-    top_n("devices", ["device"], data_signals["distribution_breakdowns"]["devices"], n=6)
-    top_n("search_appearance", ["search appearance", "appearance"], data_signals["distribution_breakdowns"]["search_appearance"], n=6)
+    top_n("countries", data_signals["distribution_breakdowns"]["countries"], n=8)
+    top_n("devices", data_signals["distribution_breakdowns"]["devices"], n=6)
+    top_n("search_appearance", data_signals["distribution_breakdowns"]["search_appearance"], n=6)
 
     # trend notes: if chart has date col
     for kind, t in gsc_tables:
         if kind != "chart":
             continue
         preview = t.get("table") or {}
-        headers = preview.get("headers") or []
-        date_i = _find_col(headers, ["date"])
-        ci = _find_col(headers, ["clicks"])
-        ii = _find_col(headers, ["impressions"])
+        sch = _table_schema(preview)
+        date_i, ci = sch["date"], sch["clicks"]
         if date_i is None or ci is None:
             continue
-        rows = _table_rows_as_dicts(preview)
-        date_key = str(headers[date_i])
-        click_key = str(headers[ci])
-        # note best day by clicks
-        best = None
-        for r in rows:
-            d = str(r.get(date_key) or "").strip()
-            c = _safe_float(r.get(click_key))
-            if d and c is not None:
-                if best is None or c > best[1]:
-                    best = (d, c)
+        agg = preview.get("gsc_aggregate")
+        scope = "export"
+        if isinstance(agg, Mapping) and "best_day" in agg:
+            best = tuple(agg["best_day"]) if agg.get("best_day") else None
+        else:
+            scope = "export preview"
+            ct = _gsc_table(preview)
+            dates = [s.strip() for s in ct.text(date_i)]
+            clicks = ct.num(ci)
+            # note best day by clicks (first one wins ties)
+            best = None
+            valid = np.array([bool(d) for d in dates], dtype=bool) & ~np.isnan(clicks)
+            if valid.any():
+                r = int(np.flatnonzero(valid)[np.argmax(clicks[valid])])
+                best = (dates[r], float(clicks[r]))
         if best:
             data_signals["trend_notes"].append({
-                "note": f"Highest-click day in the export preview: {best[0]} ({int(best[1])} clicks).",
+                "note": f"Highest-click day in the {scope}: {best[0]} ({int(best[1])} clicks).",
                 "evidence_ref": f"{t.get('filename')} / {t.get('sheet')}",
                 "confidence": "Medium",
             })
@@ -2308,41 +5320,26 @@ def _build_data_signals(supporting_context: Dict[str, Any]) -> Dict[str, Any]:
                 continue
             preview = t.get("table") or {}
             headers = preview.get("headers") or []
-            rows = _table_rows_as_dicts(preview)
-            if not headers or not rows:
+            ct = _gsc_table(preview, "top_rows")
+            if not headers or not ct.n_rows:
                 continue
 
-            metric_needles = ["click", "impression", "ctr", "position", "avg position"]
-            dim_i = None
-            for i, h in enumerate(headers):
-                hn = str(h).lower()
-                if any(m in hn for m in metric_needles):
-                    continue
-                dim_i = i
-                break
-
-            ci = _find_col(headers, ["click"])
-            ii = _find_col(headers, ["impression"])
-            ctri = _find_col(headers, ["ctr"])
-            posi = _find_col(headers, ["position"])
+            # first non-metric column as the dimension ("click" / "clicks" resolve alike)
+            sch = _table_schema(preview)
+            dim_i, ci, ii = sch["label"], sch["clicks"], sch["impressions"]
 
             if dim_i is None or ci is None or ii is None:
                 continue
 
-            scored = []
-            for r in rows:
-                clicks = _safe_float(r.get(headers[ci]))
-                imps = _safe_float(r.get(headers[ii]))
-                if clicks is None and imps is None:
-                    continue
-                scored.append((clicks or 0.0, r))
-            scored.sort(key=lambda x: x[0], reverse=True)
+            clicks, imps = np.nan_to_num(ct.num(ci), nan=0.0), np.nan_to_num(ct.num(ii), nan=0.0)
+            scored = ~(np.isnan(ct.num(ci)) & np.isnan(ct.num(ii)))
+            items = ct.text(dim_i)
 
-            for _, r in scored[:n]:
+            for r in _top_k_indices(clicks, n, mask=scored):
                 out_list.append({
-                    "item": str(r.get(headers[dim_i], "")).strip(),
-                    "clicks": int(_safe_float(r.get(headers[ci])) or 0),
-                    "impressions": int(_safe_float(r.get(headers[ii])) or 0),
+                    "item": items[r].strip(),
+                    "clicks": int(clicks[r]),
+                    "impressions": int(imps[r]),
                     "ctr": "",
                     "position": "",
                     "evidence_ref": f"{t.get('filename')} / {t.get('sheet')}",
@@ -2360,90 +5357,43 @@ def _build_data_signals(supporting_context: Dict[str, Any]) -> Dict[str, Any]:
                 continue
             preview = t.get("table") or {}
             headers = preview.get("headers") or []
-            rows = _table_rows_as_dicts(preview)
-            if not headers or not rows:
+            ct = _gsc_table(preview, "top_rows")
+            if not headers or not ct.n_rows:
                 continue
-            dim_i = _find_col(headers, ["top pages", "pages", "page", "url"])
-            ci = _find_col(headers, ["clicks"])
-            ii = _find_col(headers, ["impressions"])
-            ctri = _find_col(headers, ["ctr"])
-            posi = _find_col(headers, ["position", "avg position"])
+            sch = _table_schema(preview)
+            dim_i, ci, ii, ctri, posi = sch["dimension"]["pages"], sch["clicks"], sch["impressions"], sch["ctr"], sch["position"]
             if dim_i is None or ci is None:
                 continue
-            dim_key = str(headers[dim_i])
-            click_key = str(headers[ci])
-            impr_key = str(headers[ii]) if ii is not None else None
-            ctr_key = str(headers[ctri]) if ctri is not None else None
-            pos_key = str(headers[posi]) if posi is not None else None
-
-            def _click_val(r):
-                v = _safe_float(r.get(click_key))
-                return v if v is not None else -1.0
-
-            rows_sorted = sorted(rows, key=_click_val, reverse=True)
-            for r in rows_sorted[:MAX_LIST_ROWS]:
-                item = str(r.get(dim_key) or "").strip()
-                if not item:
+            clicks, imps, ctrs, poss = _col(ct, ci), _col(ct, ii), _col(ct, ctri), _col(ct, posi)
+            items = [s.strip() for s in ct.text(dim_i)]
+            rank = _click_rank(clicks)
+            for r in _top_k_indices(rank, MAX_LIST_ROWS):
+                if not items[r]:
                     continue
-                clicks = _safe_float(r.get(click_key))
-                imps = _safe_float(r.get(impr_key)) if impr_key else None
-                ctr = _safe_float(r.get(ctr_key)) if ctr_key else None
-                pos = _safe_float(r.get(pos_key)) if pos_key else None
-                data_signals["top_pages"].append({
-                    "item": item,
-                    "clicks": int(clicks) if clicks is not None else "",
-                    "impressions": int(imps) if imps is not None else "",
-                    "ctr": f"{ctr:.2%}" if isinstance(ctr, float) and ctr <= 1.0 else (f"{ctr:.2f}" if ctr is not None else ""),
-                    "position": round(pos, 2) if pos is not None else "",
-                    "evidence_ref": f"{t.get('filename')} / {t.get('sheet')} (top rows)",
-                    "confidence": "High" if clicks is not None else "Medium",
-                })
-
-            # Also derive opportunity pages from the same Pages table if missing
-            if not data_signals.get("opportunity_pages"):
-                try:
-                    for r in rows_sorted:
-                        item = str(r.get(dim_key) or "").strip()
-                        if not item:
-                            continue
-                        imps = _safe_float(r.get(impr_key)) if impr_key else None
-                        clicks = _safe_float(r.get(click_key))
-                        ctr = _safe_float(r.get(ctr_key)) if ctr_key else None
-                        pos = _safe_float(r.get(pos_key)) if pos_key else None
-
-                        # Opportunity heuristic: impressions present, low ctr, mid SERP position
-                        if imps is None or clicks is None or pos is None:
-                            continue
-                        if imps < 100:
-                            continue
-                        # ctr can be 0-1 or 0-100 depending on source; normalize
-                        ctr_norm = ctr
-                        if isinstance(ctr_norm, float) and ctr_norm > 1.0:
-                            ctr_norm = ctr_norm / 100.0
-                        if ctr_norm is None:
-                            continue
-                        if ctr_norm > 0.03:
-                            continue
-                        if pos < 8 or pos > 20:
-                            continue
-
-                        data_signals["opportunity_pages"].append({
-                            "item": item,
-                            "impressions": int(imps),
-                            "clicks": int(clicks),
-                            "ctr": f"{ctr_norm:.2%}",
-                            "position": round(pos, 2),
-                            "why_it_matters": "High impressions with low CTR and mid SERP position (opportunity).",
-                            "evidence_ref": f"{t.get('filename')} / {t.get('sheet')} (opportunity filter)",
-                            "confidence": "Medium",
-                        })
-                        if len(data_signals["opportunity_pages"]) >= MAX_LIST_ROWS:
-                            break
-                except Exception:
-                    pass
+                data_signals["top_pages"].append(_top_entry(t, items[r], clicks[r], imps[r], ctrs[r], poss[r]))
+
+            # Also derive opportunity pages from the same Pages table if missing: only from the
+            # full-table index; the top rows are a click-sorted sample that would skew the CTR curve
+            agg = preview.get("gsc_aggregate")
+            index = agg.get("entities") if isinstance(agg, Mapping) else None
+            if not data_signals.get("opportunity_pages") and _is_entity_index(index) and getattr(index, "kind", "") == "pages":
+                data_signals["opportunity_pages"] = _opportunity_entries(index, f"{t.get('filename')} / {t.get('sheet')}", thresholds=opportunity_thresholds)
             break
+
+    # Month-over-month movers: current vs previous period, joined on normalized query / page keys
+    for kind, gain_key, loss_key in (
+        ("queries", "mom_query_gainers", "mom_query_losers"),
+        ("pages", "mom_page_gainers", "mom_page_losers"),
+    ):
+        cur = _gsc_entity_index(kind, gsc_tables)
+        prev = _gsc_entity_index(kind, prev_tables)
+        if cur and prev:
+            data_signals[gain_key], data_signals[loss_key] = _gsc_mom_changes(cur, prev)
+
     # Record source selection so UI can group by reporting document
     data_signals["_gsc_source"] = best_gsc_file
+    if previous_context:
+        data_signals["_mom_source"] = prev_gsc_file or (prev_tables[0][1].get("filename") if prev_tables else None)
 
     # Supplemental KPIs from non-GSC documents (e.g., DashThis PDF exports)
     supplemental: Dict[str, List[Dict[str, Any]]] = {}
@@ -2484,7 +5434,7 @@ Return strict JSON with keys:
 - confidence (Low|Medium|High)
 """.strip()
 
-def _summarize_screenshot(client: OpenAI, model: str, filename: str, img_bytes: bytes, mime: str) -> Dict[str, Any]:
+def _summarize_screenshot(client: "OpenAI", model: str, filename: str, img_bytes: bytes, mime: str) -> Dict[str, Any]:
     """Summarize a screenshot into report-ready, non-diagnostic performance notes."""
     try:
         content = [
@@ -3032,15 +5982,20 @@ def _build_insight_notes(supporting_context: Any, data_signals: Dict[str, Any],
     if not (data_signals.get("kpis") or data_signals.get("top_pages") or data_signals.get("top_queries")):
         notes.append("No strong performance signals detected from uploads. If available, add GSC/GA4 exports (queries/pages) for better data-driven insights.")
 
+    # Previous-period comparison
+    if "_mom_source" in data_signals:
+        if not any(data_signals.get(k) for k in ("mom_query_gainers", "mom_query_losers", "mom_page_gainers", "mom_page_losers")):
+            notes.append("A previous-period upload was provided but no GSC queries/pages table could be matched against this month's export.")
+
     # Interpretive links density
     if (work_context.get("completed") or work_context.get("in_progress") or work_context.get("planned")) and not (data_signals.get("top_pages") or data_signals.get("top_queries")):
         notes.append("Work-to-results linking is limited without page/query performance exports.")
 
     return notes
 
-def build_insight_model(client: OpenAI, model: str, omni_notes: str, supporting_context: Dict[str, Any], image_triplets: List[Tuple[str, bytes, str]]) -> Dict[str, Any]:
+def build_insight_model(client: "OpenAI", model: str, omni_notes: str, supporting_context: Dict[str, Any], image_triplets: List[Tuple[str, bytes, str]], previous_context: Optional[Dict[str, Any]] = None, opportunity_thresholds: Optional[Mapping] = None) -> Dict[str, Any]:
     # Layer A
-    data_signals = _build_data_signals(supporting_context)
+    data_signals = _build_data_signals(supporting_context, previous_context, opportunity_thresholds)
 
     # Screenshots summarization (Layer B input)
     screen_summaries = []
@@ -3085,6 +6040,473 @@ def _insight_signature(omni_notes: str, uploaded_files: List[Any]) -> str:
     return str(abs(hash(s)))
 
 
+# ------------------------------
+# Client signal history
+# ------------------------------
+# Each analysis appends its data_signals to a local SQLite store keyed by client
+# and report month, so next month's trend context is a range query instead of a
+# re-upload (and re-parse) of old exports. Re-running a month replaces its rows.
+HISTORY_ENABLED = True
+HISTORY_DB_PATH = os.path.join(os.getcwd(), ".history", "signals.sqlite3")
+HISTORY_WINDOWS = (3, 6, 12)  # months before the report month summarized for the insight model
+HISTORY_TOP_ENTITIES = 10  # recurring top queries / pages listed per window
+HISTORY_SCHEMA_VERSION = 2  # PRAGMA user_version; older stores get their rollups rebuilt on open
+HISTORY_AVERAGED_METRICS = ("rate", "ctr", "position", "average", "avg", "per ")  # rolled up as means, not sums
+
+_MONTH_NUMBERS = {name.lower(): i for i, name in enumerate(
+    ("January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"), 1)}
+_MONTH_NUMBERS.update({name[:3]: i for name, i in list(_MONTH_NUMBERS.items())})
+_MONTH_NUMBERS["sept"] = 9
+# full month names and their common abbreviations only ("Marketing 2026" is not March)
+_MONTH_NAME_RE = re.compile(r"\b(" + "|".join(sorted(_MONTH_NUMBERS, key=len, reverse=True)) + r")\b\.?,?\s+(\d{4})\b", re.I)
+_MONTH_ISO_RE = re.compile(r"\b(\d{4})[-/.](\d{1,2})\b")
+_MONTH_US_RE = re.compile(r"\b(\d{1,2})[-/.](\d{4})\b")
+
+
+def _month_key(label: str) -> Optional[str]:
+    """"March 2026" / "Mar. 2026" / "2026-03" / "03/2026" -> "2026-03"; None without a month and year."""
+    s = (label or "").strip()
+    m = _MONTH_NAME_RE.search(s)
+    if m:
+        return f"{int(m.group(2)):04d}-{_MONTH_NUMBERS[m.group(1).lower()]:02d}"
+    m = _MONTH_ISO_RE.search(s)
+    if m and 1 <= int(m.group(2)) <= 12:
+        return f"{int(m.group(1)):04d}-{int(m.group(2)):02d}"
+    m = _MONTH_US_RE.search(s)
+    if m and 1 <= int(m.group(1)) <= 12:
+        return f"{int(m.group(2)):04d}-{int(m.group(1)):02d}"
+    return None
+
+
+def _month_shift(month: str, delta: int) -> str:
+    """"2026-03" shifted by `delta` months ("2026-03", -3 -> "2025-12")."""
+    y, m = (int(p) for p in month.split("-"))
+    n = y * 12 + (m - 1) + delta
+    return f"{n // 12:04d}-{n % 12 + 1:02d}"
+
+
+def _rollup_periods(month: str) -> Tuple[str, str]:
+    """(quarter, year-to-date) rollup periods a month belongs to: "2026-02" -> ("2026-Q1", "2026-YTD")."""
+    y, m = month.split("-")
+    return f"{y}-Q{(int(m) - 1) // 3 + 1}", f"{y}-YTD"
+
+
+def _period_months(period: str) -> Tuple[str, str]:
+    """First and last month of a rollup period: "2026-Q1" -> ("2026-01", "2026-03"), "2026-YTD" -> ("2026-01", "2026-12")."""
+    y, p = period.split("-")
+    if p.startswith("Q"):
+        q = int(p[1:])
+        return f"{y}-{3 * q - 2:02d}", f"{y}-{3 * q:02d}"
+    return f"{y}-01", f"{y}-12"
+
+
+def _client_key(client_name: str, website: str) -> str:
+    """History key: the website host (scheme / "www." dropped) when given, else the casefolded client name."""
+    host = _gsc_entity_key("pages", website or "").split("/", 1)[0]
+    return host or " ".join((client_name or "").split()).casefold()
+
+
+def _format_metric(value: Optional[float], unit: str) -> str:
+    """Render a coerced metric (see _coerce_metric) for the insight model; "" for None."""
+    if value is None:
+        return ""
+    if unit == "percent":
+        return f"{value:.2%}"
+    if unit == "currency" or abs(value) < 100:
+        return f"{value:,.2f}"
+    return f"{value:,.0f}"
+
+
+class _SignalHistory:
+    """SQLite store of per-client monthly data_signals.
+
+    `snapshots` keeps each month's full data_signals JSON; `kpis` (one numeric row per
+    KPI) and `entities` (ranked top queries / pages) are the narrow tables range
+    queries read through their (client, month, ...) primary keys.
+
+    `kpi_rollups` / `entity_rollups` hold running quarter and year-to-date totals,
+    cumulative through each stored month of the period (`through_month`), so the
+    rollup for a report month never includes later months. append() takes a
+    re-run month's old rows out of every running total from that month on and
+    adds the new ones in the same transaction, so a rollup is always a lookup
+    (see rollup()).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS snapshots (
+            client TEXT NOT NULL, month TEXT NOT NULL, month_label TEXT, client_name TEXT, website TEXT,
+            data_signals TEXT NOT NULL, updated_at REAL NOT NULL,
+            PRIMARY KEY (client, month)
+        );
+        CREATE TABLE IF NOT EXISTS kpis (
+            client TEXT NOT NULL, month TEXT NOT NULL, metric TEXT NOT NULL, value REAL, value_text TEXT,
+            unit TEXT, source TEXT,
+            PRIMARY KEY (client, month, metric)
+        );
+        CREATE TABLE IF NOT EXISTS entities (
+            client TEXT NOT NULL, month TEXT NOT NULL, kind TEXT NOT NULL, rank INTEGER NOT NULL,
+            item TEXT NOT NULL, item_key TEXT NOT NULL, clicks REAL, impressions REAL, ctr REAL, position REAL,
+            PRIMARY KEY (client, month, kind, rank)
+        );
+        CREATE INDEX IF NOT EXISTS entities_by_key ON entities (client, kind, item_key, month);
+        CREATE TABLE IF NOT EXISTS kpi_rollups (
+            client TEXT NOT NULL, period TEXT NOT NULL, through_month TEXT NOT NULL, metric TEXT NOT NULL,
+            total REAL NOT NULL, months INTEGER NOT NULL, unit TEXT,
+            PRIMARY KEY (client, period, through_month, metric)
+        );
+        CREATE TABLE IF NOT EXISTS entity_rollups (
+            client TEXT NOT NULL, period TEXT NOT NULL, through_month TEXT NOT NULL, kind TEXT NOT NULL,
+            item_key TEXT NOT NULL, item TEXT NOT NULL, clicks REAL NOT NULL, impressions REAL NOT NULL,
+            position_sum REAL NOT NULL, position_weight REAL NOT NULL, months INTEGER NOT NULL,
+            PRIMARY KEY (client, period, through_month, kind, item_key)
+        );
+        CREATE TABLE IF NOT EXISTS client_settings (
+            client TEXT PRIMARY KEY, settings TEXT NOT NULL, updated_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _connect(self) -> "sqlite3.Connection":
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        con = sqlite3.connect(self.path, timeout=30)
+        con.executescript(self.SCHEMA)
+        if con.execute("PRAGMA user_version").fetchone()[0] < HISTORY_SCHEMA_VERSION:
+            with con:
+                # rollup tables are derived data: recreate them in the current layout
+                con.execute("DROP TABLE IF EXISTS kpi_rollups")
+                con.execute("DROP TABLE IF EXISTS entity_rollups")
+            con.executescript(self.SCHEMA)
+            with con:
+                self._rebuild_rollups(con)
+                con.execute(f"PRAGMA user_version = {int(HISTORY_SCHEMA_VERSION)}")
+        return con
+
+    def _seed(self, con: "sqlite3.Connection", client: str, month: str) -> None:
+        """Start a newly stored month's running totals from the stored month before it in each period."""
+        for period in _rollup_periods(month):
+            start, _ = _period_months(period)
+            prev = con.execute(
+                "SELECT MAX(month) FROM snapshots WHERE client = ? AND month >= ? AND month < ?", (client, start, month)
+            ).fetchone()[0]
+            if prev is None:
+                continue
+            con.execute(
+                """INSERT INTO kpi_rollups (client, period, through_month, metric, total, months, unit)
+                   SELECT client, period, ?, metric, total, months, unit FROM kpi_rollups
+                   WHERE client = ? AND period = ? AND through_month = ?""",
+                (month, client, period, prev),
+            )
+            con.execute(
+                """INSERT INTO entity_rollups (client, period, through_month, kind, item_key, item, clicks, impressions, position_sum, position_weight, months)
+                   SELECT client, period, ?, kind, item_key, item, clicks, impressions, position_sum, position_weight, months FROM entity_rollups
+                   WHERE client = ? AND period = ? AND through_month = ?""",
+                (month, client, period, prev),
+            )
+
+    def _roll(self, con: "sqlite3.Connection", client: str, month: str, sign: int, upto: Optional[str] = None) -> None:
+        """Add (sign=1) or take out (sign=-1) one stored month's rows in the quarter / YTD running
+        totals through that month and every later stored month of the period (up to `upto`)."""
+        for period in _rollup_periods(month):
+            _, end = _period_months(period)
+            last = min(end, upto) if upto else end
+            for (through,) in con.execute(
+                "SELECT month FROM snapshots WHERE client = ? AND month BETWEEN ? AND ?", (client, month, last)
+            ).fetchall():
+                con.execute(
+                    """INSERT INTO kpi_rollups (client, period, through_month, metric, total, months, unit)
+                       SELECT client, ?, ?, metric, ? * value, ?, unit FROM kpis
+                       WHERE client = ? AND month = ? AND value IS NOT NULL
+                       ON CONFLICT (client, period, through_month, metric) DO UPDATE SET
+                           total = total + excluded.total, months = months + excluded.months, unit = excluded.unit""",
+                    (period, through, sign, sign, client, month),
+                )
+                # position is impression-weighted (unit weight when impressions are unknown)
+                con.execute(
+                    """INSERT INTO entity_rollups (client, period, through_month, kind, item_key, item, clicks, impressions, position_sum, position_weight, months)
+                       SELECT client, ?, ?, kind, item_key, item, ? * COALESCE(clicks, 0), ? * COALESCE(impressions, 0),
+                              ? * COALESCE(position * COALESCE(NULLIF(impressions, 0), 1), 0),
+                              ? * (CASE WHEN position IS NULL THEN 0 ELSE COALESCE(NULLIF(impressions, 0), 1) END), ?
+                       FROM entities WHERE client = ? AND month = ?
+                       ON CONFLICT (client, period, through_month, kind, item_key) DO UPDATE SET
+                           item = excluded.item, clicks = clicks + excluded.clicks, impressions = impressions + excluded.impressions,
+                           position_sum = position_sum + excluded.position_sum,
+                           position_weight = position_weight + excluded.position_weight, months = months + excluded.months""",
+                    (period, through, sign, sign, sign, sign, sign, client, month),
+                )
+        if sign < 0:
+            con.execute("DELETE FROM kpi_rollups WHERE client = ? AND months <= 0", (client,))
+            con.execute("DELETE FROM entity_rollups WHERE client = ? AND months <= 0", (client,))
+
+    def _rebuild_rollups(self, con: "sqlite3.Connection") -> None:
+        """Recompute every rollup from the monthly rows (stores written before rollups existed)."""
+        con.execute("DELETE FROM kpi_rollups")
+        con.execute("DELETE FROM entity_rollups")
+        for client, month in con.execute("SELECT client, month FROM snapshots ORDER BY client, month").fetchall():
+            self._seed(con, client, month)
+            self._roll(con, client, month, 1, upto=month)
+
+    def append(self, client: str, month: str, data_signals: Dict[str, Any], month_label: str = "", client_name: str = "", website: str = "") -> None:
+        """Store one month of data_signals for `client`, replacing that month if it was stored before."""
+        kpi_rows = []
+        sources = [("gsc", data_signals.get("kpis") or [])]
+        sources += list((data_signals.get("supplemental_kpis_by_source") or {}).items())
+        for source, kpis in sources:
+            for k in kpis:
+                metric = str((k or {}).get("metric") or "").strip()
+                if not metric:
+                    continue
+                value, unit = _coerce_metric(k.get("value"))
+                kpi_rows.append((client, month, metric, value, str(k.get("value") or "").strip(), unit, source))
+        entity_rows = []
+        for kind, dim, items in (("query", "queries", data_signals.get("top_queries")), ("page", "pages", data_signals.get("top_pages"))):
+            for rank, e in enumerate(items or []):
+                item = str((e or {}).get("item") or "").strip()
+                if not item:
+                    continue
+                entity_rows.append((
+                    client, month, kind, rank, item, _gsc_entity_key(dim, item),
+                    _safe_float(e.get("clicks")), _safe_float(e.get("impressions")),
+                    _safe_float(e.get("ctr")), _safe_float(e.get("position")),
+                ))
+        snapshot = json.dumps(data_signals, ensure_ascii=False, default=_json_default)
+        with self._lock, contextlib.closing(self._connect()) as con, con:
+            rerun = con.execute("SELECT 1 FROM snapshots WHERE client = ? AND month = ?", (client, month)).fetchone() is not None
+            if rerun:
+                self._roll(con, client, month, -1)
+            for table in ("snapshots", "kpis", "entities"):
+                con.execute(f"DELETE FROM {table} WHERE client = ? AND month = ?", (client, month))
+            con.execute(
+                "INSERT INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (client, month, month_label, client_name, website, snapshot, time.time()),
+            )
+            # first source wins when a metric name repeats
+            con.executemany("INSERT OR IGNORE INTO kpis VALUES (?, ?, ?, ?, ?, ?, ?)", kpi_rows)
+            con.executemany("INSERT INTO entities VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", entity_rows)
+            if not rerun:
+                self._seed(con, client, month)
+            self._roll(con, client, month, 1)
+
+    def settings(self, client: str) -> Dict[str, Any]:
+        """Per-client settings (e.g. {"opportunity_thresholds": {...}}); {} when none were saved."""
+        with contextlib.closing(self._connect()) as con:
+            row = con.execute("SELECT settings FROM client_settings WHERE client = ?", (client,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def save_settings(self, client: str, settings: Dict[str, Any]) -> None:
+        with self._lock, contextlib.closing(self._connect()) as con, con:
+            con.execute(
+                "INSERT OR REPLACE INTO client_settings VALUES (?, ?, ?)",
+                (client, json.dumps(settings, ensure_ascii=False), time.time()),
+            )
+
+    def months(self, client: str, start: str, end: str) -> List[str]:
+        """Stored months for `client` in [start, end], oldest first."""
+        with contextlib.closing(self._connect()) as con:
+            rows = con.execute(
+                "SELECT month FROM snapshots WHERE client = ? AND month BETWEEN ? AND ? ORDER BY month",
+                (client, start, end),
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def kpi_series(self, client: str, start: str, end: str) -> List[Dict[str, Any]]:
+        """KPI rows for `client` in [start, end] months, oldest first."""
+        with contextlib.closing(self._connect()) as con:
+            rows = con.execute(
+                "SELECT month, metric, value, value_text, unit FROM kpis WHERE client = ? AND month BETWEEN ? AND ? ORDER BY month, rowid",
+                (client, start, end),
+            ).fetchall()
+        return [{"month": m, "metric": k, "value": v, "value_text": t, "unit": u} for m, k, v, t, u in rows]
+
+    def top_entities(self, client: str, kind: str, start: str, end: str, n: int = HISTORY_TOP_ENTITIES) -> List[Dict[str, Any]]:
+        """Queries / pages ("query" / "page") most often in the monthly top lists over [start, end], by total clicks."""
+        with contextlib.closing(self._connect()) as con:
+            rows = con.execute(
+                """SELECT MAX(item), COUNT(*), SUM(clicks), SUM(impressions), AVG(position)
+                   FROM entities WHERE client = ? AND kind = ? AND month BETWEEN ? AND ?
+                   GROUP BY item_key ORDER BY COUNT(*) DESC, SUM(clicks) DESC LIMIT ?""",
+                (client, kind, start, end, int(n)),
+            ).fetchall()
+        return [
+            {
+                "item": item,
+                "months_in_top": int(count),
+                "clicks": int(clicks) if clicks is not None else "",
+                "impressions": int(imps) if imps is not None else "",
+                "avg_position": round(pos, 2) if pos is not None else "",
+            }
+            for item, count, clicks, imps, pos in rows
+        ]
+
+    def rollup(self, client: str, period: str, month: Optional[str] = None, n: int = HISTORY_TOP_ENTITIES) -> Optional[Dict[str, Any]]:
+        """Quarter ("2026-Q1") or year-to-date ("2026-YTD") rollup for `client` through `month`
+        (default: the whole period); None when no month of it up to `month` is stored.
+
+        KPIs are summed across months, except rates / averages (percent units or
+        HISTORY_AVERAGED_METRICS names), which are monthly means; GSC CTR is
+        re-derived from the rolled-up clicks and impressions. Top queries / pages
+        rank the monthly top lists' entities by rolled-up clicks.
+        """
+        start, end = _period_months(period)
+        months = self.months(client, start, min(end, month) if month else end)
+        if not months:
+            return None
+        through = months[-1]
+        with contextlib.closing(self._connect()) as con:
+            kpi_rows = con.execute(
+                """SELECT metric, total, months, unit FROM kpi_rollups WHERE client = ? AND period = ? AND through_month = ?
+                   ORDER BY metric LIKE 'GSC %' DESC, months DESC, metric""",
+                (client, period, through),
+            ).fetchall()
+            tops = {
+                kind: con.execute(
+                    """SELECT item, clicks, impressions, position_sum, position_weight, months FROM entity_rollups
+                       WHERE client = ? AND period = ? AND through_month = ? AND kind = ?
+                       ORDER BY clicks DESC, impressions DESC LIMIT ?""",
+                    (client, period, through, kind, int(n)),
+                ).fetchall()
+                for kind in ("query", "page")
+            }
+        totals = {metric: total for metric, total, _, _ in kpi_rows}
+        kpis = []
+        for metric, total, count, unit in kpi_rows:
+            averaged = unit == "percent" or any(w in metric.lower() for w in HISTORY_AVERAGED_METRICS)
+            value = total / count if averaged else total
+            aggregation = "monthly average" if averaged else "total"
+            if metric == "GSC CTR (derived)" and totals.get("GSC Impressions"):
+                value, aggregation = totals.get("GSC Clicks", 0.0) / totals["GSC Impressions"], "clicks / impressions"
+            kpis.append({
+                "metric": metric,
+                "value": _format_metric(value, unit or ""),
+                "aggregation": aggregation,
+                "months": int(count),
+            })
+
+        def _entity(item: str, clicks: float, imps: float, pos_sum: float, pos_w: float, count: int) -> Dict[str, Any]:
+            return {
+                "item": item,
+                "clicks": int(round(clicks)),
+                "impressions": int(round(imps)),
+                "avg_position": round(pos_sum / pos_w, 2) if pos_w > 0 else "",
+                "months_in_top": int(count),
+            }
+
+        return {
+            "period": period,
+            "months": months,
+            "kpis": kpis,
+            "top_queries": [_entity(*r) for r in tops["query"]],
+            "top_pages": [_entity(*r) for r in tops["page"]],
+        }
+
+    def context(self, client: str, month: str, windows: Tuple[int, ...] = HISTORY_WINDOWS) -> Dict[str, Any]:
+        """Trend context for the report month: KPI series plus per-window averages and recurring top entities.
+
+        Windows cover the N months before `month`; the report month itself is only
+        compared against each window's average. "rollups" adds the quarter and
+        year-to-date rollups the month belongs to, through the month itself.
+        """
+        longest = max(windows) if windows else 0
+        series = self.kpi_series(client, _month_shift(month, -longest), month)
+        by_metric: Dict[str, List[Dict[str, Any]]] = {}
+        for r in series:
+            by_metric.setdefault(r["metric"], []).append(r)
+        out: Dict[str, Any] = {
+            "client": client,
+            "month": month,
+            "months_stored": self.months(client, _month_shift(month, -longest), month),
+            "kpi_series": {
+                metric: [{"month": r["month"], "value": r["value_text"]} for r in rows]
+                for metric, rows in by_metric.items()
+                if len(rows) > 1 or rows[0]["month"] != month
+            },
+            "windows": {},
+        }
+        for n in windows:
+            start, end = _month_shift(month, -n), _month_shift(month, -1)
+            prior = self.months(client, start, end)
+            if not prior:
+                continue
+            kpis = {}
+            for metric, rows in by_metric.items():
+                vals = [r["value"] for r in rows if start <= r["month"] <= end and r["value"] is not None]
+                if not vals:
+                    continue
+                avg = sum(vals) / len(vals)
+                cur = next((r for r in rows if r["month"] == month and r["value"] is not None), None)
+                entry = {"average": _format_metric(avg, rows[-1]["unit"]), "months": len(vals)}
+                if cur is not None:
+                    entry["current"] = cur["value_text"]
+                    entry["current_vs_average"] = (
+                        f"{(cur['value'] - avg) * 100:+.2f} pp" if cur["unit"] == "percent"
+                        else (f"{(cur['value'] - avg) / avg:+.1%}" if avg else "")
+                    )
+                kpis[metric] = entry
+            out["windows"][f"last_{n}_months"] = {
+                "months": prior,
+                "kpis": kpis,
+                "top_queries": self.top_entities(client, "query", start, end),
+                "top_pages": self.top_entities(client, "page", start, end),
+            }
+        quarter, ytd = _rollup_periods(month)
+        out["rollups"] = {"quarter": self.rollup(client, quarter, month), "year_to_date": self.rollup(client, ytd, month)}
+        return out
+
+
+@st.cache_resource(show_spinner=False)
+def _get_signal_history() -> _SignalHistory:
+    """One history store handle per server process."""
+    return _SignalHistory(HISTORY_DB_PATH)
+
+
+def _client_settings(client_name: str, website: str) -> Dict[str, Any]:
+    """Saved settings for the client ({} when history is off, the client can't be keyed or the store fails)."""
+    client = _client_key(client_name, website)
+    if not HISTORY_ENABLED or not client:
+        return {}
+    try:
+        return _get_signal_history().settings(client)
+    except Exception:
+        return {}
+
+
+def _save_client_settings(client_name: str, website: str, settings: Dict[str, Any]) -> None:
+    """Merge `settings` into the client's saved settings (best effort, like the history itself)."""
+    client = _client_key(client_name, website)
+    if not HISTORY_ENABLED or not client:
+        return
+    try:
+        store = _get_signal_history()
+        store.save_settings(client, {**store.settings(client), **settings})
+    except Exception:
+        return
+
+
+def record_signal_history(insight: Dict[str, Any], client_name: str, website: str, month_label: str) -> Optional[Dict[str, Any]]:
+    """Append the analysis' data_signals to the client history and attach trend context as insight["history"].
+
+    Skipped (None) when history is disabled or the client or month can't be keyed.
+    A store failure is reported in insight["notes"]; analysis never fails on history.
+    """
+    client, month = _client_key(client_name, website), _month_key(month_label)
+    if not HISTORY_ENABLED or not client or not month:
+        return None
+    try:
+        store = _get_signal_history()
+        store.append(client, month, insight.get("data_signals") or {}, month_label=month_label, client_name=client_name, website=website)
+        history = store.context(client, month)
+    except Exception as e:
+        insight.setdefault("notes", []).append(f"Client history not updated ({HISTORY_DB_PATH}): {e}")
+        return None
+    insight["history"] = history
+    prior = [m for m in history.get("months_stored") or [] if m != month]
+    if prior:
+        insight.setdefault("notes", []).append(f"Client history: {len(prior)} earlier month(s) on file ({prior[0]} to {prior[-1]}) for trend context.")
+    return history
+
+
 def _sanitize_columns(columns: List[Any]) -> List[str]:
     """Make columns non-empty and unique for Streamlit data_editor."""
     cols: List[str] = []
@@ -3128,7 +6550,7 @@ def _normalize_table_preview(preview: Any) -> Tuple[List[Dict[str, Any]], List[s
     headers: List[str] = []
     rows: Any = preview
 
-    if isinstance(preview, dict):
+    if isinstance(preview, Mapping):
         headers = preview.get("headers") or preview.get("columns") or []
         headers = _sanitize_columns(headers)
         rows = preview.get("rows") or preview.get("data") or preview.get("table") or []
@@ -3207,7 +6629,7 @@ def _k(base_key: str) -> str:
         n = 0
     return f"{base_key}__{n}"
 
-def gpt_generate_email(client: OpenAI, model: str, payload: dict, image_triplets: List[Tuple[str, bytes, str]]) -> Tuple[dict, str]:
+def gpt_generate_email(client: "OpenAI", model: str, payload: dict, image_triplets: List[Tuple[str, bytes, str]]) -> Tuple[dict, str]:
     # Keep the same section structure across modes. The ONLY thing that changes by verbosity
     # is how much context is included within the same sections.
     v = (payload.get("verbosity_level") or "Quick scan").strip().lower()
@@ -3330,7 +6752,8 @@ Content rules:
 - Omni notes are the PRIMARY source of truth for what work happened, what is in progress, what is blocked, and what is planned.
 - INSIGHT_MODEL is the PRIMARY source for performance numbers (Layer A), SEO observations (Layer B), and cautious work↔results context (Layer D).
 - Supporting_context is SECONDARY and should only be used to clarify or corroborate items already present in the Insight Model.
-- Do NOT invent metrics, results, or causality. Only include numbers that appear in INSIGHT_MODEL.data_signals or are directly visible in attached screenshots/PDF text.
+- Do NOT invent metrics, results, or causality. Only include numbers that appear in INSIGHT_MODEL.data_signals, INSIGHT_MODEL.history (this client's earlier months) or are directly visible in attached screenshots/PDF text.
+- Use INSIGHT_MODEL.history only for brief trend context (e.g., versus the 3-month average); this month's numbers still come from data_signals.
 - Put KPI numbers in the Main KPIs section whenever possible. Avoid repeating the same numbers across multiple sections.
 - Use evidence in Key Highlights or Wins & Progress only when it is truly noteworthy (material movement, clear page/query mover, or evidence that directly supports the work narrative).
 - If evidence suggests a relationship between work and results, use cautious language (e.g., "early signal", "may be contributing", "directional lift") unless explicitly stated in Omni notes.
@@ -3467,19 +6890,30 @@ Output requirements:
     data = _safe_json_load(raw)
     return (data if isinstance(data, dict) else {"_parse_failed": True, "_error": "No JSON"}), raw
 
+# Command-line tools (not part of the Streamlit app)
+CLI_COMMANDS = {
+    "benchmark-ocr": _benchmark_ocr_cli,
+    "check-xlsx-previews": _check_xlsx_previews_cli,
+}
+if __name__ == "__main__" and sys.argv[1:2] and sys.argv[1] in CLI_COMMANDS:
+    sys.exit(CLI_COMMANDS[sys.argv[1]](sys.argv[2:]))
+
 # ---------- UI ----------
 # Centered, single-column layout so users can scroll straight down to the draft.
 
 
-def generate_monthly_email_draft(client: OpenAI, model: str, payload: dict, image_triplets: List[Tuple[str, bytes, str]]) -> Tuple[dict, str]:
+def generate_monthly_email_draft(client: "OpenAI", model: str, payload: dict, image_triplets: List[Tuple[str, bytes, str]]) -> Tuple[dict, str]:
     """Backward-compatible wrapper expected by the UI.
 
     Returns (email_json, raw_model_output).
     """
     return gpt_generate_email(client=client, model=model, payload=payload, image_triplets=image_triplets)
 
-st.set_page_config(page_title=APP_TITLE, layout="centered")
-st.markdown("""
+if __name__ == "__main__":  # pool workers import this script as __mp_main__ and skip the UI
+    from openai import OpenAI
+
+    st.set_page_config(page_title=APP_TITLE, layout="centered")
+    st.markdown("""
 <style>
   /* Align with quarterly tool: compact headers, consistent spacing */
   .block-container { padding-top: 1.2rem; padding-bottom: 2.2rem; }
@@ -3545,916 +6979,1021 @@ div[data-testid="stExpander"] > details > div[role="region"] {
 }
 </style>
 """, unsafe_allow_html=True)
-def _render_masthead():
-    """Render Metamend masthead (logo + tagline) at top of app."""
-    try:
-        logo_path = (Path(__file__).parent / "logo.png")
-        if logo_path.exists():
-            b64_logo = base64.b64encode(logo_path.read_bytes()).decode("utf-8")
-            st.markdown(
-                f"""
+    def _render_masthead():
+        """Render Metamend masthead (logo + tagline) at top of app."""
+        try:
+            logo_path = (Path(__file__).parent / "logo.png")
+            if logo_path.exists():
+                b64_logo = base64.b64encode(logo_path.read_bytes()).decode("utf-8")
+                st.markdown(
+                    f"""
                 <div class="mm-masthead">
                   <img src="data:image/png;base64,{b64_logo}" alt="Metamend logo" />
                   <div class="mm-masthead-tagline">AI Insight. Human Oversight.</div>
                 </div>
                 """,
-                unsafe_allow_html=True,
-            )
+                    unsafe_allow_html=True,
+                )
+            else:
+                # Fallback: tagline only (keeps layout stable)
+                st.markdown(
+                    '<div class="mm-masthead"><div class="mm-masthead-tagline">AI Insight. Human Oversight.</div></div>',
+                    unsafe_allow_html=True,
+                )
+        except Exception:
+            # Never block the app if branding fails
+            pass
+
+    _render_masthead()
+
+
+    st.markdown(f'<h1 style="font-size:1.75rem; margin:0 0 0.75rem 0;">{APP_TITLE}</h1>', unsafe_allow_html=True)
+    st.caption("This tool combines structured evidence, SEO reasoning, and controlled narrative generation - Builds a monthly SEO update email in Outlook-ready .eml format/optional PDF export.")
+
+    api_key = get_api_key()
+    if not api_key:
+        st.error("Missing OPENAI_API_KEY. Add it to Streamlit secrets or set OPENAI_API_KEY env var.")
+        st.stop()
+
+    today = datetime.date.today()
+    ss_init("client_name","")
+    ss_init("website","")
+    ss_init("month_label", today.strftime("%B %Y"))
+    ss_init("dashthis_url","")
+    ss_init("signature_choice","None")
+
+    ss_init("recipient_first_name","")
+    ss_init("opening_line_choice","Custom...")
+    ss_init("opening_line","")
+    ss_init("show_opening_suggestions", False)
+
+    ss_init("omni_notes_paste_input","")
+    ss_init("omni_notes_pasted","")
+    ss_init("omni_added", False)
+    ss_init("verbosity_level", "Quick scan")
+    ss_init("model", DEFAULT_MODEL)
+    ss_init("show_raw", False)
+    ss_init("special_instructions","")
+
+    ss_init("uploaded_files", [])
+    ss_init("previous_files", [])
+    ss_init("raw","")
+    ss_init("email_json", {})
+    ss_init("image_assignments", {})
+    ss_init("image_captions", {})
+
+    ss_init("analysis_done", False)
+    ss_init("analysis_signature", "")
+    ss_init("insight_original", {})
+    ss_init("insight_current", {})
+    ss_init("insight_locked", {})
+    ss_init("insight_locked_enabled", False)
+    ss_init("insight_editor_cache", {})  # per-section JSON/text cache for reliable undo
+    ss_init("editor_nonce", 0)  # increments to hard-reset all editors on Undo/Analyze
+
+
+    with st.expander("Inputs", expanded=True):
+        st.subheader("Details")
+        st.session_state.client_name = st.text_input("Company Name", value=st.session_state.client_name)
+        st.session_state.website = st.text_input("Website", value=st.session_state.website, placeholder="https://...")
+        st.session_state.month_label = st.text_input("Month (ex: December 2025)", value=st.session_state.month_label, placeholder="March 2026")
+        if HISTORY_ENABLED:
+            st.caption(f"Each analysis saves this client's data signals for the month and any non-default opportunity thresholds to a local history file on this server ({HISTORY_DB_PATH}) for trend context.")
+        st.session_state.dashthis_url = st.text_input("DashThis report URL", value=st.session_state.dashthis_url)
+
+        # Opportunity thresholds (optional) — saved per client, reloaded when the client changes
+        opp_client = _client_key(st.session_state.client_name, st.session_state.website)
+        if st.session_state.get("opportunity_client") != opp_client:
+            saved = _client_settings(st.session_state.client_name, st.session_state.website).get("opportunity_thresholds")
+            for name, value in _opportunity_thresholds(saved).items():
+                st.session_state[f"opp_{name}"] = value
+            st.session_state.opportunity_client = opp_client
+        with st.popover("Opportunity thresholds", use_container_width=False):
+            st.number_input("Min impressions", min_value=0.0, step=50.0, key="opp_min_impressions")
+            st.number_input("Best position", min_value=0.0, step=1.0, key="opp_min_position")
+            st.number_input("Worst position", min_value=0.0, step=1.0, key="opp_max_position")
+            st.number_input("Min missed clicks", min_value=0.0, step=1.0, key="opp_min_missed_clicks")
+            st.caption("Opportunities rank queries/pages by clicks missed versus this site's own CTR at each position. Saved for this client with the next analysis.")
+
+        # Email signature (optional) — appended to bottom of the email
+        st.session_state.signature_choice = st.selectbox(
+            "Email signature (Optional)",
+            options=SIGNATURE_OPTIONS,
+            index=SIGNATURE_OPTIONS.index(st.session_state.get("signature_choice", "None")) if st.session_state.get("signature_choice", "None") in SIGNATURE_OPTIONS else 0,
+        )
+
+        # Recipient + Opening line (optional)
+        st.session_state.recipient_first_name = st.text_input(
+            "Recipient first name(s)",
+            value=st.session_state.get("recipient_first_name", ""),
+        )
+
+        # Opening line (optional) — set via Suggestions popover (no separate field)
+        # Keep the currently selected suggestion in sync (if the current opening line matches a canned option)
+        cur_ol = (st.session_state.get("opening_line") or "").strip()
+        if cur_ol and cur_ol in CANNED_OPENERS:
+            st.session_state.opening_line_choice = cur_ol
         else:
-            # Fallback: tagline only (keeps layout stable)
-            st.markdown(
-                '<div class="mm-masthead"><div class="mm-masthead-tagline">AI Insight. Human Oversight.</div></div>',
-                unsafe_allow_html=True,
+            st.session_state.opening_line_choice = ""
+
+        st.markdown("**Opening line (Optional)**")
+        with st.popover("Suggestions", use_container_width=False):
+            def _apply_opener_choice():
+                choice = (st.session_state.get("opening_line_choice") or "").strip()
+                if not choice:
+                    return
+                ml = (st.session_state.get("month_label") or "").strip()
+                st.session_state.opening_line = choice.replace("{month_label}", ml if ml else "this month")
+
+            st.selectbox(
+                "Opening line suggestions",
+                options=[""] + CANNED_OPENERS,
+                key="opening_line_choice",
+                format_func=lambda x: "Select a suggestion..." if x == "" else x,
+                on_change=_apply_opener_choice,
             )
-    except Exception:
-        # Never block the app if branding fails
-        pass
 
-_render_masthead()
-
-
-st.markdown(f'<h1 style="font-size:1.75rem; margin:0 0 0.75rem 0;">{APP_TITLE}</h1>', unsafe_allow_html=True)
-st.caption("This tool combines structured evidence, SEO reasoning, and controlled narrative generation - Builds a monthly SEO update email in Outlook-ready .eml format/optional PDF export.")
-
-api_key = get_api_key()
-if not api_key:
-    st.error("Missing OPENAI_API_KEY. Add it to Streamlit secrets or set OPENAI_API_KEY env var.")
-    st.stop()
-
-today = datetime.date.today()
-ss_init("client_name","")
-ss_init("website","")
-ss_init("month_label", today.strftime("%B %Y"))
-ss_init("dashthis_url","")
-ss_init("signature_choice","None")
-
-ss_init("recipient_first_name","")
-ss_init("opening_line_choice","Custom...")
-ss_init("opening_line","")
-ss_init("show_opening_suggestions", False)
-
-ss_init("omni_notes_paste_input","")
-ss_init("omni_notes_pasted","")
-ss_init("omni_added", False)
-ss_init("verbosity_level", "Quick scan")
-ss_init("model", DEFAULT_MODEL)
-ss_init("show_raw", False)
-ss_init("special_instructions","")
-
-ss_init("uploaded_files", [])
-ss_init("raw","")
-ss_init("email_json", {})
-ss_init("image_assignments", {})
-ss_init("image_captions", {})
-
-ss_init("analysis_done", False)
-ss_init("analysis_signature", "")
-ss_init("insight_original", {})
-ss_init("insight_current", {})
-ss_init("insight_locked", {})
-ss_init("insight_locked_enabled", False)
-ss_init("insight_editor_cache", {})  # per-section JSON/text cache for reliable undo
-ss_init("editor_nonce", 0)  # increments to hard-reset all editors on Undo/Analyze
-
-
-with st.expander("Inputs", expanded=True):
-    st.subheader("Details")
-    st.session_state.client_name = st.text_input("Company Name", value=st.session_state.client_name)
-    st.session_state.website = st.text_input("Website", value=st.session_state.website, placeholder="https://...")
-    st.session_state.month_label = st.text_input("Month (ex: December 2025)", value=st.session_state.month_label, placeholder="March 2026")
-    st.session_state.dashthis_url = st.text_input("DashThis report URL", value=st.session_state.dashthis_url)
-
-    # Email signature (optional) — appended to bottom of the email
-    st.session_state.signature_choice = st.selectbox(
-        "Email signature (Optional)",
-        options=SIGNATURE_OPTIONS,
-        index=SIGNATURE_OPTIONS.index(st.session_state.get("signature_choice", "None")) if st.session_state.get("signature_choice", "None") in SIGNATURE_OPTIONS else 0,
-    )
+            st.text_area(
+                "Opening line (custom)",
+                key="opening_line",
+                placeholder="e.g., Hope you're doing well — please see your monthly SEO status update below.",
+                height=90,
+            )
 
-    # Recipient + Opening line (optional)
-    st.session_state.recipient_first_name = st.text_input(
-        "Recipient first name(s)",
-        value=st.session_state.get("recipient_first_name", ""),
-    )
+            st.caption("Pick a canned opener to fill the line, or type your own. Your latest text is what will be used.")
+
+        uploaded = st.file_uploader(
+            "Upload screenshots / supporting docs (optional)",
+            type=["png","jpg","jpeg","pdf","docx","txt","xlsx","csv"],
+            accept_multiple_files=True
+        ) or []
+        st.session_state.uploaded_files = uploaded
+
+        previous = st.file_uploader(
+            "Previous period GSC export (optional, for month-over-month changes)",
+            type=["xlsx","csv"],
+            accept_multiple_files=True,
+            key="previous_period_uploader",
+        ) or []
+        st.session_state.previous_files = previous
+
+        st.markdown("**Paste Omni notes from Client Dashboard.**")
+        omni_cols = st.columns([6, 2, 2])
+        with omni_cols[0]:
+            st.text_area(
+                "omni_notes_paste_input_label",
+                placeholder="Paste Omni notes here...",
+                key="omni_notes_paste_input",
+                height=220,
+                label_visibility="collapsed",
+            )
+            # Auto-sync multi-line Omni notes into the value used for analysis
+            st.session_state.omni_notes_pasted = (st.session_state.get("omni_notes_paste_input") or "").strip()
+            st.session_state.omni_added = bool(st.session_state.omni_notes_pasted)
 
-    # Opening line (optional) — set via Suggestions popover (no separate field)
-    # Keep the currently selected suggestion in sync (if the current opening line matches a canned option)
-    cur_ol = (st.session_state.get("opening_line") or "").strip()
-    if cur_ol and cur_ol in CANNED_OPENERS:
-        st.session_state.opening_line_choice = cur_ol
-    else:
-        st.session_state.opening_line_choice = ""
-
-    st.markdown("**Opening line (Optional)**")
-    with st.popover("Suggestions", use_container_width=False):
-        def _apply_opener_choice():
-            choice = (st.session_state.get("opening_line_choice") or "").strip()
-            if not choice:
-                return
-            ml = (st.session_state.get("month_label") or "").strip()
-            st.session_state.opening_line = choice.replace("{month_label}", ml if ml else "this month")
-
-        st.selectbox(
-            "Opening line suggestions",
-            options=[""] + CANNED_OPENERS,
-            key="opening_line_choice",
-            format_func=lambda x: "Select a suggestion..." if x == "" else x,
-            on_change=_apply_opener_choice,
-        )
 
-        st.text_area(
-            "Opening line (custom)",
-            key="opening_line",
-            placeholder="e.g., Hope you're doing well — please see your monthly SEO status update below.",
-            height=90,
-        )
+        def _omni_add():
+            txt = (st.session_state.get("omni_notes_paste_input") or "").strip()
+            if txt:
+                st.session_state.omni_notes_pasted = txt
+                st.session_state.omni_added = True
+
+        def _omni_clear():
+            st.session_state.omni_notes_pasted = ""
+            st.session_state.omni_added = False
+            st.session_state["omni_notes_paste_input"] = ""
+
+        with omni_cols[1]:
+            st.button("Add", on_click=_omni_add, type="secondary", use_container_width=True)
+        with omni_cols[2]:
+            st.button("Clear", on_click=_omni_clear, type="secondary", use_container_width=True)
+
+        if (st.session_state.omni_notes_pasted or "").strip():
+            st.success("Omni work summary notes were detected and will be used for the report.")
+
 
-        st.caption("Pick a canned opener to fill the line, or type your own. Your latest text is what will be used.")
-
-    uploaded = st.file_uploader(
-        "Upload screenshots / supporting docs (optional)",
-        type=["png","jpg","jpeg","pdf","docx","txt","xlsx","csv"],
-        accept_multiple_files=True
-    ) or []
-    st.session_state.uploaded_files = uploaded
-
-    st.markdown("**Paste Omni notes from Client Dashboard.**")
-    omni_cols = st.columns([6, 2, 2])
-    with omni_cols[0]:
-        st.text_area(
-            "omni_notes_paste_input_label",
-            placeholder="Paste Omni notes here...",
-            key="omni_notes_paste_input",
-            height=220,
-            label_visibility="collapsed",
-        )
-        # Auto-sync multi-line Omni notes into the value used for analysis
-        st.session_state.omni_notes_pasted = (st.session_state.get("omni_notes_paste_input") or "").strip()
-        st.session_state.omni_added = bool(st.session_state.omni_notes_pasted)
-
-
-    def _omni_add():
-        txt = (st.session_state.get("omni_notes_paste_input") or "").strip()
-        if txt:
-            st.session_state.omni_notes_pasted = txt
-            st.session_state.omni_added = True
-
-    def _omni_clear():
-        st.session_state.omni_notes_pasted = ""
-        st.session_state.omni_added = False
-        st.session_state["omni_notes_paste_input"] = ""
-
-    with omni_cols[1]:
-        st.button("Add", on_click=_omni_add, type="secondary", use_container_width=True)
-    with omni_cols[2]:
-        st.button("Clear", on_click=_omni_clear, type="secondary", use_container_width=True)
-
-    if (st.session_state.omni_notes_pasted or "").strip():
-        st.success("Omni work summary notes were detected and will be used for the report.")
-
-
-
-# Omni notes required (same as V1)
-can_analyze = bool((st.session_state.omni_notes_pasted or "").strip())
-
-# If inputs changed since last analysis, invalidate analysis + locks + draft
-current_sig = _insight_signature(st.session_state.get("omni_notes_pasted",""), st.session_state.get("uploaded_files") or [])
-if st.session_state.get("analysis_signature") and st.session_state.analysis_signature != current_sig:
-    st.session_state.analysis_done = False
-    st.session_state.insight_original = {}
-    st.session_state.insight_current = {}
-    st.session_state.insight_locked = {}
-    st.session_state.insight_locked_enabled = False
-    st.session_state.email_json = {}
-    st.session_state.raw = ""
-    st.session_state.analysis_signature = current_sig
-
-# Analyze button
-if not st.session_state.analysis_done:
-    if st.button("Analyze Data", type="primary", disabled=not can_analyze, use_container_width=True):
-        client = OpenAI(api_key=api_key)
-
-        # Collect screenshots
-        image_triplets: List[Tuple[str, bytes, str]] = []
-        for f in (st.session_state.uploaded_files or []):
-            fn = f.name
-            low = fn.lower()
-            if low.endswith((".png", ".jpg", ".jpeg")):
-                b = f.getvalue()
-                mime = "image/png" if low.endswith(".png") else "image/jpeg"
-                image_triplets.append((fn, b, mime))
-
-        with st.spinner("Analyzing and extracting campaign data..."):
-            supporting_context = build_supporting_context(st.session_state.uploaded_files or [])
-            insight = build_insight_model(
-                client=client,
-                model=st.session_state.model,
-                omni_notes=st.session_state.omni_notes_pasted.strip(),
-                supporting_context=supporting_context,
-                image_triplets=image_triplets,
-            )
 
-        st.session_state.supporting_context = supporting_context
-        st.session_state.insight_original = _json_deepcopy(insight)
-        st.session_state.insight_current = _json_deepcopy(insight)
+    # Omni notes required (same as V1)
+    can_analyze = bool((st.session_state.omni_notes_pasted or "").strip())
+
+    # If inputs changed since last analysis, invalidate analysis + locks + draft
+    current_sig = _insight_signature(st.session_state.get("omni_notes_pasted",""), (st.session_state.get("uploaded_files") or []) + (st.session_state.get("previous_files") or []))
+    if st.session_state.get("analysis_signature") and st.session_state.analysis_signature != current_sig:
+        st.session_state.analysis_done = False
+        st.session_state.insight_original = {}
+        st.session_state.insight_current = {}
         st.session_state.insight_locked = {}
         st.session_state.insight_locked_enabled = False
-        st.session_state.analysis_done = True
-        st.session_state.analysis_signature = current_sig
-
-        # Clear draft so user must re-generate with new evidence
         st.session_state.email_json = {}
         st.session_state.raw = ""
-        st.session_state.editor_nonce = int(st.session_state.get("editor_nonce", 0)) + 1
-        _reset_editor_keys("v2_")
-        st.rerun()
-
-else:
-    st.success("Evidence extracted and ready for review.")
-
-    st.divider()
-    st.markdown("## Campaign Data")
-    with st.expander("Campaign Data", expanded=True):
-
-        # Undo
-        st.session_state.insight_locked_enabled = False  # Locking removed for usability
-        top_controls = st.columns([1, 3])
-        with top_controls[0]:
-            if st.button("Undo edits", type="secondary", use_container_width=True):
-                st.session_state.insight_current = _json_deepcopy(st.session_state.insight_original or {})
-                st.session_state.insight_locked = {}
-                st.session_state.insight_locked_enabled = False
-                st.session_state.editor_nonce = int(st.session_state.get("editor_nonce", 0)) + 1
-                _reset_editor_keys("v2_")
-                st.rerun()
-
-        insight_obj = st.session_state.insight_current or {}
-        ds = (insight_obj.get("data_signals") or {})
-        wc = (insight_obj.get("work_context") or {})
-        screenshot_summaries = insight_obj.get("screenshot_summaries") or []
-
-        tabs = st.tabs(["Digital Signals", "Omni notes", "Advanced / Debug"])
-
-        # ---------------- Digital Signals ----------------
-        with tabs[0]:
-            st.caption("Edit extracted campaign data if needed prior to report generation.")
-
-            sc = st.session_state.get("supporting_context") or {}
-            by_file = sc.get("_by_file") or {}
-            gsc_file = ds.get("_gsc_source")
-
-            def _coerce_number(x):
-                try:
-                    if x is None:
-                        return None
-                    s = str(x).strip().replace(",", "")
-                    if s.endswith("%"):
-                        return float(s[:-1]) / 100.0
-                    return float(s)
-                except Exception:
-                    return None
-
-            def _derive_kpis_from_tables(tables, max_rows=12):
-                # Build a simple KPI list from "label/value" style rows in any detected table.
-                # This is intentionally conservative: it extracts numbers but does NOT interpret them.
-                out = []
-                seen = set()
-                if not isinstance(tables, list):
-                    return out
-                for t in tables:
-                    preview = (t or {}).get("table") or (t or {}).get("rows") or []
-                    rows_norm, cols = _normalize_table_preview(preview)
-                    if not rows_norm or len(cols or []) < 2:
-                        continue
-                    c0, c1 = cols[0], cols[1]
-                    for r in rows_norm[:200]:
-                        label = str((r or {}).get(c0) or "").strip()
-                        val = (r or {}).get(c1)
-                        if not label or len(label) > 60:
-                            continue
-                        num = _coerce_number(val)
-                        if num is None:
-                            continue
-                        key = label.lower()
-                        if key in seen:
-                            continue
-                        seen.add(key)
-                        out.append({
-                            "metric": label,
-                            "value": str(val).strip(),
-                            "period": "",
-                            "delta": "",
-                            "evidence_ref": str((t or {}).get("filename") or "") + (f" / {(t or {}).get('sheet')}" if (t or {}).get("sheet") else ""),
-                            "confidence": "Medium",
-                        })
-                        if len(out) >= max_rows:
-                            return out
-                return out
-
-            def _render_kpi_mini_table(kpis, key_prefix):
-                kpi_cols = ["metric","value","period","delta","evidence_ref","confidence"]
-                df_k = _df_from_list(kpis or [], kpi_cols)
-                df_k = st.data_editor(
-                    df_k,
-                    key=_k(f"{key_prefix}__kpis"),
-                    use_container_width=True,
-                    num_rows="dynamic",
-                    disabled=st.session_state.insight_locked_enabled,
+        st.session_state.analysis_signature = current_sig
+
+    # Analyze button
+    if not st.session_state.analysis_done:
+        if st.button("Analyze Data", type="primary", disabled=not can_analyze, use_container_width=True):
+            client = OpenAI(api_key=api_key)
+
+            # Collect screenshots
+            image_triplets: List[Tuple[str, bytes, str]] = []
+            for f in (st.session_state.uploaded_files or []):
+                fn = f.name
+                low = fn.lower()
+                if low.endswith((".png", ".jpg", ".jpeg")):
+                    b = f.getvalue()
+                    mime = "image/png" if low.endswith(".png") else "image/jpeg"
+                    image_triplets.append((fn, b, mime))
+
+            with st.spinner("Analyzing and extracting campaign data..."):
+                supporting_context = build_supporting_context(st.session_state.uploaded_files or [])
+                previous_context = build_supporting_context(st.session_state.previous_files) if st.session_state.get("previous_files") else None
+                # only overrides are saved, so a client follows later changes to the defaults
+                opportunity_thresholds = {
+                    name: value
+                    for name, value in _opportunity_thresholds({n: st.session_state.get(f"opp_{n}") for n in OPPORTUNITY_THRESHOLDS}).items()
+                    if value != OPPORTUNITY_THRESHOLDS[name]
+                }
+                _save_client_settings(st.session_state.client_name, st.session_state.website, {"opportunity_thresholds": opportunity_thresholds})
+                insight = build_insight_model(
+                    client=client,
+                    model=st.session_state.model,
+                    omni_notes=st.session_state.omni_notes_pasted.strip(),
+                    supporting_context=supporting_context,
+                    image_triplets=image_triplets,
+                    previous_context=previous_context,
+                    opportunity_thresholds=opportunity_thresholds,
                 )
-                return _df_to_list(df_k)[:MAX_LIST_ROWS]
-
-            # ---- GSC Performance Export
-            if gsc_file:
-                with st.expander(f"GSC Performance Export — {gsc_file}", expanded=False):
-                    st.markdown("#### KPI mini table")
-                    ds["kpis"] = _render_kpi_mini_table(ds.get("kpis") or [], "v2_gsc")
-
-                    with st.expander("Details (tables)", expanded=False):
-                        st.markdown("#### Top queries (≤ 50)")
-                        tq_cols = ["item","clicks","impressions","ctr","position","evidence_ref"]
-                        df_tq = _df_from_list(ds.get("top_queries") or [], tq_cols).head(MAX_LIST_ROWS)
-                        df_tq = st.data_editor(
-                            df_tq,
-                            key=_k("v2_gsc_top_queries"),
-                            use_container_width=True,
-                            num_rows="dynamic",
-                            disabled=st.session_state.insight_locked_enabled,
-                        )
-                        ds["top_queries"] = _df_to_list(df_tq)[:MAX_LIST_ROWS]
-
-                        st.divider()
-                        st.markdown("#### Top pages (≤ 50)")
-                        tp_cols = ["item","clicks","impressions","ctr","position","evidence_ref"]
-                        df_tp = _df_from_list(ds.get("top_pages") or [], tp_cols).head(MAX_LIST_ROWS)
-                        df_tp = st.data_editor(
-                            df_tp,
-                            key=_k("v2_gsc_top_pages"),
-                            use_container_width=True,
-                            num_rows="dynamic",
-                            disabled=st.session_state.insight_locked_enabled,
-                        )
-                        ds["top_pages"] = _df_to_list(df_tp)[:MAX_LIST_ROWS]
-
-            # ---- Other uploaded documents (PDFs, CSV/XLSX tables, etc.)
-            other_files = [fn for fn in sorted(by_file.keys()) if fn and fn != gsc_file and not str(fn).lower().endswith((".png",".jpg",".jpeg",".webp"))]
-            for fname in other_files:
-                fobj = by_file.get(fname) or {}
-                tables = fobj.get("tables") or []
-                docs = fobj.get("documents") or []
-                with st.expander(f"{fname}", expanded=False):
-
-                    # KPI mini table (auto-derived once; then user-editable)
-                    doc_kpis_map = ds.setdefault("document_kpis", {})
-                    if not isinstance(doc_kpis_map, dict):
-                        doc_kpis_map = {}
-                        ds["document_kpis"] = doc_kpis_map
-
-                    if fname not in doc_kpis_map or not isinstance(doc_kpis_map.get(fname), list) or len(doc_kpis_map.get(fname) or []) == 0:
-                        doc_kpis_map[fname] = _derive_kpis_from_tables(tables, max_rows=12)
-
-                    st.markdown("#### KPI mini table")
-                    doc_kpis_map[fname] = _render_kpi_mini_table(doc_kpis_map.get(fname) or [], f"v2_doc_{_slugify(fname)[:24]}")
-
-                    with st.expander("Details (tables / extracted text)", expanded=False):
-                        if not tables and not docs:
-                            st.caption("No structured tables or document text detected for this file.")
-                        # Tables: show one at a time (best for PDFs with many small tables)
-                        if tables:
-                            labels = []
-                            for i, t in enumerate(tables):
-                                lab = f"Table {i+1}"
-                                if (t.get("sheet") or ""):
-                                    lab = f"{t.get('sheet')}"
-                                labels.append(lab)
-                            sel = st.selectbox(
-                                "Table",
-                                options=list(range(len(tables))),
-                                format_func=lambda i: labels[i] if i < len(labels) else str(i),
-                                key=_k(f"v2_src_table_sel__{fname}"),
-                            )
-                            t = tables[int(sel)]
-                            preview = t.get("table") or []
-                            rows_norm, cols = _normalize_table_preview(preview)
-                            if not rows_norm:
-                                raw = t.get("raw") or t.get("text") or ""
-                                st.caption("No structured rows detected for this table preview.")
-                                if raw:
-                                    st.text_area("Raw extracted text", value=str(raw)[:20000], height=200, key=_k(f"v2_src_raw__{fname}_{sel}"))
-                            else:
-                                df_t = _df_from_list(rows_norm, cols).head(MAX_LIST_ROWS)
-                                df_t = st.data_editor(
-                                    df_t,
-                                    key=_k(f"v2_src_tbl__{fname}_{sel}"),
-                                    use_container_width=True,
-                                    num_rows="dynamic",
-                                    disabled=st.session_state.insight_locked_enabled,
-                                )
-                                ds.setdefault("source_table_edits", {}).setdefault(fname, {})[str(sel)] = _df_to_list(df_t)[:MAX_LIST_ROWS]
-                        # Document text snippet
-                        if docs:
-                            st.divider()
-                            for d in docs[:3]:
-                                st.markdown(f"**Extracted text — {d.get('filename','')}**")
-                                st.text_area("", value=str(d.get("text") or "")[:20000], height=220, key=_k(f"v2_doc_text__{fname}_{d.get('filename','')}"), disabled=True)
+                record_signal_history(insight, st.session_state.client_name, st.session_state.website, st.session_state.month_label)
+
+            st.session_state.supporting_context = supporting_context
+            st.session_state.insight_original = _json_deepcopy(insight)
+            st.session_state.insight_current = _json_deepcopy(insight)
+            st.session_state.insight_locked = {}
+            st.session_state.insight_locked_enabled = False
+            st.session_state.analysis_done = True
+            st.session_state.analysis_signature = current_sig
+
+            # Clear draft so user must re-generate with new evidence
+            st.session_state.email_json = {}
+            st.session_state.raw = ""
+            st.session_state.editor_nonce = int(st.session_state.get("editor_nonce", 0)) + 1
+            _reset_editor_keys("v2_")
+            st.rerun()
+
+    else:
+        st.success("Evidence extracted and ready for review.")
+
+        st.divider()
+        st.markdown("## Campaign Data")
+        with st.expander("Campaign Data", expanded=True):
+
+            # Undo
+            st.session_state.insight_locked_enabled = False  # Locking removed for usability
+            top_controls = st.columns([1, 3])
+            with top_controls[0]:
+                if st.button("Undo edits", type="secondary", use_container_width=True):
+                    st.session_state.insight_current = _json_deepcopy(st.session_state.insight_original or {})
+                    st.session_state.insight_locked = {}
+                    st.session_state.insight_locked_enabled = False
+                    st.session_state.editor_nonce = int(st.session_state.get("editor_nonce", 0)) + 1
+                    _reset_editor_keys("v2_")
+                    st.rerun()
+
+            insight_obj = st.session_state.insight_current or {}
+            ds = (insight_obj.get("data_signals") or {})
+            wc = (insight_obj.get("work_context") or {})
+            screenshot_summaries = insight_obj.get("screenshot_summaries") or []
+
+            tabs = st.tabs(["Digital Signals", "Omni notes", "Advanced / Debug"])
+
+            # ---------------- Digital Signals ----------------
+            with tabs[0]:
+                st.caption("Edit extracted campaign data if needed prior to report generation.")
 
-            # ---- Screenshots (supporting evidence)
-            if screenshot_summaries:
-                with st.expander(f"Screenshots — {len(screenshot_summaries)}", expanded=False):
-                    st.caption("Screenshots are treated as supporting evidence. Edit the extracted summary and optional note for the report.")
+                sc = st.session_state.get("supporting_context") or {}
+                by_file = sc.get("_by_file") or {}
+                gsc_file = ds.get("_gsc_source")
 
-                    # Build a lookup for preview bytes by filename
-                    _img_bytes_by_name = {}
+                def _coerce_number(x):
                     try:
-                        for uf in (st.session_state.uploaded_files or []):
-                            n = getattr(uf, "name", None)
-                            if n and str(n).lower().endswith((".png",".jpg",".jpeg",".webp")):
-                                _img_bytes_by_name[str(n)] = uf.getvalue()
+                        if x is None:
+                            return None
+                        s = str(x).strip().replace(",", "")
+                        if s.endswith("%"):
+                            return float(s[:-1]) / 100.0
+                        return float(s)
                     except Exception:
-                        _img_bytes_by_name = {}
+                        return None
 
-                    for i, item in enumerate(list(screenshot_summaries or [])):
-                        if not isinstance(item, dict):
+                def _derive_kpis_from_tables(tables, max_rows=12):
+                    # Build a simple KPI list from "label/value" style rows in any detected table.
+                    # This is intentionally conservative: it extracts numbers but does NOT interpret them.
+                    out = []
+                    seen = set()
+                    if not isinstance(tables, list):
+                        return out
+                    for t in tables:
+                        preview = (t or {}).get("table") or (t or {}).get("rows") or []
+                        rows_norm, cols = _normalize_table_preview(preview)
+                        if not rows_norm or len(cols or []) < 2:
                             continue
-                        fn = str(item.get("file_name") or f"screenshot_{i+1}")
-
-                        with st.expander(fn, expanded=False):
-                            if fn in _img_bytes_by_name:
-                                st.image(_img_bytes_by_name[fn], caption=fn, use_container_width=True)
-
-                            # Auto-fill summary & report note on first render (user can edit)
-                            default_summary = str(item.get("performance_summary") or "").strip() or _build_screenshot_summary_text(item)
-                            if not (item.get("extracted_summary") or "").strip():
-                                item["extracted_summary"] = default_summary
-
-                            # A short "SEO-consultant friendly" note, still non-diagnostic and non-causal.
-                            if not (item.get("note_for_report") or "").strip():
-                                # Prefer model-provided report_note; fallback to a trimmed performance_summary.
-                                rn = str(item.get("report_note") or "").strip()
-                                if rn:
-                                    item["note_for_report"] = rn
-                                else:
-                                    ps = str(item.get("performance_summary") or item.get("extracted_summary") or "").strip()
-                                    if ps:
-                                        # Keep it short
-                                        item["note_for_report"] = ps.splitlines()[0][:220]
-
-                            st.markdown("**Extracted summary (GPT)**")
-                            item["extracted_summary"] = st.text_area(
-                                "",
-                                value=str(item.get("extracted_summary") or ""),
-                                height=160,
-                                key=_k(f"v2_ss_extracted_summary__{i}"),
-                                disabled=st.session_state.insight_locked_enabled,
-                            )
+                        c0, c1 = cols[0], cols[1]
+                        for r in rows_norm[:200]:
+                            label = str((r or {}).get(c0) or "").strip()
+                            val = (r or {}).get(c1)
+                            if not label or len(label) > 60:
+                                continue
+                            num = _coerce_number(val)
+                            if num is None:
+                                continue
+                            key = label.lower()
+                            if key in seen:
+                                continue
+                            seen.add(key)
+                            out.append({
+                                "metric": label,
+                                "value": str(val).strip(),
+                                "period": "",
+                                "delta": "",
+                                "evidence_ref": str((t or {}).get("filename") or "") + (f" / {(t or {}).get('sheet')}" if (t or {}).get("sheet") else ""),
+                                "confidence": "Medium",
+                            })
+                            if len(out) >= max_rows:
+                                return out
+                    return out
 
-                            st.markdown("**Note for report (optional)**")
-                            item["note_for_report"] = st.text_area(
-                                "",
-                                value=str(item.get("note_for_report") or ""),
-                                height=90,
-                                key=_k(f"v2_ss_note_for_report__{i}"),
+                def _render_kpi_mini_table(kpis, key_prefix):
+                    kpi_cols = ["metric","value","period","delta","evidence_ref","confidence"]
+                    df_k = _df_from_list(kpis or [], kpi_cols)
+                    df_k = st.data_editor(
+                        df_k,
+                        key=_k(f"{key_prefix}__kpis"),
+                        use_container_width=True,
+                        num_rows="dynamic",
+                        disabled=st.session_state.insight_locked_enabled,
+                    )
+                    return _df_to_list(df_k)[:MAX_LIST_ROWS]
+
+                # ---- GSC Performance Export
+                if gsc_file:
+                    with st.expander(f"GSC Performance Export — {gsc_file}", expanded=False):
+                        st.markdown("#### KPI mini table")
+                        ds["kpis"] = _render_kpi_mini_table(ds.get("kpis") or [], "v2_gsc")
+
+                        with st.expander("Details (tables)", expanded=False):
+                            st.markdown("#### Top queries (≤ 50)")
+                            tq_cols = ["item","clicks","impressions","ctr","position","evidence_ref"]
+                            df_tq = _df_from_list(ds.get("top_queries") or [], tq_cols).head(MAX_LIST_ROWS)
+                            df_tq = st.data_editor(
+                                df_tq,
+                                key=_k("v2_gsc_top_queries"),
+                                use_container_width=True,
+                                num_rows="dynamic",
                                 disabled=st.session_state.insight_locked_enabled,
                             )
+                            ds["top_queries"] = _df_to_list(df_tq)[:MAX_LIST_ROWS]
 
-                            c = str(item.get("confidence") or "Low")
-                            conf = st.selectbox(
-                                "Confidence",
-                                options=["High","Medium","Low"],
-                                index=["High","Medium","Low"].index(c) if c in ["High","Medium","Low"] else 2,
-                                key=_k(f"v2_ss_conf__{i}"),
+                            st.divider()
+                            st.markdown("#### Top pages (≤ 50)")
+                            tp_cols = ["item","clicks","impressions","ctr","position","evidence_ref"]
+                            df_tp = _df_from_list(ds.get("top_pages") or [], tp_cols).head(MAX_LIST_ROWS)
+                            df_tp = st.data_editor(
+                                df_tp,
+                                key=_k("v2_gsc_top_pages"),
+                                use_container_width=True,
+                                num_rows="dynamic",
                                 disabled=st.session_state.insight_locked_enabled,
                             )
-                            item["confidence"] = conf
-                            screenshot_summaries[i] = item
-
-        # ---------------- Omni notes ----------------
-        with tabs[1]:
-            st.caption("Omni work notes are the core narrative for the report. Review and edit the parsed work summary below if needed.")
-            st.markdown("### Parsed work summary")
-            wc_cols = ["item","type","targets","assignee","details","evidence_ref","confidence"]
-            for label, key in [("Completed","completed"),("In progress","in_progress"),("Planned","planned")]:
-                st.markdown(f"#### {label}")
-                df_w = _df_from_list(wc.get(key) or [], wc_cols)
-                df_w = st.data_editor(
-                    df_w,
-                    key=_k(f"v2_wc_{key}"),
+                            ds["top_pages"] = _df_to_list(df_tp)[:MAX_LIST_ROWS]
+
+                        if ds.get("_mom_source"):
+                            with st.expander(f"Month over month — vs {ds.get('_mom_source')}", expanded=False):
+                                mom_cols = ["item","status","clicks","clicks_prev","clicks_delta","impressions","impressions_prev","impressions_delta","ctr","ctr_prev","ctr_delta","position","position_prev","position_delta","evidence_ref"]
+                                for mom_key, mom_title in (
+                                    ("mom_query_gainers", "Query gainers"),
+                                    ("mom_query_losers", "Query losers"),
+                                    ("mom_page_gainers", "Page gainers"),
+                                    ("mom_page_losers", "Page losers"),
+                                ):
+                                    st.markdown(f"#### {mom_title} (≤ {MOM_LIST_ROWS})")
+                                    df_mom = _df_from_list(ds.get(mom_key) or [], mom_cols).head(MOM_LIST_ROWS)
+                                    df_mom = st.data_editor(
+                                        df_mom,
+                                        key=_k(f"v2_gsc_{mom_key}"),
+                                        use_container_width=True,
+                                        num_rows="dynamic",
+                                        disabled=st.session_state.insight_locked_enabled,
+                                    )
+                                    ds[mom_key] = _df_to_list(df_mom)[:MOM_LIST_ROWS]
+
+                # ---- Client history (earlier months from the local history store)
+                history = insight_obj.get("history") or {}
+                if history.get("kpi_series") or any((history.get("rollups") or {}).values()):
+                    with st.expander(f"Client history — {len(history.get('months_stored') or [])} month(s) on file", expanded=False):
+                        trend_rows = {}
+                        for metric, points in (history.get("kpi_series") or {}).items():
+                            for p in points:
+                                trend_rows.setdefault(p.get("month"), {"month": p.get("month")})[metric] = p.get("value")
+                        st.dataframe(pd.DataFrame(sorted(trend_rows.values(), key=lambda r: r["month"])), use_container_width=True, hide_index=True)
+                        for window, summary in (history.get("windows") or {}).items():
+                            st.markdown(f"#### {window.replace('_', ' ').capitalize()}")
+                            st.dataframe(
+                                pd.DataFrame([{"metric": k, **v} for k, v in (summary.get("kpis") or {}).items()]),
+                                use_container_width=True,
+                                hide_index=True,
+                            )
+                        for rollup in (history.get("rollups") or {}).values():
+                            if not rollup:
+                                continue
+                            months_on_file = rollup.get("months") or []
+                            st.markdown(f"#### {rollup.get('period')} rollup ({months_on_file[0]} to {months_on_file[-1]})")
+                            st.dataframe(pd.DataFrame(rollup.get("kpis") or []), use_container_width=True, hide_index=True)
+                            st.dataframe(pd.DataFrame(rollup.get("top_queries") or []), use_container_width=True, hide_index=True)
+
+                # ---- Other uploaded documents (PDFs, CSV/XLSX tables, etc.)
+                other_files = [fn for fn in sorted(by_file.keys()) if fn and fn != gsc_file and not str(fn).lower().endswith((".png",".jpg",".jpeg",".webp"))]
+                for fname in other_files:
+                    fobj = by_file.get(fname) or {}
+                    tables = fobj.get("tables") or []
+                    docs = fobj.get("documents") or []
+                    with st.expander(f"{fname}", expanded=False):
+
+                        # KPI mini table (auto-derived once; then user-editable)
+                        doc_kpis_map = ds.setdefault("document_kpis", {})
+                        if not isinstance(doc_kpis_map, dict):
+                            doc_kpis_map = {}
+                            ds["document_kpis"] = doc_kpis_map
+
+                        if fname not in doc_kpis_map or not isinstance(doc_kpis_map.get(fname), list) or len(doc_kpis_map.get(fname) or []) == 0:
+                            doc_kpis_map[fname] = _derive_kpis_from_tables(tables, max_rows=12)
+
+                        st.markdown("#### KPI mini table")
+                        doc_kpis_map[fname] = _render_kpi_mini_table(doc_kpis_map.get(fname) or [], f"v2_doc_{_slugify(fname)[:24]}")
+
+                        with st.expander("Details (tables / extracted text)", expanded=False):
+                            if not tables and not docs:
+                                st.caption("No structured tables or document text detected for this file.")
+                            # Tables: show one at a time (best for PDFs with many small tables)
+                            if tables:
+                                labels = []
+                                for i, t in enumerate(tables):
+                                    lab = f"Table {i+1}"
+                                    if (t.get("sheet") or ""):
+                                        lab = f"{t.get('sheet')}"
+                                    labels.append(lab)
+                                sel = st.selectbox(
+                                    "Table",
+                                    options=list(range(len(tables))),
+                                    format_func=lambda i: labels[i] if i < len(labels) else str(i),
+                                    key=_k(f"v2_src_table_sel__{fname}"),
+                                )
+                                t = tables[int(sel)]
+                                preview = t.get("table") or []
+                                rows_norm, cols = _normalize_table_preview(preview)
+                                if not rows_norm:
+                                    raw = t.get("raw") or t.get("text") or ""
+                                    st.caption("No structured rows detected for this table preview.")
+                                    if raw:
+                                        st.text_area("Raw extracted text", value=str(raw)[:20000], height=200, key=_k(f"v2_src_raw__{fname}_{sel}"))
+                                else:
+                                    df_t = _df_from_list(rows_norm, cols).head(MAX_LIST_ROWS)
+                                    df_t = st.data_editor(
+                                        df_t,
+                                        key=_k(f"v2_src_tbl__{fname}_{sel}"),
+                                        use_container_width=True,
+                                        num_rows="dynamic",
+                                        disabled=st.session_state.insight_locked_enabled,
+                                    )
+                                    ds.setdefault("source_table_edits", {}).setdefault(fname, {})[str(sel)] = _df_to_list(df_t)[:MAX_LIST_ROWS]
+                            # Document text snippet
+                            if docs:
+                                st.divider()
+                                for d in docs[:3]:
+                                    st.markdown(f"**Extracted text — {d.get('filename','')}**")
+                                    st.text_area("", value=str(d.get("text") or "")[:20000], height=220, key=_k(f"v2_doc_text__{fname}_{d.get('filename','')}"), disabled=True)
+
+                # ---- Screenshots (supporting evidence)
+                if screenshot_summaries:
+                    with st.expander(f"Screenshots — {len(screenshot_summaries)}", expanded=False):
+                        st.caption("Screenshots are treated as supporting evidence. Edit the extracted summary and optional note for the report.")
+
+                        # Build a lookup for preview bytes by filename
+                        _img_bytes_by_name = {}
+                        try:
+                            for uf in (st.session_state.uploaded_files or []):
+                                n = getattr(uf, "name", None)
+                                if n and str(n).lower().endswith((".png",".jpg",".jpeg",".webp")):
+                                    _img_bytes_by_name[str(n)] = uf.getvalue()
+                        except Exception:
+                            _img_bytes_by_name = {}
+
+                        for i, item in enumerate(list(screenshot_summaries or [])):
+                            if not isinstance(item, dict):
+                                continue
+                            fn = str(item.get("file_name") or f"screenshot_{i+1}")
+
+                            with st.expander(fn, expanded=False):
+                                if fn in _img_bytes_by_name:
+                                    st.image(_img_bytes_by_name[fn], caption=fn, use_container_width=True)
+
+                                # Auto-fill summary & report note on first render (user can edit)
+                                default_summary = str(item.get("performance_summary") or "").strip() or _build_screenshot_summary_text(item)
+                                if not (item.get("extracted_summary") or "").strip():
+                                    item["extracted_summary"] = default_summary
+
+                                # A short "SEO-consultant friendly" note, still non-diagnostic and non-causal.
+                                if not (item.get("note_for_report") or "").strip():
+                                    # Prefer model-provided report_note; fallback to a trimmed performance_summary.
+                                    rn = str(item.get("report_note") or "").strip()
+                                    if rn:
+                                        item["note_for_report"] = rn
+                                    else:
+                                        ps = str(item.get("performance_summary") or item.get("extracted_summary") or "").strip()
+                                        if ps:
+                                            # Keep it short
+                                            item["note_for_report"] = ps.splitlines()[0][:220]
+
+                                st.markdown("**Extracted summary (GPT)**")
+                                item["extracted_summary"] = st.text_area(
+                                    "",
+                                    value=str(item.get("extracted_summary") or ""),
+                                    height=160,
+                                    key=_k(f"v2_ss_extracted_summary__{i}"),
+                                    disabled=st.session_state.insight_locked_enabled,
+                                )
+
+                                st.markdown("**Note for report (optional)**")
+                                item["note_for_report"] = st.text_area(
+                                    "",
+                                    value=str(item.get("note_for_report") or ""),
+                                    height=90,
+                                    key=_k(f"v2_ss_note_for_report__{i}"),
+                                    disabled=st.session_state.insight_locked_enabled,
+                                )
+
+                                c = str(item.get("confidence") or "Low")
+                                conf = st.selectbox(
+                                    "Confidence",
+                                    options=["High","Medium","Low"],
+                                    index=["High","Medium","Low"].index(c) if c in ["High","Medium","Low"] else 2,
+                                    key=_k(f"v2_ss_conf__{i}"),
+                                    disabled=st.session_state.insight_locked_enabled,
+                                )
+                                item["confidence"] = conf
+                                screenshot_summaries[i] = item
+
+            # ---------------- Omni notes ----------------
+            with tabs[1]:
+                st.caption("Omni work notes are the core narrative for the report. Review and edit the parsed work summary below if needed.")
+                st.markdown("### Parsed work summary")
+                wc_cols = ["item","type","targets","assignee","details","evidence_ref","confidence"]
+                for label, key in [("Completed","completed"),("In progress","in_progress"),("Planned","planned")]:
+                    st.markdown(f"#### {label}")
+                    df_w = _df_from_list(wc.get(key) or [], wc_cols)
+                    df_w = st.data_editor(
+                        df_w,
+                        key=_k(f"v2_wc_{key}"),
+                        use_container_width=True,
+                        num_rows="dynamic",
+                        disabled=st.session_state.insight_locked_enabled,
+                    )
+                    wc[key] = _df_to_list(df_w)
+
+                st.divider()
+                b_cols = ["item","type","targets","evidence_ref","confidence"]
+                st.markdown("#### Blockers / constraints")
+                df_b = _df_from_list(wc.get("blockers") or [], b_cols)
+                df_b = st.data_editor(
+                    df_b,
+                    key=_k("v2_wc_blockers"),
                     use_container_width=True,
                     num_rows="dynamic",
                     disabled=st.session_state.insight_locked_enabled,
                 )
-                wc[key] = _df_to_list(df_w)
-
-            st.divider()
-            b_cols = ["item","type","targets","evidence_ref","confidence"]
-            st.markdown("#### Blockers / constraints")
-            df_b = _df_from_list(wc.get("blockers") or [], b_cols)
-            df_b = st.data_editor(
-                df_b,
-                key=_k("v2_wc_blockers"),
-                use_container_width=True,
-                num_rows="dynamic",
-                disabled=st.session_state.insight_locked_enabled,
-            )
-            wc["blockers"] = _df_to_list(df_b)
-
-            st.markdown("#### Themes / context")
-            df_t = _df_from_list(wc.get("themes") or [], b_cols)
-            df_t = st.data_editor(
-                df_t,
-                key=_k("v2_wc_themes"),
-                use_container_width=True,
-                num_rows="dynamic",
-                disabled=st.session_state.insight_locked_enabled,
-            )
-            wc["themes"] = _df_to_list(df_t)
+                wc["blockers"] = _df_to_list(df_b)
 
-        # ---------------- Debug ----------------
-        with tabs[2]:
-            with st.expander("Evidence packet preview (debug)", expanded=False):
-                sc = st.session_state.get("supporting_context") or {}
-                insight_dbg = st.session_state.get("insight_current") or {}
-
-                st.write("Parsed uploads:", sc.get("_extraction_stats", {}))
-                st.write("Insight model keys:", sorted(list(insight_dbg.keys())))
-
-                # --- Evidence packet (what the drafter is grounded on) ---
-                st.markdown("#### Evidence packet (edited insight_payload)")
-                st.download_button(
-                    "Download evidence packet JSON",
-                    data=json.dumps(insight_dbg, indent=2, ensure_ascii=False).encode("utf-8"),
-                    file_name="evidence_packet.json",
-                    mime="application/json",
-                    key=f"dl_evidence_packet_{st.session_state.editor_nonce}",
+                st.markdown("#### Themes / context")
+                df_t = _df_from_list(wc.get("themes") or [], b_cols)
+                df_t = st.data_editor(
+                    df_t,
+                    key=_k("v2_wc_themes"),
+                    use_container_width=True,
+                    num_rows="dynamic",
+                    disabled=st.session_state.insight_locked_enabled,
                 )
-                st.json(insight_dbg)
+                wc["themes"] = _df_to_list(df_t)
+
+            # ---------------- Debug ----------------
+            with tabs[2]:
+                if st.button("Clear extraction cache", type="secondary", key="clear_extraction_cache_btn"):
+                    removed = clear_extraction_cache()
+                    st.caption(f"Extraction cache cleared ({removed} cached file(s) removed). Uploads will be re-parsed on the next analysis.")
+
+                if st.button("Benchmark OCR backends", type="secondary", key="benchmark_ocr_btn"):
+                    pdfs = [f for f in (st.session_state.get("uploaded_files") or []) if (getattr(f, "name", "") or "").lower().endswith(".pdf")]
+                    if not pdfs:
+                        st.caption("Upload a PDF to benchmark OCR backends.")
+                    for f in pdfs:
+                        with st.spinner(f"OCR benchmark: {f.name}"):
+                            st.write(f.name, _benchmark_ocr_backends(f.getvalue()))
+
+                if st.button("Benchmark numeric token parsing", type="secondary", key="benchmark_num_tokens_btn"):
+                    docs = [d for d in ((st.session_state.get("supporting_context") or {}).get("documents") or []) if d.get("type") == "pdf"]
+                    if not docs:
+                        st.caption("Run an analysis with a PDF upload first.")
+                    for d in docs:
+                        st.write(d.get("filename"), _benchmark_num_token_classifier(_tokenize_text_lines(d.get("text") or "")))
+
+                if st.button("Load deferred Excel sheets", type="secondary", key="load_deferred_sheets_btn"):
+                    sc = st.session_state.get("supporting_context") or {}
+                    files = {f.name: f.getvalue() for f in (st.session_state.get("uploaded_files") or []) if getattr(f, "name", "")}
+                    n = _load_deferred_xlsx_sheets(sc, files)
+                    st.caption(f"Loaded {n} deferred sheet(s)." if n else "No deferred sheets to load.")
+
+                with st.expander("Evidence packet preview (debug)", expanded=False):
+                    sc = st.session_state.get("supporting_context") or {}
+                    insight_dbg = st.session_state.get("insight_current") or {}
+
+                    st.write("Parsed uploads:", sc.get("_extraction_stats", {}))
+                    st.write("Insight model keys:", sorted(list(insight_dbg.keys())))
+
+                    # --- Evidence packet (what the drafter is grounded on) ---
+                    st.markdown("#### Evidence packet (edited insight_payload)")
+                    st.download_button(
+                        "Download evidence packet JSON",
+                        data=json.dumps(insight_dbg, indent=2, ensure_ascii=False).encode("utf-8"),
+                        file_name="evidence_packet.json",
+                        mime="application/json",
+                        key=f"dl_evidence_packet_{st.session_state.editor_nonce}",
+                    )
+                    st.json(insight_dbg)
+
+                    # --- Full payload (what gets sent to the drafting phase) ---
+                    full_payload_dbg = {
+                        "client_name": st.session_state.client_name.strip(),
+                        "website": st.session_state.website.strip(),
+                        "month_label": st.session_state.month_label.strip(),
+                        "dashthis_url": st.session_state.dashthis_url.strip(),
+                        "omni_notes": st.session_state.omni_notes_pasted.strip(),
+                        "insight_payload": insight_dbg,
+                        "verbosity_level": st.session_state.get("verbosity_level", "Standard"),
+                    }
+
+                    st.markdown("#### Full JSON payload (drafting input)")
+                    st.download_button(
+                        "Download full payload JSON",
+                        data=json.dumps(full_payload_dbg, indent=2, ensure_ascii=False).encode("utf-8"),
+                        file_name="monthly_report_payload.json",
+                        mime="application/json",
+                        key=f"dl_full_payload_{st.session_state.editor_nonce}",
+                    )
+                    st.json(full_payload_dbg)
 
-                # --- Full payload (what gets sent to the drafting phase) ---
-                full_payload_dbg = {
-                    "client_name": st.session_state.client_name.strip(),
-                    "website": st.session_state.website.strip(),
-                    "month_label": st.session_state.month_label.strip(),
-                    "dashthis_url": st.session_state.dashthis_url.strip(),
-                    "omni_notes": st.session_state.omni_notes_pasted.strip(),
-                    "insight_payload": insight_dbg,
-                    "verbosity_level": st.session_state.get("verbosity_level", "Standard"),
-                }
+            # Persist edits back
+            insight_obj["data_signals"] = ds
+            insight_obj["work_context"] = wc
+            insight_obj["screenshot_summaries"] = screenshot_summaries
+            st.session_state.insight_current = insight_obj
 
-                st.markdown("#### Full JSON payload (drafting input)")
-                st.download_button(
-                    "Download full payload JSON",
-                    data=json.dumps(full_payload_dbg, indent=2, ensure_ascii=False).encode("utf-8"),
-                    file_name="monthly_report_payload.json",
-                    mime="application/json",
-                    key=f"dl_full_payload_{st.session_state.editor_nonce}",
-                )
-                st.json(full_payload_dbg)
-
-        # Persist edits back
-        insight_obj["data_signals"] = ds
-        insight_obj["work_context"] = wc
-        insight_obj["screenshot_summaries"] = screenshot_summaries
-        st.session_state.insight_current = insight_obj
-
-    st.divider()
-    st.markdown("## Report Draft")
-    with st.expander("Report Draft", expanded=True):
-        st.caption("Configure generation settings, then generate a draft using the full edited evidence payload.")
-
-        model = st.text_input("Model", value=st.session_state.model)
-        st.session_state.model = model.strip() or st.session_state.model
-
-        st.session_state.show_raw = st.toggle("Show GPT output (troubleshooting)", value=bool(st.session_state.show_raw))
-        st.radio(
-            "Email length",
-            ["Quick scan", "Standard", "Deep dive"],
-            key="verbosity_level",
-            help="Quick scan is ultra brief. Standard adds more context. Deep dive is the most detailed within the same sections (no extra sections).",
-        )
+        st.divider()
+        st.markdown("## Report Draft")
+        with st.expander("Report Draft", expanded=True):
+            st.caption("Configure generation settings, then generate a draft using the full edited evidence payload.")
+
+            model = st.text_input("Model", value=st.session_state.model)
+            st.session_state.model = model.strip() or st.session_state.model
+
+            st.session_state.show_raw = st.toggle("Show GPT output (troubleshooting)", value=bool(st.session_state.show_raw))
+            st.radio(
+                "Email length",
+                ["Quick scan", "Standard", "Deep dive"],
+                key="verbosity_level",
+                help="Quick scan is ultra brief. Standard adds more context. Deep dive is the most detailed within the same sections (no extra sections).",
+            )
 
 
-        # --- Special Instructions (Optional) ---
-        # Applied at draft time as highest-priority guidance.
-        st.markdown("**Special Instructions (Optional)**")
-        si_cols = st.columns([6, 2])
-        with si_cols[0]:
-            st.text_area(
-                "special_instructions_input_label",
-                placeholder="""Examples:
+            # --- Special Instructions (Optional) ---
+            # Applied at draft time as highest-priority guidance.
+            st.markdown("**Special Instructions (Optional)**")
+            si_cols = st.columns([6, 2])
+            with si_cols[0]:
+                st.text_area(
+                    "special_instructions_input_label",
+                    placeholder="""Examples:
         - Don’t mention [topic] in the email.
         - Don’t mention [topic] in Wins & Progress.
         - Add 2 additional KPI's you think are valuable to the client in Main KPI's.
         - Capitalize all peoples names.
         - Place this sentence in Key Highlights: ...""",
-                key="special_instructions",
-                height=150,
-                label_visibility="collapsed",
-            )
-        with si_cols[1]:
-            def _si_clear():
-                st.session_state.special_instructions = ""
-
-            st.button(
-                "Clear",
-                key="special_instructions_clear_btn",
-                on_click=_si_clear,
-                type="secondary",
-                use_container_width=True,
-            )
+                    key="special_instructions",
+                    height=150,
+                    label_visibility="collapsed",
+                )
+            with si_cols[1]:
+                def _si_clear():
+                    st.session_state.special_instructions = ""
+
+                st.button(
+                    "Clear",
+                    key="special_instructions_clear_btn",
+                    on_click=_si_clear,
+                    type="secondary",
+                    use_container_width=True,
+                )
 
-        # Generate draft button
-        if st.button("Generate draft", type="primary", use_container_width=True):
-            client = OpenAI(api_key=api_key)
+            # Generate draft button
+            if st.button("Generate draft", type="primary", use_container_width=True):
+                client = OpenAI(api_key=api_key)
 
-            # Collect screenshots
-            image_triplets: List[Tuple[str, bytes, str]] = []
-            for f in (st.session_state.uploaded_files or []):
-                fn = f.name
-                low = fn.lower()
-                if low.endswith((".png", ".jpg", ".jpeg")):
-                    b = f.getvalue()
-                    mime = "image/png" if low.endswith(".png") else "image/jpeg"
-                    image_triplets.append((fn, b, mime))
+                # Collect screenshots
+                image_triplets: List[Tuple[str, bytes, str]] = []
+                for f in (st.session_state.uploaded_files or []):
+                    fn = f.name
+                    low = fn.lower()
+                    if low.endswith((".png", ".jpg", ".jpeg")):
+                        b = f.getvalue()
+                        mime = "image/png" if low.endswith(".png") else "image/jpeg"
+                        image_triplets.append((fn, b, mime))
 
-            insight_for_prompt = st.session_state.insight_current
-
-            payload = {
-                "client_name": st.session_state.client_name.strip(),
-                "website": st.session_state.website.strip(),
-                "month_label": st.session_state.month_label.strip(),
-                "dashthis_url": st.session_state.dashthis_url.strip(),
-                "omni_notes": st.session_state.omni_notes_pasted.strip(),
-                "insight_payload": insight_for_prompt,
-                "verbosity_level": st.session_state.verbosity_level,
-                "special_instructions": (st.session_state.get("special_instructions") or "").strip(),
-            }
+                insight_for_prompt = st.session_state.insight_current
 
-            with st.spinner("Generating draft..."):
-                email_json, raw = generate_monthly_email_draft(client=client, model=st.session_state.model, payload=payload, image_triplets=image_triplets)
-
-            st.session_state.email_json = email_json or {}
-            st.session_state.raw = raw or ""
-
-            # Seed screenshot placement/captions suggestions
-            for item in (st.session_state.email_json.get("image_captions") or []):
-                fn = (item.get("file_name") or "").strip()
-                if fn:
-                    suggested = (item.get("suggested_section") or "").strip()
-                    allowed_secs = {"key_highlights","main_kpis","wins_progress","blockers","completed_tasks","outstanding_tasks"}
-                    if suggested not in allowed_secs:
-                        suggested = "key_highlights"
-                    st.session_state.image_assignments.setdefault(fn, suggested)
-                    st.session_state.image_captions.setdefault(fn, item.get("caption") or "")
-    data = st.session_state.email_json or {}
-    if data:
-        st.markdown("### Draft (editable)")
-
-
-        # Keep the top of the page simple: subject + overview, with the rest in an expander.
-        subject = st.text_input("Subject", value=data.get("subject", ""))
-        monthly_overview = st.text_area("Monthly overview", value=data.get("monthly_overview", ""), height=120)
-
-        with st.expander("Edit sections", expanded=True):
-            key_highlights = st.text_area("Key highlights", value="\n".join(data.get("key_highlights") or []), height=150)
-            main_kpis = st.text_area("Main KPI's", value="\n".join(data.get("main_kpis") or []), height=140)
-
-            # Top Opportunities (editable). Defaults from GPT output; if missing, derives from Insight Model opportunities.
-            _top_opps_seed = data.get("top_opportunities") or {}
-            if not (isinstance(_top_opps_seed, dict) and (_top_opps_seed.get("queries") or _top_opps_seed.get("pages"))):
-                _top_opps_seed = _derive_top_opportunities_from_insight(st.session_state.get("insight_current") or {}, max_items=5)
-
-            st.markdown("**Top Opportunities**")
-            top_opps_queries_text = st.text_area(
-                "Queries (Top 5)",
-                value="\n".join((_top_opps_seed.get("queries") or [])[:5]),
-                height=110,
-            )
-            top_opps_pages_text = st.text_area(
-                "Pages (Top 5)",
-                value="\n".join((_top_opps_seed.get("pages") or [])[:5]),
-                height=110,
-            )
-            wins_progress = st.text_area("Wins & progress", value="\n".join(data.get("wins_progress") or []), height=170)
-            blockers = st.text_area("Blockers / risks", value="\n".join(data.get("blockers") or []), height=140)
-            completed_tasks = st.text_area("Completed tasks", value="\n".join(data.get("completed_tasks") or []), height=170)
-            outstanding_tasks = st.text_area("Outstanding tasks", value="\n".join(data.get("outstanding_tasks") or []), height=170)
-            dashthis_line = st.text_area("DashThis line", value=data.get("dashthis_line", ""), height=70)
+                payload = {
+                    "client_name": st.session_state.client_name.strip(),
+                    "website": st.session_state.website.strip(),
+                    "month_label": st.session_state.month_label.strip(),
+                    "dashthis_url": st.session_state.dashthis_url.strip(),
+                    "omni_notes": st.session_state.omni_notes_pasted.strip(),
+                    "insight_payload": insight_for_prompt,
+                    "verbosity_level": st.session_state.verbosity_level,
+                    "special_instructions": (st.session_state.get("special_instructions") or "").strip(),
+                }
 
-            st.divider()
-            st.subheader("Screenshots Placement")
-            imgs = [f for f in (st.session_state.uploaded_files or []) if f.name.lower().endswith((".png",".jpg",".jpeg"))]
-            if not imgs:
-                st.caption("No screenshots uploaded.")
-            else:
-                with st.expander("Optional: adjust screenshot placement / captions", expanded=False):
-                    st.caption("By default, the app will place screenshots automatically. Use this only if you want to override placement or edit captions.")
-                    section_options = ["key_highlights","main_kpis","wins_progress","blockers","completed_tasks","outstanding_tasks"]
-                    for f in imgs:
-                        fn = f.name
-                        a, b, c = st.columns([2.2, 1.1, 2.3])
-                        with a:
-                            st.write(fn)
-                        with b:
-                            current = st.session_state.image_assignments.get(fn)
-                            if current not in section_options:
-                                current = section_options[0]
-                            sel = st.selectbox(
-                                "Section",
-                                section_options,
-                                index=section_options.index(current),
-                                key=f"assign_{fn}",
-                            )
-                            st.session_state.image_assignments[fn] = sel
+                with st.spinner("Generating draft..."):
+                    email_json, raw = generate_monthly_email_draft(client=client, model=st.session_state.model, payload=payload, image_triplets=image_triplets)
+
+                st.session_state.email_json = email_json or {}
+                st.session_state.raw = raw or ""
+
+                # Seed screenshot placement/captions suggestions
+                for item in (st.session_state.email_json.get("image_captions") or []):
+                    fn = (item.get("file_name") or "").strip()
+                    if fn:
+                        suggested = (item.get("suggested_section") or "").strip()
+                        allowed_secs = {"key_highlights","main_kpis","wins_progress","blockers","completed_tasks","outstanding_tasks"}
+                        if suggested not in allowed_secs:
+                            suggested = "key_highlights"
+                        st.session_state.image_assignments.setdefault(fn, suggested)
+                        st.session_state.image_captions.setdefault(fn, item.get("caption") or "")
+        data = st.session_state.email_json or {}
+        if data:
+            st.markdown("### Draft (editable)")
+
+
+            # Keep the top of the page simple: subject + overview, with the rest in an expander.
+            subject = st.text_input("Subject", value=data.get("subject", ""))
+            monthly_overview = st.text_area("Monthly overview", value=data.get("monthly_overview", ""), height=120)
+
+            with st.expander("Edit sections", expanded=True):
+                key_highlights = st.text_area("Key highlights", value="\n".join(data.get("key_highlights") or []), height=150)
+                main_kpis = st.text_area("Main KPI's", value="\n".join(data.get("main_kpis") or []), height=140)
+
+                # Top Opportunities (editable). Defaults from GPT output; if missing, derives from Insight Model opportunities.
+                _top_opps_seed = data.get("top_opportunities") or {}
+                if not (isinstance(_top_opps_seed, dict) and (_top_opps_seed.get("queries") or _top_opps_seed.get("pages"))):
+                    _top_opps_seed = _derive_top_opportunities_from_insight(st.session_state.get("insight_current") or {}, max_items=5)
+
+                st.markdown("**Top Opportunities**")
+                top_opps_queries_text = st.text_area(
+                    "Queries (Top 5)",
+                    value="\n".join((_top_opps_seed.get("queries") or [])[:5]),
+                    height=110,
+                )
+                top_opps_pages_text = st.text_area(
+                    "Pages (Top 5)",
+                    value="\n".join((_top_opps_seed.get("pages") or [])[:5]),
+                    height=110,
+                )
+                wins_progress = st.text_area("Wins & progress", value="\n".join(data.get("wins_progress") or []), height=170)
+                blockers = st.text_area("Blockers / risks", value="\n".join(data.get("blockers") or []), height=140)
+                completed_tasks = st.text_area("Completed tasks", value="\n".join(data.get("completed_tasks") or []), height=170)
+                outstanding_tasks = st.text_area("Outstanding tasks", value="\n".join(data.get("outstanding_tasks") or []), height=170)
+                dashthis_line = st.text_area("DashThis line", value=data.get("dashthis_line", ""), height=70)
+
+                st.divider()
+                st.subheader("Screenshots Placement")
+                imgs = [f for f in (st.session_state.uploaded_files or []) if f.name.lower().endswith((".png",".jpg",".jpeg"))]
+                if not imgs:
+                    st.caption("No screenshots uploaded.")
+                else:
+                    with st.expander("Optional: adjust screenshot placement / captions", expanded=False):
+                        st.caption("By default, the app will place screenshots automatically. Use this only if you want to override placement or edit captions.")
+                        section_options = ["key_highlights","main_kpis","wins_progress","blockers","completed_tasks","outstanding_tasks"]
+                        for f in imgs:
+                            fn = f.name
+                            a, b, c = st.columns([2.2, 1.1, 2.3])
+                            with a:
+                                st.write(fn)
+                            with b:
+                                current = st.session_state.image_assignments.get(fn)
+                                if current not in section_options:
+                                    current = section_options[0]
+                                sel = st.selectbox(
+                                    "Section",
+                                    section_options,
+                                    index=section_options.index(current),
+                                    key=f"assign_{fn}",
+                                )
+                                st.session_state.image_assignments[fn] = sel
     
-                        with c:
-                            cap = st.text_input("Caption", value=st.session_state.image_captions.get(fn,""), key=f"cap_{fn}")
-                            st.session_state.image_captions[fn] = cap
-
-            def _lines(s: str) -> List[str]:
-                return [x.strip() for x in (s or "").splitlines() if x.strip()]
-
-            highlights_list = _lines(key_highlights)
-            main_kpis_list = _lines(main_kpis)
-            wins_list = _lines(wins_progress)
-            blockers_list = _lines(blockers)
-            completed_list = _lines(completed_tasks)
-            outstanding_list = _lines(outstanding_tasks)
-
-            sec_high = section_block("Key highlights", bullets_to_html(highlights_list))
-            # Top Opportunities (additive): use editor values; safe defaults to empty.
-            top_opps = {
-                "queries": _lines(top_opps_queries_text)[:5],
-                "pages": _lines(top_opps_pages_text)[:5],
-            }
-            try:
-                st.session_state.email_json["top_opportunities"] = copy.deepcopy(top_opps)
-            except Exception:
-                pass
-
-            # Standalone Top Opportunities section HTML (for templates that support a dedicated placeholder).
-            sec_top_opps = ""
-            try:
-                _q = top_opps.get("queries") or []
-                _p = top_opps.get("pages") or []
-                _q = [str(x).strip() for x in _q if str(x).strip()][:5]
-                _p = [str(x).strip() for x in _p if str(x).strip()][:5]
-                if _q or _p:
-                    _parts = []
-                    if _q:
-                        _parts.append('<div style="font-weight:700;margin:0 0 6px 0;">Queries (Top 5)</div>')
-                        _parts.append(bullets_to_html(_q))
-                    if _p:
-                        _parts.append('<div style="font-weight:700;margin:12px 0 6px 0;">Pages (Top 5)</div>')
-                        _parts.append(bullets_to_html(_p))
-                    sec_top_opps = section_block("Top Opportunities", "\n".join(_parts))
-            except Exception:
-                sec_top_opps = ""
-
-            # Main KPI's section: KPIs only (Top Opportunities is rendered as its own section when supported).
-            sec_kpis = section_block("Main KPI\'s", bullets_to_html(main_kpis_list))
-
-            sec_wins = section_block("Wins & progress", bullets_to_html(wins_list))
-            sec_blk = section_block("Blockers / risks", bullets_to_html(blockers_list))
-            sec_done = section_block("Completed tasks", bullets_to_html(completed_list))
-            sec_next = section_block("Outstanding / rolling", bullets_to_html(outstanding_list))
-
-            # Build CID map for all uploaded images (even if not placed, .eml can include; HTML will only reference placed)
-            uploaded_map = {f.name: f.getvalue() for f in (st.session_state.uploaded_files or []) if f.name.lower().endswith((".png",".jpg",".jpeg"))}
-            cids: Dict[str,str] = {}
-            image_parts: List[Tuple[str, bytes]] = []
-            image_mimes: Dict[str, str] = {}
-            for i, fn in enumerate(sorted(uploaded_map.keys())):
-                cid = f"img{i+1}"
-                cids[fn] = cid
-                image_parts.append((cid, uploaded_map[fn]))
-                ext = fn.lower().rsplit(".", 1)[-1]
-                image_mimes[cid] = "image/png" if ext == "png" else "image/jpeg"
-
-            def append_images(section_html: str, section_key: str) -> str:
-                out = [section_html] if section_html else []
-                for fn, sec in st.session_state.image_assignments.items():
-                    if sec == section_key and fn in cids:
-                        out.append(image_block(cids[fn], st.session_state.image_captions.get(fn,"")))
-                return "\n".join([x for x in out if x])
-
-            sec_high = append_images(sec_high, "key_highlights")
-            sec_kpis = append_images(sec_kpis, "main_kpis")
-            sec_wins = append_images(sec_wins, "wins_progress")
-            sec_blk = append_images(sec_blk, "blockers")
-            sec_done = append_images(sec_done, "completed_tasks")
-            sec_next = append_images(sec_next, "outstanding_tasks")
-
-
-            # Greeting block (optional): salutation + opening line (both editable)
-            rec = (st.session_state.get("recipient_first_name") or "").strip()
-            opener = (st.session_state.get("opening_line") or "").strip()
-            greeting_parts = []
-            if rec:
-                greeting_parts.append(f'<div style="margin:0 0 6px 0;">Hi {html_escape(rec)},</div>')
-            if opener:
-                greeting_parts.append(f'<div style="margin:0 0 12px 0;">{html_escape(opener)}</div>')
-            greeting_block_html = "\n".join(greeting_parts) if greeting_parts else ""
-
-            # Signature block (optional) appended at bottom of email
-            signature_choice = st.session_state.get("signature_choice", "None")
-            signature_block_html = render_signature_html(signature_choice)
-
-            # If a signature is selected, embed the signature logo as an inline CID image so it renders in Outlook and Preview.
-            if signature_choice and signature_choice != "None" and signature_block_html:
+                            with c:
+                                cap = st.text_input("Caption", value=st.session_state.image_captions.get(fn,""), key=f"cap_{fn}")
+                                st.session_state.image_captions[fn] = cap
+
+                def _lines(s: str) -> List[str]:
+                    return [x.strip() for x in (s or "").splitlines() if x.strip()]
+
+                highlights_list = _lines(key_highlights)
+                main_kpis_list = _lines(main_kpis)
+                wins_list = _lines(wins_progress)
+                blockers_list = _lines(blockers)
+                completed_list = _lines(completed_tasks)
+                outstanding_list = _lines(outstanding_tasks)
+
+                sec_high = section_block("Key highlights", bullets_to_html(highlights_list))
+                # Top Opportunities (additive): use editor values; safe defaults to empty.
+                top_opps = {
+                    "queries": _lines(top_opps_queries_text)[:5],
+                    "pages": _lines(top_opps_pages_text)[:5],
+                }
                 try:
-                    _sig_b64 = (SIGNATURE_LOGO_PNG_B64 or "").strip().replace("\n", "")
-                    _sig_bytes = base64.b64decode(_sig_b64)
-                    # Avoid duplicates if rerun
-                    if not any(cid == "sig_logo" for cid, _ in image_parts):
-                        image_parts.append(("sig_logo", _sig_bytes))
-                        image_mimes["sig_logo"] = "image/png"
+                    st.session_state.email_json["top_opportunities"] = copy.deepcopy(top_opps)
                 except Exception:
-                    # Fail quietly: signature will render without the logo rather than breaking generation/export.
                     pass
 
-            # Template compatibility: some templates include an explicit Top Opportunities placeholder.
-            # If missing, append the Top Opportunities section directly after Main KPI's.
-            _main_kpis_block = sec_kpis
-            if "{{SECTION_TOP_OPPORTUNITIES}}" not in TEMPLATE_HTML:
-                _main_kpis_block = sec_kpis + "\n" + sec_top_opps
-
-
-            html_out = (TEMPLATE_HTML
-                .replace("{{CLIENT_NAME}}", html_escape(st.session_state.client_name.strip() or "Client"))
-                .replace("{{MONTH_LABEL}}", html_escape(st.session_state.month_label.strip() or "Monthly"))
-                .replace("{{WEBSITE}}", html_escape(st.session_state.website.strip() or ""))
-                .replace("{{GREETING_BLOCK}}", greeting_block_html)
-                .replace("{{SIGNATURE_BLOCK}}", signature_block_html)
-                .replace("{{MONTHLY_OVERVIEW}}", html_escape(monthly_overview or ""))
-                .replace("{{DASHTHIS_URL}}", html_escape(st.session_state.dashthis_url.strip() or ""))
-                .replace("{{DASHTHIS_LINE}}", html_escape(dashthis_line or ""))
-                .replace("{{SECTION_KEY_HIGHLIGHTS}}", sec_high)
-                .replace("{{SECTION_MAIN_KPIS}}", _main_kpis_block)
-                .replace("{{SECTION_TOP_OPPORTUNITIES}}", sec_top_opps)
-                .replace("{{SECTION_WINS_PROGRESS}}", sec_wins)
-                .replace("{{SECTION_BLOCKERS}}", sec_blk)
-                .replace("{{SECTION_COMPLETED_TASKS}}", sec_done)
-                .replace("{{SECTION_OUTSTANDING_TASKS}}", sec_next)
-            )
+                # Standalone Top Opportunities section HTML (for templates that support a dedicated placeholder).
+                sec_top_opps = ""
+                try:
+                    _q = top_opps.get("queries") or []
+                    _p = top_opps.get("pages") or []
+                    _q = [str(x).strip() for x in _q if str(x).strip()][:5]
+                    _p = [str(x).strip() for x in _p if str(x).strip()][:5]
+                    if _q or _p:
+                        _parts = []
+                        if _q:
+                            _parts.append('<div style="font-weight:700;margin:0 0 6px 0;">Queries (Top 5)</div>')
+                            _parts.append(bullets_to_html(_q))
+                        if _p:
+                            _parts.append('<div style="font-weight:700;margin:12px 0 6px 0;">Pages (Top 5)</div>')
+                            _parts.append(bullets_to_html(_p))
+                        sec_top_opps = section_block("Top Opportunities", "\n".join(_parts))
+                except Exception:
+                    sec_top_opps = ""
+
+                # Main KPI's section: KPIs only (Top Opportunities is rendered as its own section when supported).
+                sec_kpis = section_block("Main KPI\'s", bullets_to_html(main_kpis_list))
+
+                sec_wins = section_block("Wins & progress", bullets_to_html(wins_list))
+                sec_blk = section_block("Blockers / risks", bullets_to_html(blockers_list))
+                sec_done = section_block("Completed tasks", bullets_to_html(completed_list))
+                sec_next = section_block("Outstanding / rolling", bullets_to_html(outstanding_list))
+
+                # Build CID map for all uploaded images (even if not placed, .eml can include; HTML will only reference placed)
+                uploaded_map = {f.name: f.getvalue() for f in (st.session_state.uploaded_files or []) if f.name.lower().endswith((".png",".jpg",".jpeg"))}
+                cids: Dict[str,str] = {}
+                image_parts: List[Tuple[str, bytes]] = []
+                image_mimes: Dict[str, str] = {}
+                for i, fn in enumerate(sorted(uploaded_map.keys())):
+                    cid = f"img{i+1}"
+                    cids[fn] = cid
+                    image_parts.append((cid, uploaded_map[fn]))
+                    ext = fn.lower().rsplit(".", 1)[-1]
+                    image_mimes[cid] = "image/png" if ext == "png" else "image/jpeg"
+
+                def append_images(section_html: str, section_key: str) -> str:
+                    out = [section_html] if section_html else []
+                    for fn, sec in st.session_state.image_assignments.items():
+                        if sec == section_key and fn in cids:
+                            out.append(image_block(cids[fn], st.session_state.image_captions.get(fn,"")))
+                    return "\n".join([x for x in out if x])
+
+                sec_high = append_images(sec_high, "key_highlights")
+                sec_kpis = append_images(sec_kpis, "main_kpis")
+                sec_wins = append_images(sec_wins, "wins_progress")
+                sec_blk = append_images(sec_blk, "blockers")
+                sec_done = append_images(sec_done, "completed_tasks")
+                sec_next = append_images(sec_next, "outstanding_tasks")
+
+
+                # Greeting block (optional): salutation + opening line (both editable)
+                rec = (st.session_state.get("recipient_first_name") or "").strip()
+                opener = (st.session_state.get("opening_line") or "").strip()
+                greeting_parts = []
+                if rec:
+                    greeting_parts.append(f'<div style="margin:0 0 6px 0;">Hi {html_escape(rec)},</div>')
+                if opener:
+                    greeting_parts.append(f'<div style="margin:0 0 12px 0;">{html_escape(opener)}</div>')
+                greeting_block_html = "\n".join(greeting_parts) if greeting_parts else ""
+
+                # Signature block (optional) appended at bottom of email
+                signature_choice = st.session_state.get("signature_choice", "None")
+                signature_block_html = render_signature_html(signature_choice)
+
+                # If a signature is selected, embed the signature logo as an inline CID image so it renders in Outlook and Preview.
+                if signature_choice and signature_choice != "None" and signature_block_html:
+                    try:
+                        _sig_b64 = (SIGNATURE_LOGO_PNG_B64 or "").strip().replace("\n", "")
+                        _sig_bytes = base64.b64decode(_sig_b64)
+                        # Avoid duplicates if rerun
+                        if not any(cid == "sig_logo" for cid, _ in image_parts):
+                            image_parts.append(("sig_logo", _sig_bytes))
+                            image_mimes["sig_logo"] = "image/png"
+                    except Exception:
+                        # Fail quietly: signature will render without the logo rather than breaking generation/export.
+                        pass
 
-            eml_bytes = build_eml(subject, html_out, image_parts)
-            # Validate EML bytes for Streamlit download_button (must be bytes-like)
-            if not isinstance(eml_bytes, (bytes, bytearray)) or len(eml_bytes) == 0:
-                # Keep None so the download button can be conditionally hidden.
-                eml_bytes = None
-
-            # Build a preview-friendly HTML where cid: images are replaced with data URIs.
-            preview_html = html_out
-            for cid, b in image_parts:
-                mime = image_mimes.get(cid, "image/png")
-                data_uri = f"data:{mime};base64," + base64.b64encode(b).decode("utf-8")
-                preview_html = preview_html.replace(f"cid:{cid}", data_uri)
-            with st.expander("Preview HTML"):
-                st.components.v1.html(preview_html, height=600, scrolling=True)
-        st.divider()
-        with st.container(border=True):
-            st.subheader("Export")
+                # Template compatibility: some templates include an explicit Top Opportunities placeholder.
+                # If missing, append the Top Opportunities section directly after Main KPI's.
+                _main_kpis_block = sec_kpis
+                if "{{SECTION_TOP_OPPORTUNITIES}}" not in TEMPLATE_HTML:
+                    _main_kpis_block = sec_kpis + "\n" + sec_top_opps
+
+
+                html_out = (TEMPLATE_HTML
+                    .replace("{{CLIENT_NAME}}", html_escape(st.session_state.client_name.strip() or "Client"))
+                    .replace("{{MONTH_LABEL}}", html_escape(st.session_state.month_label.strip() or "Monthly"))
+                    .replace("{{WEBSITE}}", html_escape(st.session_state.website.strip() or ""))
+                    .replace("{{GREETING_BLOCK}}", greeting_block_html)
+                    .replace("{{SIGNATURE_BLOCK}}", signature_block_html)
+                    .replace("{{MONTHLY_OVERVIEW}}", html_escape(monthly_overview or ""))
+                    .replace("{{DASHTHIS_URL}}", html_escape(st.session_state.dashthis_url.strip() or ""))
+                    .replace("{{DASHTHIS_LINE}}", html_escape(dashthis_line or ""))
+                    .replace("{{SECTION_KEY_HIGHLIGHTS}}", sec_high)
+                    .replace("{{SECTION_MAIN_KPIS}}", _main_kpis_block)
+                    .replace("{{SECTION_TOP_OPPORTUNITIES}}", sec_top_opps)
+                    .replace("{{SECTION_WINS_PROGRESS}}", sec_wins)
+                    .replace("{{SECTION_BLOCKERS}}", sec_blk)
+                    .replace("{{SECTION_COMPLETED_TASKS}}", sec_done)
+                    .replace("{{SECTION_OUTSTANDING_TASKS}}", sec_next)
+                )
 
-            # Filenames (computed locally to avoid Streamlit rerun scope issues)
-            _client_name_for_files = (st.session_state.get("client_name") or "").strip()
-            _safe_client_name = re.sub(r"[^A-Za-z0-9]+", "", _client_name_for_files) or "monthly"
+                eml_bytes = build_eml(subject, html_out, image_parts)
+                # Validate EML bytes for Streamlit download_button (must be bytes-like)
+                if not isinstance(eml_bytes, (bytes, bytearray)) or len(eml_bytes) == 0:
+                    # Keep None so the download button can be conditionally hidden.
+                    eml_bytes = None
+
+                # Build a preview-friendly HTML where cid: images are replaced with data URIs.
+                preview_html = html_out
+                for cid, b in image_parts:
+                    mime = image_mimes.get(cid, "image/png")
+                    data_uri = f"data:{mime};base64," + base64.b64encode(b).decode("utf-8")
+                    preview_html = preview_html.replace(f"cid:{cid}", data_uri)
+                with st.expander("Preview HTML"):
+                    st.components.v1.html(preview_html, height=600, scrolling=True)
+            st.divider()
+            with st.container(border=True):
+                st.subheader("Export")
 
-            _month_label_for_files = (st.session_state.get("month_label") or "").strip()
-            _safe_month_label = re.sub(r"\s+", "-", _month_label_for_files)
-            _safe_month_label = re.sub(r"[^A-Za-z0-9\-]+", "", _safe_month_label) or "Month"
+                # Filenames (computed locally to avoid Streamlit rerun scope issues)
+                _client_name_for_files = (st.session_state.get("client_name") or "").strip()
+                _safe_client_name = re.sub(r"[^A-Za-z0-9]+", "", _client_name_for_files) or "monthly"
 
-            eml_filename = f"{_safe_client_name}-seo-update.eml"
-            pdf_filename = f"{_safe_client_name}-Monthly-SEO-Report-{_safe_month_label}.pdf"
+                _month_label_for_files = (st.session_state.get("month_label") or "").strip()
+                _safe_month_label = re.sub(r"\s+", "-", _month_label_for_files)
+                _safe_month_label = re.sub(r"[^A-Za-z0-9\-]+", "", _safe_month_label) or "Month"
 
-            col_eml, col_pdf = st.columns(2)
-            with col_eml:
-                if isinstance(eml_bytes, (bytes, bytearray)) and len(eml_bytes) > 0:
-                    st.download_button(
-                        "Download .eml (Outlook-ready)",
-                        data=eml_bytes,
-                        file_name=eml_filename,
-                        mime="message/rfc822",
-                    )
-                else:
-                    st.info("EML export unavailable for this draft (no valid EML bytes were produced). Try regenerating the draft or removing problematic images.")
+                eml_filename = f"{_safe_client_name}-seo-update.eml"
+                pdf_filename = f"{_safe_client_name}-Monthly-SEO-Report-{_safe_month_label}.pdf"
 
-            with col_pdf:
-                if PLAYWRIGHT_AVAILABLE:
-                    try:
-                        pdf_bytes = html_to_pdf_bytes(preview_html)
+                col_eml, col_pdf = st.columns(2)
+                with col_eml:
+                    if isinstance(eml_bytes, (bytes, bytearray)) and len(eml_bytes) > 0:
                         st.download_button(
-                            "Download PDF",
-                            data=pdf_bytes,
-                            file_name=pdf_filename,
-                            mime="application/pdf",
+                            "Download .eml (Outlook-ready)",
+                            data=eml_bytes,
+                            file_name=eml_filename,
+                            mime="message/rfc822",
                         )
-                    except Exception as _pdf_exc:
-                        st.caption(f"PDF export unavailable: {_pdf_exc}")
-                else:
-                    st.caption("PDF export unavailable (Playwright/Chromium not installed).")
+                    else:
+                        st.info("EML export unavailable for this draft (no valid EML bytes were produced). Try regenerating the draft or removing problematic images.")
+
+                with col_pdf:
+                    if PLAYWRIGHT_AVAILABLE:
+                        try:
+                            pdf_bytes = html_to_pdf_bytes(preview_html)
+                            st.download_button(
+                                "Download PDF",
+                                data=pdf_bytes,
+                                file_name=pdf_filename,
+                                mime="application/pdf",
+                            )
+                        except Exception as _pdf_exc:
+                            st.caption(f"PDF export unavailable: {_pdf_exc}")
+                    else:
+                        st.caption("PDF export unavailable (Playwright/Chromium not installed).")
 
-            with st.expander("Copy/paste HTML (optional)"):
-                st.code(html_out, language="html")
+                with st.expander("Copy/paste HTML (optional)"):
+                    st.code(html_out, language="html")
 
-    if st.session_state.show_raw and st.session_state.raw:
-            with st.expander("GPT output (raw)"):
-                st.code(st.session_state.raw)
\ No newline at end of file
+        if st.session_state.show_raw and st.session_state.raw:
+                with st.expander("GPT output (raw)"):
+                    st.code(st.session_state.raw)
\ No newline at end of file